@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from compute_token_lengths import MIN_PIXELS, smart_resize
+from dedup_datasets import get_image_paths
+
+CACHE_VERSION = 2
+JPEG_QUALITY = 95
+TRAIN_MAX_PIXELS = 1280 * 28 * 28  # MAX_PIXELS of the training and evaluation runs (eval/tmp.sh)
+INDEX_FILE = 'index.json'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def iter_unique_images(input_files):
+    """Unique non-empty image paths referenced by JSONL files, in first-seen order"""
+    seen = set()
+    for input_file in input_files:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for path in get_image_paths(json.loads(line)):
+                    if path and path not in seen:
+                        seen.add(path)
+                        yield path
+
+def cache_key(data, height, width, quality):
+    """Content hash of the source bytes and the output settings"""
+    h = hashlib.blake2b(data, digest_size=16)
+    h.update(f"{height}x{width}q{quality}".encode('ascii'))
+    return h.hexdigest()
+
+def output_format(data):
+    """File suffix of the cached copy: PNG sources stay lossless, everything else becomes JPEG"""
+    return '.png' if data[:8] == PNG_SIGNATURE else '.jpg'
+
+class ImageCache:
+    """
+    Pre-resized images keyed by content hash. Each source image is decoded
+    once, resized to the Qwen2.5-VL smart_resize size for the pixel budget
+    (multiples of 28, so the processor keeps it as is) and stored at
+    `<cache_dir>/<key[:2]>/<key>.jpg`, or `.png` for PNG sources, which are
+    kept lossless. index.json maps source paths to cached file names, with
+    size and mtime so unchanged files are not read again.
+    """
+    def __init__(self, cache_dir, min_pixels=MIN_PIXELS, max_pixels=TRAIN_MAX_PIXELS, quality=JPEG_QUALITY):
+        self.cache_dir = Path(cache_dir).resolve()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self.settings = {'version': CACHE_VERSION, 'min_pixels': min_pixels, 'max_pixels': max_pixels, 'quality': quality}
+        self.entries = {}  # source path -> [file name, size, mtime_ns, width, height]
+        index_path = self.cache_dir / INDEX_FILE
+        if index_path.exists():
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('settings') == self.settings:
+                self.entries = index['entries']
+
+    def path_of(self, name):
+        return self.cache_dir / name[:2] / name
+
+    def lookup(self, path):
+        """Cached file of a source path if it is indexed and unchanged, else None"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry[1] != stat.st_size or entry[2] != stat.st_mtime_ns or not self.path_of(entry[0]).exists():
+            return None
+        return str(self.path_of(entry[0]))
+
+    def add(self, path):
+        """Cache one image; returns (path, entry) or (path, None) if it cannot be read or decoded"""
+        import cv2
+        try:
+            stat = os.stat(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return path, None
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return path, None
+        height, width = image.shape[:2]
+        target_height, target_width = smart_resize(height, width, min_pixels=self.min_pixels, max_pixels=self.max_pixels)
+        suffix = output_format(data)
+        name = cache_key(data, target_height, target_width, self.quality if suffix == '.jpg' else 0) + suffix
+        target = self.path_of(name)
+        if not target.exists():
+            if (target_height, target_width) != (height, width):
+                shrink = target_height * target_width < height * width
+                image = cv2.resize(image, (target_width, target_height),
+                                   interpolation=cv2.INTER_AREA if shrink else cv2.INTER_CUBIC)
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality] if suffix == '.jpg' else []
+            ok, encoded = cv2.imencode(suffix, image, params)
+            if not ok:
+                return path, None
+            target.parent.mkdir(exist_ok=True)
+            # Write under a temporary name so concurrent builders never see a partial file
+            tmp = target.with_suffix(f".{os.getpid()}.{os.urandom(4).hex()}.tmp")
+            tmp.write_bytes(encoded.tobytes())
+            os.replace(tmp, target)
+        return path, [name, stat.st_size, stat.st_mtime_ns, target_width, target_height]
+
+    def build(self, paths, workers=8):
+        """Cache every path not already cached; returns (number cached, failed paths)"""
+        todo = [path for path in paths if self.lookup(path) is None]
+        failed = []
+        cached = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, entry in executor.map(self.add, todo, chunksize=64):
+                if entry is None:
+                    failed.append(path)
+                    self.entries.pop(path, None)
+                else:
+                    self.entries[path] = entry
+                    cached += 1
+        return cached, failed
+
+    def save(self):
+        index_path = self.cache_dir / INDEX_FILE
+        tmp = index_path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'settings': self.settings, 'entries': self.entries}, f)
+        os.replace(tmp, index_path)
+
+    def mapping(self):
+        """{source path: cached file} of all indexed images"""
+        return {path: str(self.path_of(entry[0])) for path, entry in self.entries.items()}
+
+def rewrite_paths(item, mapping):
+    """Point a record's images at the cache; returns the number of paths replaced"""
+    replaced = 0
+    images = item.get('images')
+    if images is None:
+        path = item.get('image_path')
+        if path in mapping:
+            item['image_path'] = mapping[path]
+            replaced += 1
+        return replaced
+    if isinstance(images, str):
+        if images in mapping:
+            item['images'] = mapping[images]
+            replaced += 1
+        return replaced
+    for i, image in enumerate(images):
+        if isinstance(image, str):
+            if image in mapping:
+                images[i] = mapping[image]
+                replaced += 1
+        elif image.get('path') in mapping:
+            image['path'] = mapping[image['path']]
+            replaced += 1
+    return replaced
+
+def rewrite_jsonl(input_file, output_file, mapping):
+    """Copy a JSONL file with image paths replaced by their cached files; returns (records, replaced paths)"""
+    records = 0
+    replaced = 0
+    with open(input_file, 'r', encoding='utf-8') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
+        for line in f_in:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            replaced += rewrite_paths(item, mapping)
+            f_out.write(json.dumps(item, ensure_ascii=False) + '\n')
+            records += 1
+    return records, replaced
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-resize the images of task JSONL files into a content-addressed cache and rewrite the files to use it')
+    parser.add_argument('--inputs', nargs='+', required=True, help='Task or merged JSONL files')
+    parser.add_argument('--cache_dir', required=True, help='Directory of the image cache')
+    parser.add_argument('--output_dir', default=None, help='Write copies of the inputs pointing at the cache here (same file names)')
+    parser.add_argument('--workers', type=int, default=8, help='Decode/resize threads (default: 8)')
+    parser.add_argument('--quality', type=int, default=JPEG_QUALITY, help=f'JPEG quality of cached images; PNG sources stay PNG (default: {JPEG_QUALITY})')
+    parser.add_argument('--min_pixels', type=int, default=int(os.environ.get('MIN_PIXELS', MIN_PIXELS)), help='Processor min_pixels (default: $MIN_PIXELS or 3136)')
+    parser.add_argument('--max_pixels', type=int, default=int(os.environ.get('MAX_PIXELS', TRAIN_MAX_PIXELS)), help=f'Processor max_pixels; must match training (default: $MAX_PIXELS or {TRAIN_MAX_PIXELS})')
+    args = parser.parse_args()
+
+    cache = ImageCache(args.cache_dir, args.min_pixels, args.max_pixels, args.quality)
+    paths = list(iter_unique_images(args.inputs))
+    cached, failed = cache.build(paths, args.workers)
+    cache.save()
+    print(f"Unique images: {len(paths)}")
+    print(f"Newly cached: {cached}, already cached: {len(paths) - cached - len(failed)}")
+    print(f"Missing or unreadable: {len(failed)}")
+    for path in failed[:10]:
+        print(f"  {path}")
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        mapping = cache.mapping()
+        for input_file in args.inputs:
+            output_file = os.path.join(args.output_dir, os.path.basename(input_file))
+            if os.path.abspath(output_file) == os.path.abspath(input_file):
+                parser.error(f"--output_dir would overwrite {input_file}")
+            records, replaced = rewrite_jsonl(input_file, output_file, mapping)
+            print(f"{output_file}: {records} records, {replaced} image paths rewritten")
+
+if __name__ == '__main__':
+    main()
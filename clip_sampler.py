@@ -0,0 +1,154 @@
+import argparse
+import copy
+import json
+import os
+import re
+
+import numpy as np
+
+from dedup_datasets import get_image_paths
+
+IMAGE_PLACEHOLDER = '<image>'
+FRAME_NUMBER = re.compile(r"(\d+)(?!.*\d)")
+VIDEO_SHIFT = 40  # frame numbers stay below 2**40
+
+def parse_frame(path):
+    """(video directory, frame number) of a frame path, or None without a number in the file name"""
+    match = FRAME_NUMBER.search(os.path.basename(path))
+    if match is None:
+        return None
+    return os.path.dirname(path), int(match.group(1))
+
+class FrameIndex:
+    """
+    Extracted frames of every video, from meta or task JSONL files. Frames
+    are sorted by (video, frame number) in one array with per-video offsets,
+    so a window around a frame is a binary search plus index arithmetic and
+    the frame directories are never listed. Strides count extracted frames,
+    so unevenly sampled videos (e.g. extract_frames_balanced.py) still give
+    K distinct frames.
+    """
+    def __init__(self, videos, offsets, frames, paths):
+        self.videos = list(videos)  # video directories
+        self.video_ids = {video: i for i, video in enumerate(self.videos)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.frames = np.asarray(frames, dtype=np.int64)
+        self.paths = list(paths)
+        video_of = np.repeat(np.arange(len(self.videos), dtype=np.int64), np.diff(self.offsets))
+        self.keys = (video_of << VIDEO_SHIFT) + self.frames
+
+    @classmethod
+    def build(cls, files):
+        videos = {}
+        for input_file in files:
+            with open(input_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    for path in get_image_paths(json.loads(line)):
+                        parsed = parse_frame(path) if path else None
+                        if parsed is not None:
+                            videos.setdefault(parsed[0], {}).setdefault(parsed[1], path)
+        names = sorted(videos)
+        offsets = [0]
+        frames, paths = [], []
+        for video in names:
+            for frame in sorted(videos[video]):
+                frames.append(frame)
+                paths.append(videos[video][frame])
+            offsets.append(len(frames))
+        return cls(names, offsets, frames, paths)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def locate(self, paths):
+        """Global frame positions of frame paths; -1 where the frame is not indexed"""
+        positions = np.full(len(paths), -1, dtype=np.int64)
+        keys = np.zeros(len(paths), dtype=np.int64)
+        known = np.zeros(len(paths), dtype=bool)
+        for i, path in enumerate(paths):
+            parsed = parse_frame(path) if path else None
+            video = self.video_ids.get(parsed[0]) if parsed else None
+            if video is not None:
+                keys[i] = (video << VIDEO_SHIFT) + parsed[1]
+                known[i] = True
+        found = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        hit = known & (len(self.keys) > 0)
+        hit[hit] = self.keys[found[hit]] == keys[hit]
+        positions[hit] = found[hit]
+        return positions
+
+    def windows(self, positions, k, stride=1, align='center'):
+        """
+        (N, k) global positions of k-frame windows at `stride` around each
+        position: centred on it, or ending at it for align='end' (causal
+        clips). Windows running past either end of a video repeat its
+        first or last frame.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        anchor = k // 2 if align == 'center' else k - 1
+        steps = (np.arange(k, dtype=np.int64) - anchor) * stride
+        video_of = np.searchsorted(self.offsets, positions, side='right') - 1
+        first = self.offsets[video_of]
+        last = self.offsets[video_of + 1] - 1
+        return np.clip(positions[:, None] + steps, first[:, None], last[:, None])
+
+    def clip_paths(self, window):
+        return [self.paths[i] for i in window]
+
+def make_clip_record(item, paths):
+    """
+    Copy of a single-image record using a clip: `images` becomes the clip
+    frames and the `<image>` placeholder is repeated once per frame. Meta
+    records keep `image_path` as the labelled frame.
+    """
+    clip = copy.deepcopy(item)
+    clip['images'] = list(paths)
+    for message in clip.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, str) and IMAGE_PLACEHOLDER in content:
+            message['content'] = content.replace(IMAGE_PLACEHOLDER, IMAGE_PLACEHOLDER * len(paths), 1)
+            break
+    return clip
+
+def sample_clips(input_file, output_file, index, k, stride=1, align='center'):
+    """Write the clip records of a JSONL file; returns (written, skipped) counts"""
+    with open(input_file, 'r', encoding='utf-8') as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    labelled = []
+    for item in items:
+        images = get_image_paths(item)
+        labelled.append(images[0] if len(images) == 1 else None)
+    positions = index.locate(labelled)
+    valid = np.flatnonzero(positions >= 0)
+    windows = index.windows(positions[valid], k, stride, align)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for i, window in zip(valid, windows):
+            f.write(json.dumps(make_clip_record(items[i], index.clip_paths(window)), ensure_ascii=False) + '\n')
+    return len(valid), len(items) - len(valid)
+
+def main():
+    parser = argparse.ArgumentParser(description='Turn single-frame records into K-frame clip records over the extracted frames')
+    parser.add_argument('--inputs', nargs='+', required=True, help='Single-image task or meta JSONL files')
+    parser.add_argument('--meta', nargs='+', default=None, help='Meta JSONL files listing every extracted frame (default: the inputs)')
+    parser.add_argument('--output_dir', required=True, help='Write the clip records here (same file names)')
+    parser.add_argument('--num_frames', '-k', type=int, default=8, help='Frames per clip (default: 8)')
+    parser.add_argument('--stride', type=int, default=1, help='Step between clip frames, in extracted frames (default: 1)')
+    parser.add_argument('--align', choices=['center', 'end'], default='center', help='Centre clips on the labelled frame, or end them there (default: center)')
+    args = parser.parse_args()
+    if args.num_frames < 1 or args.stride < 1:
+        parser.error('--num_frames and --stride must be positive')
+
+    index = FrameIndex.build(args.meta or args.inputs)
+    print(f"Indexed {len(index)} frames in {len(index.videos)} videos")
+    os.makedirs(args.output_dir, exist_ok=True)
+    for input_file in args.inputs:
+        output_file = os.path.join(args.output_dir, os.path.basename(input_file))
+        if os.path.abspath(output_file) == os.path.abspath(input_file):
+            parser.error(f"--output_dir would overwrite {input_file}")
+        written, skipped = sample_clips(input_file, output_file, index, args.num_frames, args.stride, args.align)
+        print(f"{output_file}: {written} clips, {skipped} records skipped (not single-image or frame not indexed)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import bisect
+import json
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+
+from dedup_datasets import get_image_paths
+from validate_images import OK, read_image_header
+
+# Qwen2.5-VL vision settings: 14px patches merged 2x2, so one token per 28x28 block
+IMAGE_FACTOR = 28
+MIN_PIXELS = 4 * 28 * 28
+MAX_PIXELS = 16384 * 28 * 28
+# <|vision_start|> and <|vision_end|> around every image
+IMAGE_SPECIAL_TOKENS = 2
+# <|im_start|>role\n ... <|im_end|>\n
+MESSAGE_OVERHEAD_TOKENS = 5
+IMAGE_PLACEHOLDER = '<image>'
+
+def smart_resize(height, width, factor=IMAGE_FACTOR, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS):
+    """Resize rule of the Qwen2.5-VL processor: round to multiples of `factor` within the pixel budget."""
+    h_bar = max(factor, round(height / factor) * factor)
+    w_bar = max(factor, round(width / factor) * factor)
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = math.floor(height / beta / factor) * factor
+        w_bar = math.floor(width / beta / factor) * factor
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+def count_image_tokens(height, width, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS):
+    h_bar, w_bar = smart_resize(height, width, min_pixels=min_pixels, max_pixels=max_pixels)
+    return (h_bar // IMAGE_FACTOR) * (w_bar // IMAGE_FACTOR) + IMAGE_SPECIAL_TOKENS
+
+class ApproxTokenizer:
+    """
+    Dependency-free token count estimate: every CJK character and punctuation
+    mark is one token, and latin words cost one token per 4 characters.
+    """
+    pattern = re.compile(r"[一-鿿]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+    def count(self, text):
+        count = 0
+        for token in self.pattern.findall(text):
+            count += (len(token) + 3) // 4 if token[0].isascii() and token[0].isalnum() else 1
+        return count
+
+class HFTokenizer:
+    """Exact text token counts from a Hugging Face tokenizer (e.g. the model checkpoint)."""
+    def __init__(self, name_or_path):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(name_or_path, trust_remote_code=True)
+
+    def count(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+class ImageSizeCache:
+    """Image (width, height) lookup that reads only the header and caches per path."""
+    def __init__(self, dims_table=None):
+        self.sizes = {}
+        if dims_table:
+            with open(dims_table, 'r', encoding='utf-8') as f:
+                for line in f:
+                    row = json.loads(line)
+                    if row.get('width') and row.get('height'):
+                        self.sizes[row['path']] = (row['width'], row['height'])
+
+    def get(self, path):
+        if path not in self.sizes:
+            status, width, height, _ = read_image_header(path)
+            if status == OK:
+                self.sizes[path] = (width, height)
+                return self.sizes[path]
+            if status in ('empty_path', 'missing', 'empty'):
+                self.sizes[path] = None
+                return None
+            try:
+                from PIL import Image
+                with Image.open(path) as image:
+                    self.sizes[path] = image.size
+            except (OSError, ValueError):
+                self.sizes[path] = None
+        return self.sizes[path]
+
+def record_lengths(item, tokenizer, image_sizes, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS):
+    """
+    Estimate (text_tokens, image_tokens, missing_images) for one record.
+    `<image>` placeholders are not counted as text; they are replaced by
+    the image tokens of the corresponding image.
+    """
+    text_tokens = 0
+    for message in item.get('messages', []):
+        content = message.get('content', '')
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        text_tokens += tokenizer.count(content.replace(IMAGE_PLACEHOLDER, '')) + MESSAGE_OVERHEAD_TOKENS
+
+    image_tokens = 0
+    missing = 0
+    for path in get_image_paths(item):
+        size = image_sizes.get(path) if path else None
+        if size is None:
+            missing += 1
+            continue
+        width, height = size
+        image_tokens += count_image_tokens(height, width, min_pixels, max_pixels)
+    return text_tokens, image_tokens, missing
+
+MISSING_IMAGES_SHARD = 'missing_images'
+
+def bucket_name(length, bucket_size, max_length):
+    """
+    Length bucket of a record: len_00000-00256, len_00257-00512, ..., with
+    the last bucket ending at max_length, and len_<max_length + 1>+ for
+    records that will be truncated.
+    """
+    if length > max_length:
+        return f"len_{max_length + 1:05d}+"
+    index = max(length - 1, 0) // bucket_size
+    lower = index * bucket_size + 1 if index else 0
+    upper = min(max_length, (index + 1) * bucket_size)
+    return f"len_{lower:05d}-{upper:05d}"
+
+def pack_best_fit_decreasing(lengths, capacity):
+    """
+    Group record indices into packs of total length <= capacity. Records are
+    placed longest first into the pack with the least remaining space that
+    still fits (best-fit decreasing), found by bisection over open packs.
+    """
+    packs = []
+    open_packs = []  # sorted (remaining space, pack id)
+    for idx in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        length = lengths[idx]
+        pos = bisect.bisect_left(open_packs, (length, -1))
+        if pos < len(open_packs):
+            space, pack_id = open_packs.pop(pos)
+            packs[pack_id].append(idx)
+        else:
+            space, pack_id = capacity, len(packs)
+            packs.append([idx])
+        if space - length > 0:
+            bisect.insort(open_packs, (space - length, pack_id))
+    return packs
+
+def compute_token_lengths(input_file, output_dir, tokenizer, max_length=4096, bucket_size=256,
+                          min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS, dims_table=None):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    image_sizes = ImageSizeCache(dims_table)
+
+    bucket_files = {}
+    bucket_lengths = {}
+    histogram = Counter()
+    total = 0
+    truncated = 0
+    missing_images = 0
+    missing_records = 0
+    total_tokens = 0
+
+    try:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                text_tokens, image_tokens, missing = record_lengths(item, tokenizer, image_sizes, min_pixels, max_pixels)
+                length = text_tokens + image_tokens
+                item['_lengths'] = {'text': text_tokens, 'image': image_tokens, 'total': length}
+
+                # Lengths without the missing images are underestimates, so keep those records apart
+                name = MISSING_IMAGES_SHARD if missing else bucket_name(length, bucket_size, max_length)
+                if name not in bucket_files:
+                    bucket_files[name] = open(output_dir / f"{name}.jsonl", 'w', encoding='utf-8')
+                    bucket_lengths[name] = []
+                bucket_files[name].write(json.dumps(item, ensure_ascii=False) + '\n')
+                bucket_lengths[name].append(length)
+
+                histogram[name] += 1
+                total += 1
+                total_tokens += length
+                missing_images += missing
+                missing_records += missing > 0
+                if not missing and length > max_length:
+                    truncated += 1
+    finally:
+        for f in bucket_files.values():
+            f.close()
+
+    # Pack plan: line indices of each bucket shard grouped into max_length packs
+    packs = {}
+    for name, lengths in bucket_lengths.items():
+        if name == MISSING_IMAGES_SHARD or name.endswith('+'):
+            continue
+        packs[f"{name}.jsonl"] = pack_best_fit_decreasing(lengths, max_length)
+    with open(output_dir / 'packs.json', 'w', encoding='utf-8') as f:
+        json.dump(packs, f)
+
+    num_packs = sum(len(p) for p in packs.values())
+    packed_records = total - truncated - missing_records
+    report = {
+        'input_file': str(input_file),
+        'max_length': max_length,
+        'bucket_size': bucket_size,
+        'max_pixels': max_pixels,
+        'total_records': total,
+        'truncated_records': truncated,
+        'missing_images': missing_images,
+        'records_with_missing_images': missing_records,
+        'mean_length': total_tokens / total if total else 0,
+        'buckets': dict(sorted((name, count) for name, count in histogram.items() if name != MISSING_IMAGES_SHARD)),
+        'packs': num_packs,
+        'records_per_pack': packed_records / num_packs if num_packs else 0
+    }
+    with open(output_dir / 'length_report.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Estimate token lengths of merged records and write length-bucketed shards')
+    parser.add_argument('--input_file', required=True, help='Merged JSONL file (e.g. merged_data/train.jsonl)')
+    parser.add_argument('--output_dir', required=True, help='Directory for the bucket shards, packs.json and length_report.json')
+    parser.add_argument('--tokenizer', default=None, help='Hugging Face tokenizer name or path; approximate counts if omitted')
+    parser.add_argument('--max_length', type=int, default=4096, help='Training --max_length (default: 4096)')
+    parser.add_argument('--bucket_size', type=int, default=256, help='Token width of each length bucket (default: 256)')
+    parser.add_argument('--min_pixels', type=int, default=int(os.environ.get('MIN_PIXELS', MIN_PIXELS)), help='Processor min_pixels (default: $MIN_PIXELS or 3136)')
+    parser.add_argument('--max_pixels', type=int, default=int(os.environ.get('MAX_PIXELS', MAX_PIXELS)), help='Processor max_pixels (default: $MAX_PIXELS or 12845056)')
+    parser.add_argument('--dims_table', default=None, help='Optional JSONL table of image dimensions (path, width, height) to avoid opening images')
+    args = parser.parse_args()
+
+    tokenizer = HFTokenizer(args.tokenizer) if args.tokenizer else ApproxTokenizer()
+    report = compute_token_lengths(
+        args.input_file, args.output_dir, tokenizer,
+        max_length=args.max_length,
+        bucket_size=args.bucket_size,
+        min_pixels=args.min_pixels,
+        max_pixels=args.max_pixels,
+        dims_table=args.dims_table
+    )
+
+    print(f"Records: {report['total_records']}")
+    print(f"Mean length: {report['mean_length']:.1f} tokens")
+    print(f"Truncated (> {report['max_length']} tokens): {report['truncated_records']}")
+    print(f"Records with missing images: {report['records_with_missing_images']} ({report['missing_images']} images), "
+          f"kept out of the length buckets in {MISSING_IMAGES_SHARD}.jsonl")
+    print("\nLength buckets:")
+    for name, count in report['buckets'].items():
+        print(f"  {name}: {count}")
+    print(f"\nPacks of {report['max_length']} tokens: {report['packs']} ({report['records_per_pack']:.2f} records per pack)")
+    print(f"Output saved to: {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+PHASE_NAMES = ['Preparation', 'CalotTriangleDissection', 'ClippingCutting', 'GallbladderDissection',
+               'GallbladderPackaging', 'CleaningCoagulation', 'GallbladderRetraction']
+TOOL_NAMES = ['Grasper', 'Bipolar', 'Hook', 'Scissors', 'Clipper', 'Irrigator', 'SpecimenBag']
+# Phase id / tool mask of frames without an annotation (tool annotations are 1 fps)
+UNANNOTATED = 0x80
+STORE_VERSION = 1
+VIDEO_FILE = re.compile(r"video(\d+)-phase\.txt$")
+
+def parse_phase_file(txt_path, phase_names):
+    """(frames, phase ids) of a 'Frame\\tPhase' file; new phase names are appended to phase_names"""
+    with open(txt_path, 'r') as f:
+        tokens = f.read().split()[2:]  # Skip header line
+    frames = np.array(tokens[0::2], dtype=np.int64)
+    names, inverse = np.unique(np.array(tokens[1::2]), return_inverse=True)
+    for name in names:
+        if name not in phase_names:
+            phase_names.append(name)
+    ids = np.array([phase_names.index(name) for name in names], dtype=np.uint8)
+    return frames, ids[inverse]
+
+def parse_tool_file(txt_path):
+    """(frames, tool bitmasks) of a 'Frame Grasper ... SpecimenBag' file; bit i is TOOL_NAMES[i]"""
+    with open(txt_path, 'r') as f:
+        tokens = f.read().split()[len(TOOL_NAMES) + 1:]  # Skip header line
+    table = np.array(tokens, dtype=np.int64).reshape(-1, len(TOOL_NAMES) + 1)
+    masks = (table[:, 1:] != 0).astype(np.uint8) << np.arange(len(TOOL_NAMES), dtype=np.uint8)
+    return table[:, 0], masks.sum(axis=1, dtype=np.uint8)
+
+def compile_annotations(annotations_dir, tool_annotations_dir, output_dir):
+    """
+    Write all phase and tool annotations as one store: phases.npy and
+    tools.npy (uint8 per frame, all videos concatenated), offsets.npy
+    (int64, video i spans offsets[i]:offsets[i + 1], indexed by frame
+    number) and index.json (video ids, phase and tool names).
+    """
+    phase_files = sorted(f for f in glob.glob(os.path.join(annotations_dir, 'video*-phase.txt')) if VIDEO_FILE.search(f))
+    phase_names = list(PHASE_NAMES)
+    videos, phase_parts, tool_parts, lengths = [], [], [], []
+    for phase_file in phase_files:
+        video_id = int(VIDEO_FILE.search(phase_file).group(1))
+        tool_file = os.path.join(tool_annotations_dir, f'video{video_id:02d}-tool.txt')
+        phase_frames, phase_ids = parse_phase_file(phase_file, phase_names)
+        if os.path.exists(tool_file):
+            tool_frames, tool_masks = parse_tool_file(tool_file)
+        else:
+            logging.warning(f"Tool annotation not found for video {video_id:02d}")
+            tool_frames, tool_masks = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        length = int(max(phase_frames.max(initial=-1), tool_frames.max(initial=-1))) + 1
+        phases = np.full(length, UNANNOTATED, dtype=np.uint8)
+        tools = np.full(length, UNANNOTATED, dtype=np.uint8)
+        phases[phase_frames] = phase_ids
+        tools[tool_frames] = tool_masks
+        videos.append(f"{video_id:02d}")
+        phase_parts.append(phases)
+        tool_parts.append(tools)
+        lengths.append(length)
+        logging.info(f"Video {video_id:02d}: {length} frames, {len(tool_frames)} with tool labels")
+
+    if len(phase_names) >= UNANNOTATED:
+        raise ValueError(f"Too many phase names for a uint8 store: {len(phase_names)}")
+    os.makedirs(output_dir, exist_ok=True)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    empty = np.zeros(0, dtype=np.uint8)
+    np.save(os.path.join(output_dir, 'phases.npy'), np.concatenate(phase_parts) if phase_parts else empty)
+    np.save(os.path.join(output_dir, 'tools.npy'), np.concatenate(tool_parts) if tool_parts else empty)
+    np.save(os.path.join(output_dir, 'offsets.npy'), offsets)
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'videos': videos, 'phases': phase_names, 'tools': TOOL_NAMES}, f, indent=2)
+    return videos, int(offsets[-1])
+
+class ArrayLookup:
+    """dict.get-style view of one video's labels, as used by create_metadata.process_video_folder"""
+    def __init__(self, values, decode):
+        self.values = values
+        self.decode = decode
+
+    def get(self, frame, default=None):
+        if 0 <= frame < len(self.values) and self.values[frame] != UNANNOTATED:
+            return self.decode(self.values[frame])
+        return default
+
+class Cholec80Annotations:
+    """
+    Read-only, memory-mapped view of a compiled store. Arrays are opened with
+    mmap_mode='r', so worker processes share the page cache and any frame's
+    labels are a single array read.
+    """
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, 'index.json'), 'r') as f:
+            index = json.load(f)
+        if index.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported annotation store version: {index.get('version')}")
+        self.videos = index['videos']
+        self.phase_names = index['phases']
+        self.tool_names = index['tools']
+        self.video_index = {video: i for i, video in enumerate(self.videos)}
+        self.phases = np.load(os.path.join(store_dir, 'phases.npy'), mmap_mode='r')
+        self.tools = np.load(os.path.join(store_dir, 'tools.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, 'offsets.npy'))
+        self._tool_lists = [[name for bit, name in enumerate(self.tool_names) if mask >> bit & 1] for mask in range(UNANNOTATED)]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def span(self, video):
+        """(start, end) of a video ('01' or 1) in the frame arrays"""
+        i = self.video_index[video if isinstance(video, str) else f"{video:02d}"]
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def phase_timeline(self, video):
+        """uint8 phase ids of every frame of a video (UNANNOTATED where missing)"""
+        start, end = self.span(video)
+        return self.phases[start:end]
+
+    def tool_timeline(self, video):
+        """uint8 tool bitmasks of every frame of a video (UNANNOTATED where missing)"""
+        start, end = self.span(video)
+        return self.tools[start:end]
+
+    def phase(self, video, frame, default="Unknown"):
+        return self.phase_lookup(video).get(frame, default)
+
+    def tool_list(self, video, frame):
+        return self.tool_lookup(video).get(frame, [])
+
+    def phase_lookup(self, video):
+        return ArrayLookup(self.phase_timeline(video), lambda value: self.phase_names[value])
+
+    def tool_lookup(self, video):
+        return ArrayLookup(self.tool_timeline(video), lambda value: self._tool_lists[value])
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile Cholec80 phase and tool annotations into a memory-mapped store')
+    parser.add_argument('--annotations_dir', default='/opt/liblibai-models/user-workspace/jj/datasets/cholec80/phase_annotations')
+    parser.add_argument('--tool_annotations_dir', default='/opt/liblibai-models/user-workspace/jj/datasets/cholec80/tool_annotations')
+    parser.add_argument('--output_dir', default='/opt/liblibai-models/user-workspace/jj/datasets/cholec80/annotation_store')
+    args = parser.parse_args()
+
+    videos, frames = compile_annotations(args.annotations_dir, args.tool_annotations_dir, args.output_dir)
+    logging.info(f"Compiled {len(videos)} videos, {frames} frames into {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
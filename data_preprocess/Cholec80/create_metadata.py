@@ -2,15 +2,18 @@ import os
 import glob
 import json
 import logging
+import argparse
 import pandas as pd
 
+from compile_annotations import TOOL_NAMES, Cholec80Annotations
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
 def read_tool_annotation(txt_path):
     """Read tool annotation file and return a dictionary mapping frame numbers to tool states"""
     tool_dict = {}
-    tool_names = ['Grasper', 'Bipolar', 'Hook', 'Scissors', 'Clipper', 'Irrigator', 'SpecimenBag']
+    tool_names = TOOL_NAMES
     
     with open(txt_path, 'r') as f:
         # Skip header line
@@ -75,6 +78,12 @@ def process_video_folder(folder_path, phase_dict, tool_dict, frames_dir):
     return metadata_list
 
 def main():
+    parser = argparse.ArgumentParser(description='Create Cholec80 frame metadata')
+    parser.add_argument('--annotation_store', default=None,
+                        help='Read labels from a store built by compile_annotations.py instead of parsing the txt files')
+    args = parser.parse_args()
+    store = Cholec80Annotations(args.annotation_store) if args.annotation_store else None
+    
     # Define directories
     frames_dir = '/opt/liblibai-models/user-workspace/jj/datasets/cholec80/frames_sample_rate_25'
     annotations_dir = '/opt/liblibai-models/user-workspace/jj/datasets/cholec80/phase_annotations'
@@ -96,6 +105,16 @@ def main():
             folder_name = os.path.basename(folder_path)
             video_id = int(folder_name)
             
+            if store is not None:
+                if folder_name not in store.video_index:
+                    logging.warning(f"Video {video_id:02d} not in annotation store")
+                    continue
+                metadata_list = process_video_folder(folder_path, store.phase_lookup(folder_name), store.tool_lookup(folder_name), frames_dir)
+                for metadata in metadata_list:
+                    f.write(json.dumps(metadata) + '\n')
+                logging.info(f"Completed video {video_id:02d}: {len(metadata_list)} frames processed")
+                continue
+            
             # Find corresponding annotation files
             phase_file = os.path.join(annotations_dir, f'video{video_id:02d}-phase.txt')
             tool_file = os.path.join(tool_annotations_dir, f'video{video_id:02d}-tool.txt')
@@ -22,7 +22,7 @@ def get_all_phases_and_tools(data_list):
             tools.update(data['tools'])
     return list(phases - {'Unknown'}), list(tools)
 
-def create_mcq_question(category, all_options, frame_data, num_options=5):
+def create_mcq_question(category, all_options, frame_data, num_options=5, sampler=None):
     if category == "phase":
         if 'phase' not in frame_data:
             return None
@@ -44,8 +44,11 @@ def create_mcq_question(category, all_options, frame_data, num_options=5):
     total_available = len(other_options) + 1
     actual_num_options = min(num_options, total_available)
     
-    # Select random distractors
-    distractors = random.sample(other_options, min(actual_num_options - 1, len(other_options)))
+    # Select random distractors, or plausible confusers with a hard-negative sampler
+    if sampler is not None:
+        distractors = sampler.sample(correct_answer, actual_num_options - 1)
+    else:
+        distractors = random.sample(other_options, min(actual_num_options - 1, len(other_options)))
     
     all_choices = [correct_answer] + distractors
     random.shuffle(all_choices)
@@ -120,6 +123,8 @@ def main():
     parser.add_argument('--mode', choices=['mcq', 'vqa'], required=True, help='Mode of question generation')
     parser.add_argument('--category', choices=['phase', 'tool'], required=True, help='Category of question')
     parser.add_argument('--num_options', type=int, default=5, help='Number of options for MCQ questions (default: 5)')
+    parser.add_argument('--distractors', choices=['random', 'hard'], default='random',
+                       help="MCQ distractors: 'random' options, or 'hard' ones that co-occur or are adjacent in the data")
     parser.add_argument('--input_jsonl', type=str,
                        default='/opt/liblibai-models/user-workspace/jj/proj/Laparo/data_json/Cholec80/meta_data.jsonl',
                        help='Path to input JSONL file containing frame data')
@@ -149,6 +154,12 @@ def main():
         print("Error: No tool data found in the input file.")
         sys.exit(1)
     
+    sampler = None
+    if args.mode == 'mcq' and args.distractors == 'hard':
+        from distractors import DistractorSampler, cholec80_weights
+        options = all_phases if args.category == 'phase' else all_tools
+        sampler = DistractorSampler(options, cholec80_weights(frame_data_list, args.category, options))
+    
     # Process and write questions
     count = 0
     skipped = 0
@@ -160,7 +171,8 @@ def main():
                         args.category,
                         all_phases if args.category == 'phase' else all_tools,
                         frame_data,
-                        args.num_options
+                        args.num_options,
+                        sampler
                     )
                 else:  # vqa mode
                     formatted_data = create_vqa_question(args.category, frame_data)
@@ -15,11 +15,14 @@ def load_jsonl_data(file_path):
             data.append(json.loads(line.strip()))
     return data
 
+def split_triplet(triplet):
+    return triplet.strip('[]').split(']-[')
+
 def get_category_from_triplets(triplets, category):
     """Extract all values for a given category from triplets."""
     values = []
     for triplet in triplets:
-        parts = triplet.strip('[]').split(']-[')
+        parts = split_triplet(triplet)
         if category == "tool":
             values.append(parts[0])
         elif category == "action":
@@ -28,7 +31,12 @@ def get_category_from_triplets(triplets, category):
             values.append(parts[2])
     return values
 
-def create_mcq_question(category, mapping, frame_data):
+def get_mcq_options(category, mapping):
+    """Non-null option names of a category from the category mapping."""
+    key = {"tissue": "target", "action": "verb", "tool": "instrument"}[category]
+    return [opt for opt in mapping[key].values() if not opt.startswith("null")]
+
+def create_mcq_question(category, mapping, frame_data, sampler=None):
     # Skip if category is triplet
     if category == "triplet":
         return None
@@ -52,23 +60,23 @@ def create_mcq_question(category, mapping, frame_data):
     
     # Set up question and options based on category
     if category == "tissue":
-        options = list(mapping["target"].values())
         question = "Given the cholecystectomy surgical image <image>, which organ/tissue is being operated?"
     elif category == "action":
-        options = list(mapping["verb"].values())
         question = "Given the cholecystectomy surgical image <image>, what action is being performed?"
     elif category == "tool":
-        options = list(mapping["instrument"].values())
         question = "Given the cholecystectomy surgical image <image>, what surgical instrument is being used?"
     else:
         raise ValueError(f"Invalid category: {category}")
     
-    # Remove null options
-    options = [opt for opt in options if not opt.startswith("null")]
+    # Non-null options of the category
+    options = get_mcq_options(category, mapping)
     
     # Get distractors (excluding the correct answer)
     other_options = [opt for opt in options if opt != correct_answer]
-    distractors = random.sample(other_options, min(4, len(other_options)))
+    if sampler is not None:
+        distractors = sampler.sample(correct_answer, 4)
+    else:
+        distractors = random.sample(other_options, min(4, len(other_options)))
     
     # Ensure we have exactly 5 options (ABCDE)
     while len(distractors) < 4:
@@ -186,6 +194,8 @@ def main():
     parser = argparse.ArgumentParser(description='Create recognition data for surgical video frames')
     parser.add_argument('--mode', choices=['mcq', 'vqa'], required=True, help='Mode of question generation')
     parser.add_argument('--category', choices=['tissue', 'action', 'tool', 'triplet'], required=True, help='Category of question')
+    parser.add_argument('--distractors', choices=['random', 'hard'], default='random',
+                       help="MCQ distractors: 'random' options, or 'hard' ones sharing triplet co-occurrence statistics")
     parser.add_argument('--mapping_file', type=str, 
                        default='data_preprocess/Cholect50/datasets/category_mapping.json',
                        help='Path to category mapping JSON file')
@@ -208,6 +218,12 @@ def main():
     category_mapping = load_category_mapping(args.mapping_file)
     frame_data_list = load_jsonl_data(args.input_jsonl)
     
+    sampler = None
+    if args.mode == 'mcq' and args.distractors == 'hard' and args.category != 'triplet':
+        from distractors import DistractorSampler, triplet_weights
+        options = get_mcq_options(args.category, category_mapping)
+        sampler = DistractorSampler(options, triplet_weights(frame_data_list, args.category, options, split_triplet))
+    
     # Process and write questions
     count = 0
     skipped = 0
@@ -215,7 +231,7 @@ def main():
         with open(output_file, 'w') as f_out:
             for frame_data in frame_data_list:
                 if args.mode == 'mcq':
-                    formatted_data = create_mcq_question(args.category, category_mapping, frame_data)
+                    formatted_data = create_mcq_question(args.category, category_mapping, frame_data, sampler)
                 else:  # vqa mode
                     formatted_data = create_vqa_question(args.category, frame_data)
                 
@@ -35,13 +35,19 @@ Copyright 2021 The Research Group CAMMA Authors All Rights Reserved.
 
 import os
 import json
+import bisect
 import random
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import numpy as np
 from PIL import Image
 import torchvision.transforms as transforms
 from torch.utils.data import Dataset, ConcatDataset, DataLoader
 
+IMAGE_SIZE = (256, 448)
+# (label column, classes) of the triplet, tool, verb, target and phase labels
+LABEL_COLUMNS = ((0, 100), (1, 6), (7, 10), (8, 15), (14, 100))
+
 
 class CholecT50():
     def __init__(self, 
@@ -49,12 +55,16 @@ class CholecT50():
                 dataset_variant="cholect50-crossval",
                 test_fold=1,
                 augmentation_list=['original', 'vflip', 'hflip', 'contrast', 'rot90'],
-                normalize=True):
+                normalize=True,
+                batched=False,
+                decode_threads=8):
         """ Args
                 dataset_dir : common path to the dataset (excluding videos, output)
                 list_video  : list video IDs, e.g:  ['VID01', 'VID02']
                 aug         : data augumentation style
                 split       : data split ['train', 'val', 'test']
+                batched     : decode images and apply batch_transform() per batch (see T50.__getitems__)
+                decode_threads : image decoding threads per process in batched mode
             Call
                 batch_size: int, 
                 shuffle: True or False
@@ -62,6 +72,8 @@ class CholecT50():
                 tuple ((image), (tool_label, verb_label, target_label, triplet_label, phase_label))
         """
         self.normalize   = normalize
+        self.batched     = batched
+        self.decode_threads = decode_threads
         self.dataset_dir = dataset_dir
         self.target_transform = self.to_binary # in case its decoding results in non-binary labels
         self.list_dataset_variant = {
@@ -96,7 +108,7 @@ class CholecT50():
         self.augmentation_list = []
         for aug in augmentation_list:
             self.augmentation_list.append(self.augmentations[aug])
-        trainform, testform = self.transform()
+        trainform, testform = self.batch_transform() if batched else self.transform()
         self.build_train_dataset(trainform)
         self.build_val_dataset(trainform)
         self.build_test_dataset(testform)
@@ -149,45 +161,43 @@ class CholecT50():
         testform  = transforms.Compose(op_test)
         trainform = transforms.Compose(op_train)
         return trainform, testform
+
+    def batch_transform(self):
+        """ transform() for whole batches: uint8 (B, 3, 256, 448) tensors, resized when decoded.
+            Dtype conversion and normalization run once per batch; the random augmentations
+            run per image, so every sample draws its own flip, rotation and contrast. """
+        normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]) if self.normalize else None
+        augment   = transforms.Compose(self.augmentation_list + [transforms.Resize(IMAGE_SIZE, antialias=True)])
+        return BatchTransform(augment, normalize), BatchTransform(None, normalize)
     
     # IT IS NOT one-hot encoding, can be all zeros, and multiple labels can be 1
     
     def to_binary(self, label_list):
         outputs = []
         for label in label_list:
-            label = torch.tensor(label).bool().int()
+            label = torch.as_tensor(label).bool().int()
             outputs.append(label)
         return outputs
 
 
+    def build_video_dataset(self, video, transform):
+        return T50(img_dir = os.path.join(self.dataset_dir, 'videos', video), 
+                   label_file = os.path.join(self.dataset_dir, 'labels', '{}.json'.format(video)),
+                   transform=None if self.batched else transform,
+                   target_transform=self.target_transform,
+                   batch_transform=transform if self.batched else None,
+                   decode_threads=self.decode_threads)
+
     def build_train_dataset(self, transform):
-        iterable_dataset = []
-        for video in self.train_records:
-            dataset = T50(img_dir = os.path.join(self.dataset_dir, 'videos', video), 
-                          label_file = os.path.join(self.dataset_dir, 'labels', '{}.json'.format(video)),
-                          transform=transform,
-                          target_transform=self.target_transform)
-            iterable_dataset.append(dataset)
-        self.train_dataset = ConcatDataset(iterable_dataset)
+        iterable_dataset = [self.build_video_dataset(video, transform) for video in self.train_records]
+        self.train_dataset = T50Concat(iterable_dataset)
 
     def build_val_dataset(self, transform):
-        iterable_dataset = []
-        for video in self.val_records:
-            dataset = T50(img_dir = os.path.join(self.dataset_dir, 'videos', video), 
-                          label_file = os.path.join(self.dataset_dir, 'labels', '{}.json'.format(video)),
-                          transform=transform,
-                          target_transform=self.target_transform)
-            iterable_dataset.append(dataset)
-        self.val_dataset = ConcatDataset(iterable_dataset)
+        iterable_dataset = [self.build_video_dataset(video, transform) for video in self.val_records]
+        self.val_dataset = T50Concat(iterable_dataset)
 
     def build_test_dataset(self, transform):
-        iterable_dataset = []
-        for video in self.test_records:
-            dataset = T50(img_dir = os.path.join(self.dataset_dir, 'videos', video), 
-                          label_file = os.path.join(self.dataset_dir, 'labels', '{}.json'.format(video)), 
-                          transform=transform,
-                          target_transform=self.target_transform)
-            iterable_dataset.append(dataset)
+        iterable_dataset = [self.build_video_dataset(video, transform) for video in self.test_records]
         self.test_dataset = iterable_dataset
         
     def build(self):
@@ -198,15 +208,54 @@ class CholecT50():
 
 
     
+class BatchTransform():
+    """ Float conversion and normalization of a uint8 (B, 3, H, W) batch as single tensor ops,
+        with `augment` (per-image random transforms ending in a resize) applied image by image """
+    def __init__(self, augment=None, normalize=None):
+        self.augment   = augment
+        self.normalize = normalize
+
+    def __call__(self, images):
+        images = transforms.functional.convert_image_dtype(images, torch.float32)
+        if self.augment is not None:
+            images = torch.stack([self.augment(image) for image in images])
+        if self.normalize is not None:
+            images = self.normalize(images)
+        return images
+
+
+_decode_pools = (None, {})
+
+def decode_pool(threads):
+    """ Thread pool of `threads` workers of the current process (pools inherited from a
+        forked parent have no threads) """
+    global _decode_pools
+    pid, pools = _decode_pools
+    if pid != os.getpid():
+        pools = {}
+        _decode_pools = (os.getpid(), pools)
+    if threads not in pools:
+        pools[threads] = ThreadPoolExecutor(max_workers=threads)
+    return pools[threads]
+
+
 class T50(Dataset):
-    def __init__(self, img_dir, label_file, transform=None, target_transform=None):
+    def __init__(self, img_dir, label_file, transform=None, target_transform=None, batch_transform=None, decode_threads=8):
+        """ Without batch_transform, items are (image path, (triplet, phase labels)) as before.
+            With it, images are decoded (and resized to IMAGE_SIZE) by a thread pool and
+            batch_transform is applied to whole uint8 (B, 3, H, W) batches, see __getitems__. """
         label_data = json.load(open(label_file, "rb"))
-        self.label_data = label_data["annotations"]
-        self.frames = list(self.label_data.keys())
+        annotations = label_data["annotations"]
+        self.frames = np.array([int(frame) for frame in annotations.keys()], dtype=np.int64)
         # self.categories = label_data["categories"]
         self.img_dir = img_dir
         self.transform = transform
         self.target_transform = target_transform
+        self.batch_transform = batch_transform
+        self.decode_threads = decode_threads
+        # Label counts of every frame, computed once in shared memory so DataLoader
+        # workers read the same pages instead of each holding the JSON annotations
+        self.labels = tuple(torch.from_numpy(label).share_memory_() for label in self.encode_labels(list(annotations.values())))
         # self.category_mapper = CategoryMapper(self.categories)
     
     def get_mapper(self):
@@ -239,20 +288,78 @@ class T50(Dataset):
             if phase[0] != -1.0:
                 phase_label[phase[0]] += 1
         return (triplet_label, tool_label, verb_label, target_label, phase_label)
+
+    @staticmethod
+    def encode_labels(frame_labels):
+        """ get_binary_labels for all frames at once: (triplet, tool, verb, target, phase)
+            int32 count arrays of shape (frames, classes) """
+        owners = np.repeat(np.arange(len(frame_labels)), [len(labels) for labels in frame_labels])
+        rows = np.array([label[:LABEL_COLUMNS[-1][0] + 1] for labels in frame_labels for label in labels], dtype=np.int64)
+        rows = rows.reshape(len(owners), LABEL_COLUMNS[-1][0] + 1)
+        outputs = []
+        for column, classes in LABEL_COLUMNS:
+            counts = np.zeros((len(frame_labels), classes), dtype=np.int32)
+            valid = rows[:, column] != -1
+            np.add.at(counts, (owners[valid], rows[valid, column]), 1)
+            outputs.append(counts)
+        return tuple(outputs)
+
+    def image_path(self, index):
+        basename = "{}.png".format(str(self.frames[index]).zfill(6))
+        return os.path.join(self.img_dir, basename)
+
+    def decode_image(self, index, out):
+        with Image.open(self.image_path(index)) as image:
+            image = image.convert('RGB').resize((IMAGE_SIZE[1], IMAGE_SIZE[0]), Image.BILINEAR)
+        out.copy_(torch.from_numpy(np.asarray(image)).permute(2, 0, 1))
+
+    def __getitems__(self, indices):
+        """ Batched fetch, used by DataLoader when present: images are decoded by a thread
+            pool into one uint8 batch, batch_transform (per-image augmentations) and
+            target_transform run on the whole batch, and the per-sample list is returned
+            for collate_fn. """
+        if self.batch_transform is None:
+            return [self[index] for index in indices]
+        images = torch.empty((len(indices), 3) + IMAGE_SIZE, dtype=torch.uint8)
+        list(decode_pool(self.decode_threads).map(self.decode_image, indices, images))
+        images = self.batch_transform(images)
+        rows = torch.as_tensor(indices, dtype=torch.long)
+        labels = tuple(label[rows] for label in self.labels)
+        if self.target_transform:
+            labels = self.target_transform(labels)
+        return [(images[i], (labels[0][i], labels[4][i])) for i in range(len(indices))]
     
     def __getitem__(self, index):
-        frame_key = self.frames[index]
-        labels = self.label_data[frame_key]
-        basename = "{}.png".format(str(frame_key).zfill(6))
-        img_path = os.path.join(self.img_dir, basename)
+        if self.batch_transform is not None:
+            return self.__getitems__([index])[0]
+        img_path = self.image_path(index)
         # image = Image.open(img_path)
-        labels = self.get_binary_labels(labels)
+        labels = tuple(label[index] for label in self.labels)
         # if self.transform:
         #     image = self.transform(image)
         if self.target_transform:
             labels = self.target_transform(labels)
         # return image, (labels[0], labels[4]) # return triplet and phase labels
         return img_path, (labels[0], labels[4])
+
+
+class T50Concat(ConcatDataset):
+    """ ConcatDataset of T50 videos that passes batched fetches on to each video """
+    def __getitems__(self, indices):
+        samples = [None] * len(indices)
+        groups = {}
+        for position, index in enumerate(indices):
+            dataset_idx = bisect.bisect_right(self.cumulative_sizes, index)
+            sample_idx = index - self.cumulative_sizes[dataset_idx - 1] if dataset_idx > 0 else index
+            positions, sample_indices = groups.setdefault(dataset_idx, ([], []))
+            positions.append(position)
+            sample_indices.append(sample_idx)
+        for dataset_idx, (positions, sample_indices) in groups.items():
+            for position, sample in zip(positions, self.datasets[dataset_idx].__getitems__(sample_indices)):
+                samples[position] = sample
+        return samples
+
+
 class CategoryMapper:
     def __init__(self,  json_dir):
     
@@ -1,9 +1,10 @@
+import argparse
 import json
 import os
 import sys
 import random
 
-def convert_to_mcq_format(input_file, output_file):
+def convert_to_mcq_format(input_file, output_file, distractors='random'):
     # Check if input file exists
     if not os.path.exists(input_file):
         print(f"Error: Input file '{input_file}' does not exist!")
@@ -27,6 +28,11 @@ def convert_to_mcq_format(input_file, output_file):
         "Suturing",
         "Washing"
     ]
+    # Hard distractors: adjacent phases and phases sharing instruments in testlap_data.cypher
+    sampler = None
+    if distractors == 'hard':
+        from distractors import DistractorSampler, kg_phase_weights
+        sampler = DistractorSampler(all_phases, kg_phase_weights(all_phases))
 
     count = 0
     try:
@@ -37,11 +43,14 @@ def convert_to_mcq_format(input_file, output_file):
                 
                 # Get other phases (excluding the correct one)
                 other_phases = [p for p in all_phases if p != correct_phase]
-                # Randomly select 4 distractors
-                distractors = random.sample(other_phases, min(4, len(other_phases)))
+                # Select 4 distractors
+                if sampler is not None:
+                    selected_distractors = sampler.sample(correct_phase, 4)
+                else:
+                    selected_distractors = random.sample(other_phases, min(4, len(other_phases)))
                 
                 # Combine correct answer and distractors
-                selected_phases = [correct_phase] + distractors
+                selected_phases = [correct_phase] + selected_distractors
                 # Shuffle the options
                 random.shuffle(selected_phases)
                 
@@ -84,7 +93,11 @@ def convert_to_mcq_format(input_file, output_file):
         sys.exit(1)
 
 if __name__ == "__main__":
-    input_file = "/opt/liblibai-models/user-workspace/jj/proj/Laparo/data_json/autoLaparo/meta_labels.jsonl"  # Added ./ to make path explicit
-    output_file = "/opt/liblibai-models/user-workspace/jj/proj/Laparo/data_json/autoLaparo/mcq_phase.jsonl"  # Added ./ to make path explicit
+    parser = argparse.ArgumentParser(description='Create AutoLaparo phase MCQ data')
+    parser.add_argument('--input_file', default="/opt/liblibai-models/user-workspace/jj/proj/Laparo/data_json/autoLaparo/meta_labels.jsonl")
+    parser.add_argument('--output_file', default="/opt/liblibai-models/user-workspace/jj/proj/Laparo/data_json/autoLaparo/mcq_phase.jsonl")
+    parser.add_argument('--distractors', choices=['random', 'hard'], default='random',
+                        help="MCQ distractors: 'random' phases, or 'hard' ones adjacent or sharing instruments in the knowledge graph")
+    args = parser.parse_args()
     print(f"Current working directory: {os.getcwd()}")
-    convert_to_mcq_format(input_file, output_file)
\ No newline at end of file
+    convert_to_mcq_format(args.input_file, args.output_file, args.distractors)
\ No newline at end of file
@@ -0,0 +1,229 @@
+import argparse
+import glob
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+AUTOLAPARO_PHASES = {
+    1: "Preparation",
+    2: "Dividing Ligament and Peritoneum",
+    3: "Dividing Uterine Vessels and Ligament",
+    4: "Transecting the Vagina",
+    5: "Specimen Removal",
+    6: "Suturing",
+    7: "Washing"
+}
+# CholecT50 phase ids (label column 14), as in Cholect50/create_phase_triplet_data.PhaseMapper
+CHOLECT50_PHASES = {
+    0: "Preparation",
+    1: "CalotTriangleDissection",
+    2: "ClippingAndCutting",
+    3: "GallbladderDissection",
+    4: "GallbladderPackaging",
+    5: "CleaningAndCoagulation",
+    6: "GallbladderExtraction"
+}
+CHOLECT50_PHASE_COLUMN = 14
+COLUMNS = ('dataset', 'video', 'phase', 'start', 'end')
+
+def run_lengths(frames, labels):
+    """(labels, start frames, end frames) of the runs of equal labels; frames are sorted, ends inclusive"""
+    frames = np.asarray(frames)
+    labels = np.asarray(labels)
+    if len(labels) == 0:
+        return labels, frames, frames
+    order = np.argsort(frames, kind='stable')
+    frames, labels = frames[order], labels[order]
+    starts = np.concatenate(([0], np.flatnonzero(labels[1:] != labels[:-1]) + 1))
+    ends = np.append(starts[1:], len(labels)) - 1
+    return labels[starts], frames[starts], frames[ends]
+
+def read_cholec80(annotations_dir):
+    """Yield (video, frames, phase names) from Cholec80 phase_annotations/videoXX-phase.txt (25 fps)"""
+    for path in sorted(glob.glob(os.path.join(annotations_dir, 'video*-phase.txt'))):
+        with open(path, 'r') as f:
+            tokens = f.read().split()[2:]  # Skip header line
+        video = os.path.basename(path).replace('-phase.txt', '')
+        yield video, np.array(tokens[0::2], dtype=np.int64), np.array(tokens[1::2])
+
+def read_autolaparo(labels_dir):
+    """Yield (video, frames, phase names) from AutoLaparo labels/label_XX.txt (1 fps, phases 1-7)"""
+    names = np.array([''] + [AUTOLAPARO_PHASES[i] for i in sorted(AUTOLAPARO_PHASES)])
+    for path in sorted(glob.glob(os.path.join(labels_dir, 'label_*.txt'))):
+        with open(path, 'r') as f:
+            table = np.array(f.read().split()[2:], dtype=np.int64).reshape(-1, 2)  # Skip header line
+        video = re.search(r"label_(\w+)\.txt$", path).group(1)
+        yield video, table[:, 0], names[table[:, 1]]
+
+def read_cholect50(labels_dir):
+    """Yield (video, frames, phase names) from CholecT50 labels/VIDXX.json (1 fps); frames without a phase are skipped"""
+    for path in sorted(glob.glob(os.path.join(labels_dir, 'VID*.json'))):
+        with open(path, 'rb') as f:
+            annotations = json.load(f)['annotations']
+        frames, phases = [], []
+        for frame, labels in annotations.items():
+            phase = next((int(label[CHOLECT50_PHASE_COLUMN]) for label in labels
+                          if len(label) > CHOLECT50_PHASE_COLUMN and label[CHOLECT50_PHASE_COLUMN] != -1), None)
+            if phase is not None:
+                frames.append(int(frame))
+                phases.append(CHOLECT50_PHASES.get(phase, f"Unknown-{phase}"))
+        video = os.path.basename(path).rsplit('.', 1)[0]
+        yield video, np.array(frames, dtype=np.int64), np.array(phases)
+
+class SegmentTable:
+    """
+    Columnar table of phase segments, one row per run of equal phase labels:
+    dataset, video and phase as small integer codes into string vocabularies,
+    start and end (inclusive) frame numbers. Rows are sorted by (video,
+    start) and `video_offsets` gives each video's row range, so per-video
+    and per-frame queries are slices and binary searches.
+    """
+    def __init__(self, datasets, videos, phases, columns):
+        self.datasets = list(datasets)
+        self.videos = list(videos)     # 'dataset/video'
+        self.phases = list(phases)
+        self.dataset = columns['dataset'].astype(np.uint8)
+        self.video = columns['video'].astype(np.uint16)
+        self.phase = columns['phase'].astype(np.uint8)
+        self.start = columns['start'].astype(np.int32)
+        self.end = columns['end'].astype(np.int32)
+        self.video_index = {video: i for i, video in enumerate(self.videos)}
+        self.phase_index = {phase: i for i, phase in enumerate(self.phases)}
+        self.video_offsets = np.searchsorted(self.video, np.arange(len(self.videos) + 1)).astype(np.int64)
+
+    @classmethod
+    def from_sources(cls, sources):
+        """Build from {dataset: iterable of (video, frames, phase names)}"""
+        datasets, videos, phases = [], [], {}
+        parts = {name: [] for name in COLUMNS}
+        for dataset, sequences in sources.items():
+            datasets.append(dataset)
+            for video, frames, names in sequences:
+                labels, starts, ends = run_lengths(frames, names)
+                if len(labels) == 0:
+                    continue
+                codes = np.array([phases.setdefault(name, len(phases)) for name in labels.tolist()], dtype=np.int64)
+                parts['dataset'].append(np.full(len(labels), len(datasets) - 1))
+                parts['video'].append(np.full(len(labels), len(videos)))
+                parts['phase'].append(codes)
+                parts['start'].append(starts)
+                parts['end'].append(ends)
+                videos.append(f"{dataset}/{video}")
+        columns = {name: np.concatenate(values) if values else np.zeros(0, dtype=np.int64) for name, values in parts.items()}
+        return cls(datasets, videos, list(phases), columns)
+
+    def save(self, path):
+        np.savez(path, datasets=np.array(self.datasets, dtype=str), videos=np.array(self.videos, dtype=str),
+                 phases=np.array(self.phases, dtype=str), **{name: getattr(self, name) for name in COLUMNS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['datasets'].tolist(), data['videos'].tolist(), data['phases'].tolist(),
+                       {name: data[name] for name in COLUMNS})
+
+    def __len__(self):
+        return len(self.start)
+
+    def video_rows(self, video):
+        """Row slice of a video ('dataset/video')"""
+        i = self.video_index[video]
+        return slice(int(self.video_offsets[i]), int(self.video_offsets[i + 1]))
+
+    def segments(self, video):
+        """[(phase, start, end)] of a video in temporal order"""
+        rows = self.video_rows(video)
+        return [(self.phases[p], int(s), int(e)) for p, s, e in zip(self.phase[rows], self.start[rows], self.end[rows])]
+
+    def phase_at(self, video, frame):
+        """Phase name of a frame, or None if it falls outside every segment of the video"""
+        rows = self.video_rows(video)
+        i = rows.start + int(np.searchsorted(self.start[rows], frame, side='right')) - 1
+        if i < rows.start or frame > self.end[i]:
+            return None
+        return self.phases[self.phase[i]]
+
+    def phase_rows(self, phase, dataset=None):
+        """Row indices of all segments of a phase, optionally within one dataset"""
+        mask = self.phase == self.phase_index[phase]
+        if dataset is not None:
+            mask &= self.dataset == self.datasets.index(dataset)
+        return np.flatnonzero(mask)
+
+    def frame_counts(self, dataset=None):
+        """{phase: annotated frame span} summed over segments (end - start + 1)"""
+        mask = slice(None) if dataset is None else self.dataset == self.datasets.index(dataset)
+        totals = np.bincount(self.phase[mask], weights=(self.end[mask] - self.start[mask] + 1).astype(np.float64),
+                             minlength=len(self.phases))
+        return {name: int(total) for name, total in zip(self.phases, totals) if total}
+
+    def write_count_txt(self, path, dataset):
+        """
+        count.txt as read by Cholec80/extract_frames_balanced.read_phase_info:
+        a 'videoXX-phase:' line per video and 'Phase: start-end' per phase.
+        That format holds one range per phase, so a phase occurring in several
+        segments is written as the span from its first start to its last end,
+        which then overlaps the phases in between. Returns the videos whose
+        written ranges overlap; each one is also warned about.
+        """
+        code = self.datasets.index(dataset)
+        overlapping = []
+        with open(path, 'w') as f:
+            for video in self.videos:
+                rows = self.video_rows(video)
+                if rows.start == rows.stop or self.dataset[rows.start] != code:
+                    continue
+                spans = {}
+                for phase, start, end in self.segments(video):
+                    first = spans.get(phase, (start, end))
+                    spans[phase] = (min(first[0], start), max(first[1], end))
+                name = video.split('/', 1)[1]
+                ordered = sorted(spans.values())
+                if any(start <= previous_end for (_, previous_end), (start, _) in zip(ordered, ordered[1:])):
+                    overlapping.append(video)
+                    recurring = [phase for phase, count in Counter(self.phases[p] for p in self.phase[rows]).items() if count > 1]
+                    print(f"Warning: {name} has recurring phases ({', '.join(recurring)}); their count.txt ranges overlap")
+                f.write(f"{name}-phase:\n")
+                for phase, (start, end) in spans.items():
+                    f.write(f"{phase}: {start}-{end}\n")
+                f.write("\n")
+        return overlapping
+
+def main():
+    parser = argparse.ArgumentParser(description='Derive run-length phase segments for every video into a columnar table')
+    parser.add_argument('--cholec80_dir', default=None, help='Cholec80 phase_annotations directory (videoXX-phase.txt)')
+    parser.add_argument('--autolaparo_dir', default=None, help='AutoLaparo labels directory (label_XX.txt)')
+    parser.add_argument('--cholect50_dir', default=None, help='CholecT50 labels directory (VIDXX.json)')
+    parser.add_argument('--output', '-o', default='phase_segments.npz', help='Segment table (.npz)')
+    parser.add_argument('--count_txt', default=None, help='Also write Cholec80 phase ranges in the count.txt format of extract_frames_balanced.py')
+    args = parser.parse_args()
+
+    sources = {}
+    if args.cholec80_dir:
+        sources['cholec80'] = read_cholec80(args.cholec80_dir)
+    if args.autolaparo_dir:
+        sources['autolaparo'] = read_autolaparo(args.autolaparo_dir)
+    if args.cholect50_dir:
+        sources['cholect50'] = read_cholect50(args.cholect50_dir)
+    if not sources:
+        parser.error('give at least one of --cholec80_dir, --autolaparo_dir, --cholect50_dir')
+
+    table = SegmentTable.from_sources(sources)
+    table.save(args.output)
+    for code, dataset in enumerate(table.datasets):
+        rows = table.dataset == code
+        videos = len(np.unique(table.video[rows]))
+        mean = (table.end[rows] - table.start[rows] + 1).mean() if rows.any() else 0
+        print(f"{dataset}: {videos} videos, {int(rows.sum())} segments, mean length {mean:.1f} frames")
+    print(f"Segment table saved to {args.output}")
+    if args.count_txt:
+        if 'cholec80' not in table.datasets:
+            parser.error('--count_txt needs --cholec80_dir')
+        overlapping = table.write_count_txt(args.count_txt, 'cholec80')
+        print(f"count.txt written to {args.count_txt} ({len(overlapping)} videos with overlapping phase ranges)")
+
+if __name__ == "__main__":
+    main()
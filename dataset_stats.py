@@ -0,0 +1,199 @@
+import argparse
+import json
+import re
+from collections import Counter, defaultdict
+
+from dedup_datasets import get_image_paths, get_question_answer, get_video_key
+
+MCQ_LETTER = re.compile(r"^([A-Z])\.\s*")
+PHASE_PREFIX = re.compile(r"(?i)^the\s+(current\s+)?phase\s+is\s*")
+# Column order of the row table; counts are kept per unique combination
+COLUMNS = ('split', 'dataset', 'task', 'phase', 'video')
+MISSING = '-'
+
+def get_task(file_name):
+    """Task name of a ready/ file, e.g. 'train_mcq_phase.jsonl' -> 'mcq_phase'."""
+    stem = file_name.rsplit('.', 1)[0]
+    return stem.split('_', 1)[1] if '_' in stem else stem
+
+def get_answer_class(answer):
+    """Answer text without the MCQ letter, used as the class of the record."""
+    return MCQ_LETTER.sub('', answer).strip()
+
+def get_phase(item, task, answer_class):
+    meta = item.get('meta') or {}
+    if 'phase' in meta:
+        return str(meta['phase'])
+    if 'phase' in task:
+        return PHASE_PREFIX.sub('', answer_class).strip() or MISSING
+    return MISSING
+
+class DatasetStats:
+    """
+    Streaming statistics over merged records. Counts are stored as a row
+    table keyed by (split, dataset, task, phase, video), from which every
+    per-column marginal is derived, plus answer-class and MCQ answer-letter
+    histograms per (split, dataset, task). Instances can be merged, so
+    per-shard statistics can be combined without re-reading records.
+    """
+    def __init__(self):
+        self.rows = Counter()
+        self.answers = Counter()
+        self.letters = Counter()
+        self.sources = defaultdict(lambda: {'original': 0, 'kept': 0})
+
+    def update(self, item, split, dataset, file_name):
+        task = get_task(file_name)
+        _, answer = get_question_answer(item)
+        answer_class = get_answer_class(answer)
+        image_paths = get_image_paths(item)
+        video = get_video_key(image_paths[0]) if image_paths and image_paths[0] else MISSING
+
+        self.rows[(split, dataset, task, get_phase(item, task, answer_class), video)] += 1
+        self.answers[(split, dataset, task, answer_class)] += 1
+        match = MCQ_LETTER.match(answer)
+        if match:
+            self.letters[(split, dataset, task, match.group(1))] += 1
+        self.sources[f"{dataset}/{file_name}"]['kept'] += 1
+
+    def add_original(self, source, count):
+        self.sources[source]['original'] += count
+
+    def merge(self, other):
+        self.rows.update(other.rows)
+        self.answers.update(other.answers)
+        self.letters.update(other.letters)
+        for source, counts in other.sources.items():
+            self.sources[source]['original'] += counts['original']
+            self.sources[source]['kept'] += counts['kept']
+        return self
+
+    def marginal(self, *columns):
+        """Counts grouped by the given columns, e.g. marginal('split', 'dataset')."""
+        idx = [COLUMNS.index(c) for c in columns]
+        counts = Counter()
+        for row, count in self.rows.items():
+            counts[tuple(row[i] for i in idx)] += count
+        return counts
+
+    def to_dict(self):
+        """Compact, sorted and therefore diffable JSON form."""
+        def table(counter, columns):
+            keys = sorted(counter)
+            data = {col: [key[i] for key in keys] for i, col in enumerate(columns)}
+            data['count'] = [counter[key] for key in keys]
+            return data
+        return {
+            'total': sum(self.rows.values()),
+            'rows': table(self.rows, COLUMNS),
+            'answers': table(self.answers, ('split', 'dataset', 'task', 'answer')),
+            'mcq_letters': table(self.letters, ('split', 'dataset', 'task', 'letter')),
+            'sources': {source: dict(counts) for source, counts in sorted(self.sources.items())}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        def load(table, columns):
+            keys = zip(*(table[col] for col in columns))
+            return Counter(dict(zip(keys, table['count'])))
+        stats.rows = load(data['rows'], COLUMNS)
+        stats.answers = load(data['answers'], ('split', 'dataset', 'task', 'answer'))
+        stats.letters = load(data['mcq_letters'], ('split', 'dataset', 'task', 'letter'))
+        for source, counts in data['sources'].items():
+            stats.sources[source] = dict(counts)
+        return stats
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def print_summary(self):
+        print("\nDataset Statistics:")
+        print("=" * 50)
+        per_dataset = defaultdict(lambda: {'original': 0, 'kept': 0, 'files': []})
+        for source, counts in sorted(self.sources.items()):
+            dataset, file_name = source.split('/', 1)
+            per_dataset[dataset]['original'] += counts['original']
+            per_dataset[dataset]['kept'] += counts['kept']
+            per_dataset[dataset]['files'].append(file_name)
+        for dataset, stats in sorted(per_dataset.items()):
+            print(f"\nDataset: {dataset}")
+            print(f"Original examples: {stats['original']}")
+            print(f"After sampling: {stats['kept']}")
+            print(f"Files processed: {len(stats['files'])}")
+            print("Files:", ", ".join(stats['files']))
+
+        print("\nMerged Split Statistics:")
+        print("=" * 50)
+        split_dataset = self.marginal('split', 'dataset')
+        split_task = self.marginal('split', 'task')
+        split_video = self.marginal('split', 'video')
+        for (split,), total in sorted(self.marginal('split').items()):
+            print(f"\nSplit: {split}")
+            print(f"Total examples: {total}")
+            print(f"Source datasets: {', '.join(d for (s, d) in sorted(split_dataset) if s == split)}")
+            print("Tasks: " + ", ".join(f"{t} ({c})" for (s, t), c in sorted(split_task.items()) if s == split))
+            videos = sum(1 for (s, _) in split_video if s == split)
+            print(f"Videos: {videos}")
+
+        letters = Counter()
+        for (_, _, _, letter), count in self.letters.items():
+            letters[letter] += count
+        if letters:
+            total_letters = sum(letters.values())
+            print("\nMCQ answer letter balance: " + ", ".join(
+                f"{letter} {count / total_letters:.1%}" for letter, count in sorted(letters.items())))
+
+        total_original = sum(s['original'] for s in self.sources.values())
+        print(f"\nTotal original examples across all datasets: {total_original}")
+        print(f"Total examples after sampling: {sum(self.rows.values())}")
+        print(f"Total datasets processed: {len(per_dataset)}")
+
+def diff_stats(old, new, columns=('split', 'dataset', 'task', 'phase'), threshold=0.05):
+    """
+    Compare two DatasetStats on the given marginal. Returns rows whose
+    share of their split changed by more than `threshold` (absolute),
+    as (key, old_count, new_count, old_share, new_share).
+    """
+    def shares(stats):
+        counts = stats.marginal(*columns)
+        split_totals = Counter()
+        for key, count in counts.items():
+            split_totals[key[0]] += count
+        return counts, {key: count / split_totals[key[0]] for key, count in counts.items()}
+
+    old_counts, old_shares = shares(old)
+    new_counts, new_shares = shares(new)
+    changes = []
+    for key in sorted(set(old_counts) | set(new_counts)):
+        old_share = old_shares.get(key, 0.0)
+        new_share = new_shares.get(key, 0.0)
+        if abs(new_share - old_share) > threshold:
+            changes.append((key, old_counts.get(key, 0), new_counts.get(key, 0), old_share, new_share))
+    return changes
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two merged dataset statistics files')
+    parser.add_argument('old', help='Previous stats.json')
+    parser.add_argument('new', help='Current stats.json')
+    parser.add_argument('--columns', default='split,dataset,task,phase', help='Comma separated columns to compare on (first must be split)')
+    parser.add_argument('--threshold', type=float, default=0.05, help='Report share changes larger than this (default: 0.05)')
+    args = parser.parse_args()
+
+    columns = tuple(args.columns.split(','))
+    changes = diff_stats(DatasetStats.load(args.old), DatasetStats.load(args.new), columns, args.threshold)
+    if not changes:
+        print(f"No share changes larger than {args.threshold:.1%}")
+        return
+    print(f"{'/'.join(columns)}: old -> new (share of split)")
+    for key, old_count, new_count, old_share, new_share in changes:
+        print(f"{' / '.join(key)}: {old_count} ({old_share:.1%}) -> {new_count} ({new_share:.1%})")
+
+if __name__ == '__main__':
+    main()
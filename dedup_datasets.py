@@ -0,0 +1,146 @@
+import hashlib
+from collections import Counter, defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+def get_image_paths(item):
+    """Return the list of image paths referenced by a task record."""
+    images = item.get('images')
+    if images is None:
+        images = [item.get('image_path', '')]
+    elif isinstance(images, str):
+        images = [images]
+    return [img if isinstance(img, str) else img.get('path', '') for img in images]
+
+def get_question_answer(item):
+    """Extract the (question, answer) text pair from a messages-style record."""
+    question = ''
+    answer = ''
+    for message in item.get('messages', []):
+        if message.get('role') == 'user':
+            question = message.get('content', '')
+        elif message.get('role') == 'assistant':
+            answer = message.get('content', '')
+    return question, answer
+
+def get_video_key(image_path):
+    """Frames of one video share a parent directory (e.g. .../frames/01, .../VID01)."""
+    return Path(image_path).parent.name
+
+def hash64(*parts):
+    """Stable 64-bit content hash of a sequence of strings."""
+    h = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        h.update(part.encode('utf-8'))
+        h.update(b'\x00')
+    return int.from_bytes(h.digest(), 'little')
+
+def record_hash(item):
+    """Hash a record by (images, question, answer), ignoring merge metadata."""
+    question, answer = get_question_answer(item)
+    return hash64('\x1f'.join(get_image_paths(item)), question, answer)
+
+def dhash(image_path, hash_size=8):
+    """
+    64-bit difference hash of an image. Near-identical frames (consecutive
+    frames of a static scene) map to the same hash. Returns None if the
+    image cannot be read.
+    """
+    import cv2
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    resized = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (resized[:, 1:] > resized[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+PHASH_CACHE_SIZE = 65536
+
+class HashSet:
+    """
+    Compact set of 64-bit hashes backed by a sorted uint64 array.
+    New hashes are buffered in a small Python set and inserted into the
+    sorted array once the buffer grows past `buffer_size`, so lookups stay
+    O(log N) with 8 bytes per hash and the buffer stays a few MB.
+    """
+    def __init__(self, values=None, buffer_size=65536):
+        self.sorted = np.unique(np.asarray(values if values is not None else [], dtype=np.uint64))
+        self.pending = set()
+        self.buffer_size = buffer_size
+
+    def __contains__(self, value):
+        if value in self.pending:
+            return True
+        idx = np.searchsorted(self.sorted, np.uint64(value))
+        return idx < len(self.sorted) and int(self.sorted[idx]) == value
+
+    def __len__(self):
+        self.flush()
+        return len(self.sorted)
+
+    def add(self, value):
+        self.pending.add(value)
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            new_values = np.unique(np.fromiter(self.pending, dtype=np.uint64, count=len(self.pending)))
+            positions = np.searchsorted(self.sorted, new_values)
+            found = positions < len(self.sorted)
+            found[found] = self.sorted[positions[found]] == new_values[found]
+            # One O(N) insert instead of re-sorting the whole array on every flush
+            self.sorted = np.insert(self.sorted, positions[~found], new_values[~found])
+            self.pending = set()
+
+class Deduplicator:
+    """
+    Streaming filter that drops exact duplicates (same images, question and
+    answer) and, with `use_phash`, keeps at most `max_near_duplicates`
+    records per (video, perceptual hash, question, answer) bucket.
+    Removed counts are tracked per source.
+    """
+    def __init__(self, hash_set=None, use_phash=False, max_near_duplicates=1):
+        self.hash_set = hash_set if hash_set is not None else HashSet()
+        self.use_phash = use_phash
+        self.max_near_duplicates = max_near_duplicates
+        self.near_counts = Counter()
+        # Frames are shared by the MCQ and VQA records of nearby lines; a bounded cache covers those
+        self.get_phash = lru_cache(maxsize=PHASH_CACHE_SIZE)(dhash)
+        self.removed = defaultdict(Counter)
+
+    def keep(self, item, source):
+        """Return True if the record should be kept, updating internal state."""
+        key = record_hash(item)
+        if key in self.hash_set:
+            self.removed[source]['exact'] += 1
+            return False
+        self.hash_set.add(key)
+
+        if self.use_phash:
+            image_paths = get_image_paths(item)
+            phashes = [self.get_phash(path) for path in image_paths]
+            if image_paths and None not in phashes:
+                question, answer = get_question_answer(item)
+                near_key = hash64(get_video_key(image_paths[0]), ','.join(map(str, phashes)), question, answer)
+                self.near_counts[near_key] += 1
+                if self.near_counts[near_key] > self.max_near_duplicates:
+                    self.removed[source]['near'] += 1
+                    return False
+        return True
+
+    def print_report(self, title):
+        print(f"\nDeduplication ({title}):")
+        if not self.removed:
+            print("No duplicates removed")
+            return
+        for source in sorted(self.removed):
+            counts = self.removed[source]
+            print(f"{source}: removed {counts['exact']} exact, {counts['near']} near duplicates")
+        total = sum(sum(counts.values()) for counts in self.removed.values())
+        print(f"Total removed: {total}")
+
+    def report(self):
+        return {source: dict(counts) for source, counts in self.removed.items()}
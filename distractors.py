@@ -0,0 +1,158 @@
+import random
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from surgical_kg import PHASE, load_default_graph
+
+KG_FILE = Path(__file__).resolve().parent / 'testlap_data.cypher'
+# Share of the sampling mass spread uniformly over all wrong options, so hard
+# distractors stay varied and every option can still appear
+UNIFORM_MIX = 0.2
+
+def normalize_rows(weights):
+    weights = np.asarray(weights, dtype=np.float64).copy()
+    np.fill_diagonal(weights, 0.0)
+    totals = weights.sum(axis=1, keepdims=True)
+    return np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+def profile_similarity(profiles):
+    """Cosine similarity between the rows of a (options x features) count matrix"""
+    profiles = np.asarray(profiles, dtype=np.float64)
+    norms = np.linalg.norm(profiles, axis=1, keepdims=True)
+    unit = np.divide(profiles, norms, out=np.zeros_like(profiles), where=norms > 0)
+    similarity = unit @ unit.T
+    np.fill_diagonal(similarity, 0.0)
+    return similarity
+
+def order_similarity(options, order, decay=0.5):
+    """Similarity decaying with the distance of two options in a sequence (e.g. the phase order)"""
+    position = {name: i for i, name in enumerate(order)}
+    ranks = np.array([position.get(name, -1) for name in options])
+    known = ranks >= 0
+    distance = np.abs(ranks[:, None] - ranks[None, :])
+    similarity = np.where(known[:, None] & known[None, :], decay ** np.maximum(distance - 1, 0), 0.0)
+    np.fill_diagonal(similarity, 0.0)
+    return similarity
+
+def transition_similarity(sequences, options):
+    """Symmetric counts of direct transitions between options in label sequences"""
+    index = {name: i for i, name in enumerate(options)}
+    counts = np.zeros((len(options), len(options)))
+    for sequence in sequences:
+        ids = np.array([index.get(label, -1) for label in sequence])
+        if len(ids) < 2:
+            continue
+        changes = (ids[1:] != ids[:-1]) & (ids[1:] >= 0) & (ids[:-1] >= 0)
+        np.add.at(counts, (ids[:-1][changes], ids[1:][changes]), 1)
+    return counts + counts.T
+
+class DistractorSampler:
+    """
+    Weighted sampling of MCQ distractors without replacement. `weights[i, j]`
+    is how plausible option j is as a confuser for the correct option i; rows
+    are normalized and mixed with `uniform` of uniform mass once, so sampling
+    only draws keys over the precomputed rows.
+    """
+    def __init__(self, options, weights=None, uniform=UNIFORM_MIX):
+        self.options = list(options)
+        self.index = {name: i for i, name in enumerate(self.options)}
+        n = len(self.options)
+        off_diagonal = 1.0 - np.eye(n)
+        flat = normalize_rows(off_diagonal)
+        if weights is None:
+            probabilities = flat
+        else:
+            hard = normalize_rows(weights)
+            # Rows without any statistics fall back to uniform
+            hard[hard.sum(axis=1) == 0] = flat[hard.sum(axis=1) == 0]
+            probabilities = (1.0 - uniform) * hard + uniform * flat
+        self.probabilities = probabilities
+        self._rows = [row.tolist() for row in probabilities]
+
+    def sample(self, correct, k, rng=random):
+        """k distinct distractors for `correct` (Efraimidis-Spirakis keys drawn from `rng`)"""
+        i = self.index.get(correct)
+        if i is None:
+            others = [option for option in self.options if option != correct]
+            return rng.sample(others, min(k, len(others)))
+        keys = []
+        for j, p in enumerate(self._rows[i]):
+            if p > 0:
+                keys.append((rng.random() ** (1.0 / p), j))
+        keys.sort(reverse=True)
+        return [self.options[j] for _, j in keys[:k]]
+
+def cholec80_weights(frame_data_list, category, options):
+    """
+    Confusion weights for Cholec80 phases (direct transitions between phases
+    within a video) or tools (similar phase profiles, plus co-occurrence in
+    the same frame).
+    """
+    if category == 'phase':
+        videos = {}
+        for frame_data in sorted(frame_data_list, key=lambda d: d.get('id', '')):
+            video = frame_data.get('id', '')[:2]
+            videos.setdefault(video, []).append(frame_data.get('phase'))
+        return transition_similarity(videos.values(), options)
+
+    tool_index = {name: i for i, name in enumerate(options)}
+    # Count distinct (tool set, phase) combinations once, then expand the few unique ones
+    combinations = Counter()
+    for frame_data in frame_data_list:
+        tools = frozenset(tool_index[t] for t in frame_data.get('tools', []) if t in tool_index)
+        if tools:
+            combinations[(tools, frame_data.get('phase', 'Unknown'))] += 1
+    phases = sorted({phase for _, phase in combinations})
+    phase_index = {name: i for i, name in enumerate(phases)}
+    by_phase = np.zeros((len(options), max(len(phases), 1)))
+    together = np.zeros((len(options), len(options)))
+    for (tools, phase), count in combinations.items():
+        ids = list(tools)
+        by_phase[ids, phase_index[phase]] += count
+        together[np.ix_(ids, ids)] += count
+    return profile_similarity(by_phase) + profile_similarity(together)
+
+def triplet_weights(frame_data_list, category, options, parse_triplet):
+    """
+    Confusion weights for a CholecT50 component (tool, action, tissue): two
+    values are similar when they occur with the same other two components.
+    `parse_triplet` splits a triplet string into [instrument, verb, target].
+    """
+    component = {'tool': 0, 'action': 1, 'tissue': 2}[category]
+    index = {name: i for i, name in enumerate(options)}
+    contexts = {}
+    rows, cols = [], []
+    for frame_data in frame_data_list:
+        for triplet in frame_data.get('triplets', []):
+            parts = parse_triplet(triplet)
+            if len(parts) != 3 or parts[component] not in index:
+                continue
+            context = tuple(p for c, p in enumerate(parts) if c != component)
+            rows.append(index[parts[component]])
+            cols.append(contexts.setdefault(context, len(contexts)))
+    profiles = np.zeros((len(options), max(len(contexts), 1)))
+    np.add.at(profiles, (rows, cols), 1)
+    return profile_similarity(profiles)
+
+def kg_phase_weights(options, kg=None, decay=0.5):
+    """
+    Confusion weights for AutoLaparo phases from the surgical knowledge graph:
+    closeness in the phase order plus the Jaccard overlap of the phases'
+    instrument sets.
+    """
+    if kg is None:
+        kg = load_default_graph(str(KG_FILE))
+    similarity = order_similarity(options, kg.phase_order(), decay)
+    masks = []
+    for name in options:
+        try:
+            masks.append(kg.phase_masks[kg.node(PHASE, name)])
+        except KeyError:
+            masks.append(0)
+    for i, a in enumerate(masks):
+        for j, b in enumerate(masks):
+            if i != j and a | b:
+                similarity[i, j] += bin(a & b).count('1') / bin(a | b).count('1')
+    return similarity
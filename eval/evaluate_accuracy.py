@@ -2,8 +2,55 @@
 import json
 import re
 import argparse
+from array import array
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from collections import Counter, defaultdict
+
+import numpy as np
+
+# Prefixes removed anywhere in the text (case-insensitive)
+PREFIX_RULES = {
+    # "The phase is" / "The current phase is"
+    'phase_prefix': r"the\s+(?:current\s+)?phase\s+is\s*",
+    # "The complete surgical action is:"
+    'action_prefix': r"the\s+complete\s+surgical\s+action\s+is\s*:\s*",
+}
+# Multiple-choice option prefix (e.g., "A.", "F.") at the start of the remaining text
+MCQ_LETTER_PATTERN = re.compile(r"^[A-Z]\.\s*")
+
+# Rule sets per dataset/task family; 'default' applies all rules
+NORMALIZATION_PRESETS = {
+    'default': ('phase_prefix', 'action_prefix', 'mcq_letter'),
+    'phase': ('phase_prefix', 'mcq_letter'),
+    'triplet': ('action_prefix', 'mcq_letter'),
+    'none': (),
+}
+
+class LabelNormalizer:
+    """
+    Label normalization with precompiled rules. All prefix rules are
+    combined into one alternation so a string is scanned once, then the
+    MCQ letter is matched at the start. Results are memoized, since the
+    label vocabulary has only a few dozen distinct strings.
+    """
+    def __init__(self, rules=NORMALIZATION_PRESETS['default'], cache_size=4096):
+        prefixes = [PREFIX_RULES[rule] for rule in rules if rule in PREFIX_RULES]
+        self.prefix_pattern = re.compile('|'.join(prefixes), re.IGNORECASE) if prefixes else None
+        self.strip_mcq_letter = 'mcq_letter' in rules
+        self.clean = lru_cache(maxsize=cache_size)(self._clean)
+    
+    def _clean(self, text):
+        """Return (display, normalized): prefixes removed and trimmed / lowercased without spaces"""
+        if self.prefix_pattern is not None:
+            text = self.prefix_pattern.sub("", text)
+        if self.strip_mcq_letter:
+            match = MCQ_LETTER_PATTERN.match(text)
+            if match:
+                text = text[match.end():]
+        return text.strip(), text.lower().replace(" ", "")
+
+DEFAULT_NORMALIZER = LabelNormalizer()
 
 def normalize_phase(phase_text):
     """
@@ -14,17 +61,7 @@ def normalize_phase(phase_text):
     4. Converting to lowercase
     5. Removing whitespace
     """
-    # Remove "The phase is" or "The current phase is" prefixes if present
-    phase_text = re.sub(r"(?i)the\s+(current\s+)?phase\s+is\s*", "", phase_text)
-    
-    # Remove "The complete surgical action is:" prefix if present
-    phase_text = re.sub(r"(?i)the\s+complete\s+surgical\s+action\s+is\s*:\s*", "", phase_text)
-    
-    # Remove multiple-choice option prefix (e.g., "A.", "F.") if present
-    phase_text = re.sub(r"^[A-Z]\.\s*", "", phase_text)
-    
-    # Convert to lowercase and remove all whitespace
-    return phase_text.lower().replace(" ", "")
+    return DEFAULT_NORMALIZER.clean(phase_text)[1]
 
 def preprocess_label(label):
     """
@@ -34,16 +71,17 @@ def preprocess_label(label):
     3. Remove multiple-choice option prefix (e.g., "A.", "F.")
     4. Trim whitespace
     """
-    # Remove "The phase is" or "The current phase is" prefixes if present
-    label = re.sub(r"(?i)the\s+(current\s+)?phase\s+is\s*", "", label)
-    
-    # Remove "The complete surgical action is:" prefix if present
-    label = re.sub(r"(?i)the\s+complete\s+surgical\s+action\s+is\s*:\s*", "", label)
-    
-    # Remove multiple-choice option prefix if present
-    label = re.sub(r"^[A-Z]\.\s*", "", label)
-    
-    return label.strip()
+    return DEFAULT_NORMALIZER.clean(label)[0]
+
+def parse_normalization_args(preset="default", by_dataset=None):
+    """Build (default normalizer, {dataset: normalizer}) from CLI values like ['Cholect50=triplet']"""
+    normalizers = {}
+    for spec in by_dataset or []:
+        dataset, _, name = spec.partition('=')
+        if name not in NORMALIZATION_PRESETS:
+            raise ValueError(f"Unknown normalization preset '{name}' for dataset '{dataset}'")
+        normalizers[dataset] = LabelNormalizer(NORMALIZATION_PRESETS[name])
+    return LabelNormalizer(NORMALIZATION_PRESETS[preset]), normalizers
 
 def extract_answer_from_cot(text):
     """
@@ -55,106 +93,359 @@ def extract_answer_from_cot(text):
         return match.group(1).strip()
     return text
 
-def calculate_accuracy(jsonl_file, mode="normal"):
-    """Calculate the accuracy from the JSONL file"""
-    correct = 0
-    total = 0
-    predictions = []
-    true_labels_counter = Counter()
-    pred_labels_counter = Counter()
-    norm_to_orig = {}
-    original_items = []
-    
-    with open(jsonl_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if not line.strip():
-                continue
-                
-            data = json.loads(line)
-            
-            # Support different JSON formats by checking multiple possible field names
-            response = (
-                data.get("response") or 
-                data.get("prediction") or 
-                data.get("predicted_phase") or
-                data.get("output")
-            )
-            
-            labels = (
-                data.get("labels") or 
-                data.get("label") or 
-                data.get("ground_truth") or 
-                data.get("true_phase") or
-                data.get("target")
-            )
-            
-            # Skip entries with missing response or labels
-            if not response or not labels:
-                continue
-            
-            # Handle cases where response/labels might be in a nested structure
-            if isinstance(response, dict):
-                response = response.get("text", "") or response.get("value", "")
-            if isinstance(labels, dict):
-                labels = labels.get("text", "") or labels.get("value", "")
-            
-            # Convert to string if necessary
-            response = str(response).strip()
-            labels = str(labels).strip()
-            
-            # Extract answer from CoT format if mode is "cot"
-            if mode == "cot":
-                response = extract_answer_from_cot(response)
-                labels = extract_answer_from_cot(labels)
-            
-            # Store original item
-            original_items.append(data)
-            
-            # Clean for human-readable display - ignore the MCQ letters
-            clean_response = preprocess_label(response)
-            clean_labels = preprocess_label(labels)
-            
-            # Store original MCQ format for incorrect prediction display
-            original_response = response
-            original_labels = labels
-            
-            # Normalize for comparison
-            norm_response = normalize_phase(response)
-            norm_labels = normalize_phase(labels)
-            
-            # Store mapping from normalized to original (without MCQ letters)
-            norm_to_orig[norm_response] = clean_response
-            norm_to_orig[norm_labels] = clean_labels
-            
-            # Track for statistics
-            true_labels_counter[norm_labels] += 1
-            pred_labels_counter[norm_response] += 1
-            
-            # Store prediction
-            predictions.append({
+def extract_response_and_labels(data, mode="normal"):
+    """Return the (response, labels) strings of a record, or None if either is missing"""
+    # Support different JSON formats by checking multiple possible field names
+    response = (
+        data.get("response") or 
+        data.get("prediction") or 
+        data.get("predicted_phase") or
+        data.get("output")
+    )
+    
+    labels = (
+        data.get("labels") or 
+        data.get("label") or 
+        data.get("ground_truth") or 
+        data.get("true_phase") or
+        data.get("target")
+    )
+    
+    # Skip entries with missing response or labels
+    if not response or not labels:
+        return None
+    
+    # Handle cases where response/labels might be in a nested structure
+    if isinstance(response, dict):
+        response = response.get("text", "") or response.get("value", "")
+    if isinstance(labels, dict):
+        labels = labels.get("text", "") or labels.get("value", "")
+    
+    # Convert to string if necessary
+    response = str(response).strip()
+    labels = str(labels).strip()
+    
+    # Extract answer from CoT format if mode is "cot"
+    if mode == "cot":
+        response = extract_answer_from_cot(response)
+        labels = extract_answer_from_cot(labels)
+    return response, labels
+
+# Record fields holding per-class scores, {class label: score}; log probabilities rank the same way.
+# Token log probabilities ({"content": [{"token", "logprob", "top_logprobs": [...]}]}, as written by
+# OpenAI-compatible servers and swift infer) are also accepted, see token_logprob_scores.
+SCORE_FIELDS = ("scores", "logprobs")
+TOP_K = (1, 3, 5)
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value == value
+
+# "A. Preparation" lines of an MCQ prompt's option list
+OPTION_LINE = re.compile(r"^\s*([A-Z])\.\s*(\S.*?)\s*$", re.MULTILINE)
+
+def mcq_options(data):
+    """{letter: option text} listed in the last user message of a record, or {} if it has none"""
+    for message in reversed(data.get("messages") or []):
+        if isinstance(message, dict) and message.get("role") == "user":
+            content = message.get("content")
+            return dict(OPTION_LINE.findall(content)) if isinstance(content, str) else {}
+    return {}
+
+def token_logprob_scores(logprobs, options=None):
+    """
+    Per-class scores from token log probabilities: the top_logprobs of the
+    first generated token that is not whitespace, keyed by token text. With
+    MCQ `options` ({letter: option text}), letter tokens are keyed by their
+    option text, since labels are "A. <option>", and other tokens are
+    dropped. Returns None if the shape does not match or nothing is left.
+    """
+    content = logprobs.get("content")
+    if not isinstance(content, list):
+        return None
+    for position in content:
+        if not isinstance(position, dict) or not str(position.get("token", "")).strip():
+            continue
+        candidates = position.get("top_logprobs") or [position]
+        scores = {}
+        for candidate in candidates:
+            if not isinstance(candidate, dict) or not is_number(candidate.get("logprob")):
+                return None
+            token = str(candidate.get("token", "")).strip()
+            if options:
+                token = options.get(token.rstrip('.'), '')
+            if token:
+                scores[token] = max(scores.get(token, -float('inf')), float(candidate["logprob"]))
+        return scores or None
+    return None
+
+def extract_scores(data):
+    """
+    Return the per-class score dict of a record, or None if it has none.
+    Records whose scores are not all numbers count as unscored.
+    """
+    for field in SCORE_FIELDS:
+        scores = data.get(field)
+        if not isinstance(scores, dict) or not scores:
+            continue
+        if "content" in scores:
+            return token_logprob_scores(scores, mcq_options(data))
+        if all(is_number(score) for score in scores.values()):
+            return scores
+        return None
+    return None
+
+def get_image_paths(data):
+    """Image paths of a record, as dedup_datasets.get_image_paths (kept here so eval/ runs on its own)"""
+    images = data.get('images')
+    if images is None:
+        images = [data.get('image_path', '')]
+    elif isinstance(images, str):
+        images = [images]
+    return [image if isinstance(image, str) else image.get('path', '') for image in images]
+
+MISSING_GROUP = '-'
+# Class of all predictions outside the ground-truth vocabulary
+OTHER_LABEL = '<other>'
+
+def get_group_value(data, key):
+    """
+    Value of a group-by key for one record: a dotted path into the record
+    (e.g. '_source.dataset', 'meta.phase'), or 'video' for the directory
+    name of the first image.
+    """
+    if key == 'video':
+        images = get_image_paths(data)
+        return Path(images[0]).parent.name if images and images[0] else MISSING_GROUP
+    value = data
+    for part in key.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING_GROUP
+        value = value[part]
+    return str(value)
+
+class StreamingEvaluator:
+    """
+    Incremental evaluator with memory bounded by the label vocabulary.
+    Each record only adds two integer label ids; incorrect records are
+    written to `failure_file` as their raw input bytes while streaming.
+    Per-record display strings are kept only when explicitly requested
+    (`keep_incorrect` for --verbose, `keep_predictions` for --debug).
+    For every `group_by` key, each record also gets the integer id of its
+    group value so metrics can be sliced after the single pass. Per-class
+    scores (see SCORE_FIELDS) are kept as sparse (row, column, score)
+    triplets and only densified when ranked metrics are computed; a record
+    whose scores do not include its true label counts as unscored.
+    Metrics are computed over the ground-truth vocabulary: predictions of
+    any other label (e.g. free-text answers) share one OTHER_LABEL class,
+    so matrices stay bounded by the number of true classes.
+    """
+    def __init__(self, mode="normal", failure_file=None, keep_incorrect=False, keep_predictions=False,
+                 normalizer=None, dataset_normalizers=None, group_by=None):
+        self.mode = mode
+        # Normalization rules, optionally chosen per record by _source.dataset
+        self.normalizer = normalizer or DEFAULT_NORMALIZER
+        self.dataset_normalizers = dataset_normalizers or {}
+        self.correct = 0
+        self.total = 0
+        self.norm_to_orig = {}
+        self.label_ids = {}
+        self.true_ids = array('i')
+        self.pred_ids = array('i')
+        self.failure_file = failure_file
+        self.failures = 0
+        self._failure_f = None
+        self.incorrect = [] if keep_incorrect else None
+        self.predictions = [] if keep_predictions else None
+        self.group_by = list(group_by or [])
+        self.group_values = {key: {} for key in self.group_by}
+        self.group_ids = {key: array('i') for key in self.group_by}
+        # Score columns are normalized class labels, which may never occur as truth or prediction
+        self.score_ids = {}
+        self.score_rows = array('i')
+        self.score_cols = array('i')
+        self.score_values = array('d')
+        self.unscored = 0
+        self._vocabulary = None
+    
+    def update_line(self, line):
+        """Evaluate one raw JSONL line (bytes or str)"""
+        if not line.strip():
+            return
+        self.update(json.loads(line), line)
+    
+    def update(self, data, raw_line=None):
+        """Evaluate one parsed record; `raw_line` is what gets written on failure"""
+        fields = extract_response_and_labels(data, self.mode)
+        if fields is None:
+            return
+        response, labels = fields
+        # Parsed before any state changes, so a malformed record cannot leave the arrays misaligned
+        scores = extract_scores(data)
+        
+        normalizer = self.normalizer
+        if self.dataset_normalizers:
+            source = data.get("_source") or {}
+            normalizer = self.dataset_normalizers.get(source.get("dataset"), normalizer)
+        
+        # Clean for human-readable display (MCQ letters removed) and normalize for comparison
+        clean_response, norm_response = normalizer.clean(response)
+        clean_labels, norm_labels = normalizer.clean(labels)
+        
+        # Store mapping from normalized to original (without MCQ letters)
+        self.norm_to_orig[norm_response] = clean_response
+        self.norm_to_orig[norm_labels] = clean_labels
+        
+        # Map labels to integer ids once; all metrics are derived from these
+        self.true_ids.append(self.label_ids.setdefault(norm_labels, len(self.label_ids)))
+        self.pred_ids.append(self.label_ids.setdefault(norm_response, len(self.label_ids)))
+        for key in self.group_by:
+            values = self.group_values[key]
+            self.group_ids[key].append(values.setdefault(get_group_value(data, key), len(values)))
+        
+        if scores is not None:
+            normalized = {}
+            for label, score in scores.items():
+                label = normalizer.clean(label)[1]
+                normalized[label] = max(normalized.get(label, -float('inf')), float(score))
+            # Scores that cannot rank the true class would pass as confident misses
+            scores = normalized if norm_labels in normalized else None
+        if scores is None:
+            self.unscored += 1
+        else:
+            for label, score in scores.items():
+                self.score_rows.append(self.total)
+                self.score_cols.append(self.score_ids.setdefault(label, len(self.score_ids)))
+                self.score_values.append(score)
+        
+        # Check if normalized strings match
+        is_correct = norm_response == norm_labels
+        if is_correct:
+            self.correct += 1
+        else:
+            self.write_failure(data if raw_line is None else raw_line)
+            if self.incorrect is not None:
+                # Store original MCQ format for incorrect prediction display
+                self.incorrect.append((labels, response))
+        self.total += 1
+        
+        if self.predictions is not None:
+            self.predictions.append({
                 'true': norm_labels,
                 'pred': norm_response,
                 'true_display': clean_labels,
                 'pred_display': clean_response,
-                'original_response': original_response,  # Store original with MCQ format
-                'original_labels': original_labels,      # Store original with MCQ format
-                'correct': norm_response == norm_labels,
-                'original_item': data  # Store original item
+                'correct': is_correct
             })
-            
-            # Check if normalized strings match
-            if norm_response == norm_labels:
-                correct += 1
-            
-            total += 1
-    
-    # Build confusion matrix (using normalized labels)
-    confusion = defaultdict(lambda: defaultdict(int))
-    for pred in predictions:
-        confusion[pred['true']][pred['pred']] += 1
     
-    accuracy = correct / total if total > 0 else 0
-    return accuracy, confusion, correct, total, true_labels_counter, pred_labels_counter, predictions, norm_to_orig
+    def write_failure(self, record):
+        if not self.failure_file:
+            return
+        if self._failure_f is None:
+            self._failure_f = open(self.failure_file, 'wb')
+        if isinstance(record, dict):
+            record = json.dumps(record)
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        self._failure_f.write(record if record.endswith(b'\n') else record + b'\n')
+        self.failures += 1
+    
+    def close(self):
+        if self._failure_f is not None:
+            self._failure_f.close()
+            self._failure_f = None
+    
+    @property
+    def accuracy(self):
+        return self.correct / self.total if self.total > 0 else 0
+    
+    def vocabulary(self):
+        """
+        (labels, remap): the ground-truth labels in id order, plus OTHER_LABEL
+        if some prediction is none of them, and the map from every label id
+        to its index in `labels`. Cached until the next record.
+        """
+        if self._vocabulary is None or self._vocabulary[0] != self.total:
+            names = list(self.label_ids)
+            true_ids = np.frombuffer(self.true_ids, dtype=np.intc)
+            vocab = np.flatnonzero(np.bincount(true_ids, minlength=len(names)))
+            remap = np.full(len(names), len(vocab), dtype=np.intc)
+            remap[vocab] = np.arange(len(vocab), dtype=np.intc)
+            labels = [names[i] for i in vocab]
+            if np.any(remap[np.frombuffer(self.pred_ids, dtype=np.intc)] == len(vocab)):
+                labels.append(OTHER_LABEL)
+            self._vocabulary = (self.total, labels, remap)
+        return self._vocabulary[1], self._vocabulary[2]
+    
+    @property
+    def labels(self):
+        return self.vocabulary()[0]
+    
+    def id_arrays(self):
+        """(true_ids, pred_ids) as NumPy arrays of indices into `labels`, in input order"""
+        _, remap = self.vocabulary()
+        return (remap[np.frombuffer(self.true_ids, dtype=np.intc)],
+                remap[np.frombuffer(self.pred_ids, dtype=np.intc)])
+    
+    def confusion_matrix(self):
+        true_ids, pred_ids = self.id_arrays()
+        return build_confusion_matrix(true_ids, pred_ids, len(self.labels))
+    
+    @property
+    def has_scores(self):
+        """Ranked metrics need scores on every record"""
+        return self.total > 0 and self.unscored == 0
+    
+    def score_matrix(self):
+        """
+        Dense (records x classes) score matrix, or None unless every record
+        has scores. The first columns follow `labels`; scored classes outside
+        the ground-truth vocabulary come after them. Unscored classes are -inf.
+        """
+        if not self.has_scores:
+            return None
+        labels, _ = self.vocabulary()
+        positions = {label: i for i, label in enumerate(labels) if label != OTHER_LABEL}
+        columns = np.empty(len(self.score_ids), dtype=np.intp)
+        extra = len(labels)
+        for label, col in self.score_ids.items():
+            if label in positions:
+                columns[col] = positions[label]
+            else:
+                columns[col] = extra
+                extra += 1
+        scores = np.full((self.total, extra), -np.inf)
+        rows = np.frombuffer(self.score_rows, dtype=np.intc)
+        cols = columns[np.frombuffer(self.score_cols, dtype=np.intc)]
+        scores[rows, cols] = np.frombuffer(self.score_values, dtype=np.float64)
+        return scores
+    
+    def slices(self, key, scores=None):
+        """{group value: (true_ids, pred_ids, scores)} for one group_by key, values sorted"""
+        true_ids, pred_ids = self.id_arrays()
+        group_ids = np.frombuffer(self.group_ids[key], dtype=np.intc)
+        result = {}
+        for value, group_id in sorted(self.group_values[key].items()):
+            mask = group_ids == group_id
+            result[value] = (true_ids[mask], pred_ids[mask], None if scores is None else scores[mask])
+        return result
+
+def evaluate_file(jsonl_file, mode="normal", failure_file=None, keep_incorrect=False, keep_predictions=False,
+                  normalizer=None, dataset_normalizers=None, group_by=None):
+    """Stream a JSONL file through a StreamingEvaluator, reading raw lines"""
+    evaluator = StreamingEvaluator(mode, failure_file, keep_incorrect, keep_predictions, normalizer,
+                                   dataset_normalizers, group_by)
+    try:
+        with open(jsonl_file, 'rb') as f:
+            for line in f:
+                evaluator.update_line(line)
+    finally:
+        evaluator.close()
+    return evaluator
+
+def build_confusion_matrix(true_ids, pred_ids, num_labels):
+    """Dense confusion matrix (rows: true, columns: predicted) in a single bincount pass"""
+    flat = np.bincount(true_ids.astype(np.int64) * num_labels + pred_ids, minlength=num_labels * num_labels)
+    return flat.reshape(num_labels, num_labels)
 
 def get_max_class_name_length(classes, norm_to_orig):
     """Get the maximum length of class names for formatting"""
@@ -164,64 +455,61 @@ def get_max_class_name_length(classes, norm_to_orig):
         max_length = max(max_length, len(display_name))
     return max_length
 
-def print_confusion_matrix(confusion, true_labels_counter, norm_to_orig):
+def print_confusion_matrix(confusion, labels, norm_to_orig):
     """Print a better formatted confusion matrix"""
-    # Get all unique class labels
-    all_classes = set()
-    for true_label in confusion:
-        all_classes.add(true_label)
-        for pred_label in confusion[true_label]:
-            all_classes.add(pred_label)
-    
-    all_classes = sorted(all_classes)
+    # Columns: every ground-truth label, plus OTHER_LABEL for any other prediction
+    all_classes = sorted(range(len(labels)), key=lambda i: labels[i])
+    support = confusion.sum(axis=1).tolist()
+    counts = confusion.tolist()
     
     # Get maximum class name length for better formatting
-    max_class_length = get_max_class_name_length(all_classes, norm_to_orig) + 2  # Add padding
+    max_class_length = get_max_class_name_length(labels, norm_to_orig) + 2  # Add padding
     max_class_length = min(max_class_length, 30)  # Cap at reasonable length
     
     # Print header
     print("\nConfusion Matrix:")
-    header = f"{'True\\Pred':{max_class_length}}"
+    corner = 'True\\Pred'
+    header = f"{corner:{max_class_length}}"
     for cls in all_classes:
-        display_cls = norm_to_orig.get(cls, cls)
+        display_cls = norm_to_orig.get(labels[cls], labels[cls])
         header += f" | {display_cls[:12]:<12}"
     print(header)
     print("-" * len(header))
     
-    # Print rows
-    for true_label in sorted(confusion.keys(), key=lambda x: norm_to_orig.get(x, x)):
-        display_true = norm_to_orig.get(true_label, true_label)
+    # Print rows for labels that occur as ground truth
+    true_classes = [i for i in range(len(labels)) if support[i] > 0]
+    for true_label in sorted(true_classes, key=lambda i: norm_to_orig.get(labels[i], labels[i])):
+        display_true = norm_to_orig.get(labels[true_label], labels[true_label])
         row = f"{display_true:{max_class_length}}"
         for pred_label in all_classes:
-            count = confusion[true_label][pred_label]
+            count = counts[true_label][pred_label]
             # Calculate percentage of this class
-            total_for_class = true_labels_counter[true_label]
+            total_for_class = support[true_label]
             percentage = (count / total_for_class) * 100 if total_for_class > 0 else 0
             row += f" | {count:>3} ({percentage:>4.1f}%)"
         print(row)
 
-def calculate_class_metrics(predictions):
-    """Calculate per-class precision, recall, and F1 scores using normalized labels"""
-    # Get unique normalized class labels
-    class_labels = set()
-    for p in predictions:
-        class_labels.add(p['true'])
+def calculate_class_metrics(confusion, labels):
+    """Calculate per-class precision, recall, and F1 scores from the confusion matrix"""
+    tps = np.diag(confusion).tolist()
+    predicted = confusion.sum(axis=0).tolist()
+    supports = confusion.sum(axis=1).tolist()
     
     metrics = {}
-    for cls in class_labels:
-        # For each class, count metrics using normalized labels
-        tp = sum(1 for p in predictions if p['pred'] == cls and p['true'] == cls)
-        fp = sum(1 for p in predictions if p['pred'] == cls and p['true'] != cls)
-        fn = sum(1 for p in predictions if p['pred'] != cls and p['true'] == cls)
+    for idx, cls in enumerate(labels):
+        # Only classes that occur as ground truth are reported
+        support = supports[idx]
+        if support == 0:
+            continue
+        tp = tps[idx]
+        fp = predicted[idx] - tp
+        fn = support - tp
         
         # Calculate standard metrics
         precision = tp / (tp + fp) if (tp + fp) > 0 else 0
         recall = tp / (tp + fn) if (tp + fn) > 0 else 0
         f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
         
-        # Calculate support
-        support = sum(1 for p in predictions if p['true'] == cls)
-        
         metrics[cls] = {
             'precision': precision,
             'recall': recall,
@@ -234,209 +522,369 @@ def calculate_class_metrics(predictions):
     
     return metrics
 
-def calculate_precision_recall_curve(predictions, class_label):
-    """Calculate precision and recall values for a specific class"""
-    tp = 0  # True positives
-    fp = 0  # False positives
-    fn = sum(1 for p in predictions if p['true'] == class_label)  # False negatives
-    
-    precisions = []
-    recalls = []
-    
-    # For each prediction, calculate precision and recall
-    for pred in predictions:
-        if pred['pred'] == class_label:
-            if pred['true'] == class_label:
-                tp += 1
-            else:
-                fp += 1
-            
-            # Calculate current precision and recall
-            current_precision = tp / (tp + fp) if (tp + fp) > 0 else 0
-            current_recall = tp / (tp + fn) if (tp + fn) > 0 else 0
-            
-            precisions.append(current_precision)
-            recalls.append(current_recall)
-    
-    # Add the final point (0,0) if not present
-    if not precisions or precisions[-1] != 0:
-        precisions.append(0)
-        recalls.append(0)
+def calculate_average_metrics(class_metrics, sorted_classes):
+    """Macro and weighted averages of the per-class metrics, accumulated in display order"""
+    macro = {'precision': 0, 'recall': 0, 'f1': 0}
+    weighted = {'precision': 0, 'recall': 0, 'f1': 0}
+    total_support = 0
+    for cls in sorted_classes:
+        metrics = class_metrics[cls]
+        support = metrics['support']
+        total_support += support
+        for key in macro:
+            macro[key] += metrics[key]
+            weighted[key] += metrics[key] * support
     
-    return precisions, recalls
+    num_classes = len(sorted_classes)
+    if num_classes > 0:
+        macro = {key: value / num_classes for key, value in macro.items()}
+    if total_support > 0:
+        weighted = {key: value / total_support for key, value in weighted.items()}
+    return macro, weighted, total_support
 
-def calculate_average_precision(precisions, recalls):
-    """Calculate average precision using 11-point interpolation"""
-    if not precisions or not recalls:
-        return 0.0
-    
-    # 11-point interpolation
-    recall_levels = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
-    interpolated_precisions = []
-    
-    for r in recall_levels:
-        # Find the maximum precision for recall >= r
-        max_precision = 0.0
-        for p, rec in zip(precisions, recalls):
-            if rec >= r:
-                max_precision = max(max_precision, p)
-        interpolated_precisions.append(max_precision)
+# Recall levels of the 11-point interpolated average precision
+RECALL_LEVELS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+def calculate_average_precisions(true_ids, pred_ids, num_labels):
+    """
+    11-point interpolated AP per class, with predictions taken in file order.
+    For class c, walking the predictions of c in order gives
+    precision = tp / (tp + fp) and recall = tp / (tp + support); the
+    interpolated precision at recall level r is the maximum precision over
+    the points with recall >= r. One stable sort groups the predictions by
+    class, then each class is a cumulative sum over its own segment.
+    Returns {class id: AP} for classes that occur as ground truth.
+    """
+    support = np.bincount(true_ids, minlength=num_labels).tolist()
+    order = np.argsort(pred_ids, kind='stable')
+    hits = true_ids[order] == pred_ids[order]
+    bounds = np.searchsorted(pred_ids[order], np.arange(num_labels + 1))
+    
+    aps = {}
+    for cls in range(num_labels):
+        if support[cls] == 0:
+            continue
+        segment = hits[bounds[cls]:bounds[cls + 1]]
+        if len(segment) == 0:
+            aps[cls] = 0.0
+            continue
+        tp = np.cumsum(segment)
+        precisions = tp / np.arange(1, len(segment) + 1)
+        recalls = tp / (tp + support[cls])
+        # Recall never decreases along the walk, so points with recall >= r form a suffix
+        suffix_max = np.maximum.accumulate(precisions[::-1])[::-1].tolist()
+        starts = np.searchsorted(recalls, RECALL_LEVELS, side='left').tolist()
+        interpolated = [max(0.0, suffix_max[i]) if i < len(segment) else 0.0 for i in starts]
+        aps[cls] = sum(interpolated) / len(RECALL_LEVELS)
+    return aps
+
+def calculate_ranked_average_precisions(true_ids, scores, num_labels):
+    """
+    Exact (non-interpolated) AP per class from per-record scores, as in the
+    Cholec80/CholecT50 literature: records are ranked by descending score
+    and AP = sum over score thresholds of (R_n - R_n-1) * P_n, where tied
+    scores form a single threshold. Each class is one sort and one
+    cumulative sum over all records.
+    Returns {class id: AP} for classes that occur as ground truth.
+    """
+    support = np.bincount(true_ids, minlength=num_labels).tolist()
+    aps = {}
+    for cls in range(num_labels):
+        if support[cls] == 0:
+            continue
+        column = scores[:, cls]
+        order = np.argsort(-column, kind='stable')
+        ranked = column[order]
+        tp = np.cumsum(true_ids[order] == cls)
+        # Last position of every group of tied scores
+        thresholds = np.flatnonzero(np.append(ranked[1:] != ranked[:-1], True))
+        tp = tp[thresholds]
+        precisions = tp / (thresholds + 1)
+        recalls = tp / support[cls]
+        aps[cls] = float(np.sum(np.diff(recalls, prepend=0.0) * precisions))
+    return aps
+
+def calculate_top_k_accuracy(true_ids, scores, ks=TOP_K):
+    """Share of records whose true class is among the k highest scores; ties count against the true class"""
+    if len(true_ids) == 0:
+        return {k: 0.0 for k in ks}
+    true_scores = scores[np.arange(len(true_ids)), true_ids]
+    ranks = np.count_nonzero(scores >= true_scores[:, None], axis=1) - 1
+    scored = np.isfinite(true_scores)
+    return {k: float(np.mean(scored & (ranks < k))) for k in ks}
+
+def calculate_map(true_ids, pred_ids, labels, scores=None):
+    """Calculate mean Average Precision for all classes, ranked by scores when available"""
+    if scores is not None:
+        aps = calculate_ranked_average_precisions(true_ids, scores, len(labels))
+    else:
+        aps = calculate_average_precisions(true_ids, pred_ids, len(labels))
+    ordered = [aps[cls] for cls in sorted(aps, key=lambda i: labels[i])]
+    return sum(ordered) / len(ordered) if ordered else 0.0
+
+def summarize_ids(true_ids, pred_ids, labels, norm_to_orig, scores=None):
+    """Headline and per-class metrics of aligned label id arrays (and optional score matrix)"""
+    class_metrics = calculate_class_metrics(build_confusion_matrix(true_ids, pred_ids, len(labels)), labels)
+    sorted_classes = sorted(class_metrics, key=lambda x: norm_to_orig.get(x, x))
+    macro, weighted, _ = calculate_average_metrics(class_metrics, sorted_classes)
+    total = len(true_ids)
+    correct = int(np.count_nonzero(true_ids == pred_ids))
+    summary = {
+        'accuracy': correct / total if total > 0 else 0,
+        'correct': correct,
+        'total': total,
+        'map': calculate_map(true_ids, pred_ids, labels, scores),
+        'macro': macro,
+        'weighted': weighted,
+        'class_metrics': class_metrics
+    }
+    if scores is not None:
+        summary['top_k_accuracy'] = calculate_top_k_accuracy(true_ids, scores)
+    return summary
+
+def summarize_evaluator(evaluator):
+    """Headline and per-class metrics of an evaluator as a JSON-serializable dict"""
+    true_ids, pred_ids = evaluator.id_arrays()
+    summary = summarize_ids(true_ids, pred_ids, evaluator.labels, evaluator.norm_to_orig, evaluator.score_matrix())
+    summary['norm_to_orig'] = evaluator.norm_to_orig
+    return summary
+
+def summarize_slices(evaluator, scores=None):
+    """{group_by key: {group value: summary}} computed from the single evaluation pass"""
+    labels, norm_to_orig = evaluator.labels, evaluator.norm_to_orig
+    if scores is None and evaluator.group_by:
+        scores = evaluator.score_matrix()
+    return {
+        key: {value: summarize_ids(true_ids, pred_ids, labels, norm_to_orig, value_scores)
+              for value, (true_ids, pred_ids, value_scores) in evaluator.slices(key, scores).items()}
+        for key in evaluator.group_by
+    }
+
+def print_slice_table(key, slices, norm_to_orig):
+    """Print headline metrics and per-class F1 with one column per slice"""
+    values = list(slices)
+    classes = sorted({cls for summary in slices.values() for cls in summary['class_metrics']},
+                     key=lambda x: norm_to_orig.get(x, x))
+    name_width = min(max([get_max_class_name_length(classes, norm_to_orig), len('Weighted F1')]), 30)
+    col_width = max([len(value[:20]) for value in values] + [8])
+    
+    print(f"\nMetrics by {key}:")
+    header = f"{'Metric':{name_width}}" + "".join(f" {value[:20]:>{col_width}}" for value in values)
+    print(header)
+    print("-" * len(header))
+    print(f"{'Total':{name_width}}" + "".join(f" {slices[v]['total']:>{col_width}}" for v in values))
+    rows = [('Accuracy', lambda s: s['accuracy']), ('mAP', lambda s: s['map']),
+            ('Macro F1', lambda s: s['macro']['f1']), ('Weighted F1', lambda s: s['weighted']['f1'])]
+    for name, get in rows:
+        print(f"{name:{name_width}}" + "".join(f" {get(slices[v]):>{col_width}.4f}" for v in values))
     
-    return sum(interpolated_precisions) / len(recall_levels)
+    print("-" * len(header))
+    for cls in classes:
+        row = f"{norm_to_orig.get(cls, cls)[:name_width]:{name_width}}"
+        for value in values:
+            metrics = slices[value]['class_metrics'].get(cls)
+            row += f" {metrics['f1']:>{col_width}.4f}" if metrics else f" {'-':>{col_width}}"
+        print(row)
+
+REPORT_VERSION = 1
+
+def build_report(evaluator, metadata=None):
+    """
+    Structured evaluation report: label vocabulary, dense confusion matrix
+    (rows: true, columns: predicted, in vocabulary order), headline and
+    per-class metrics, slices and run metadata. Everything is
+    JSON-serializable; rendering it as text is a separate step.
+    """
+    labels, norm_to_orig = evaluator.labels, evaluator.norm_to_orig
+    true_ids, pred_ids = evaluator.id_arrays()
+    scores = evaluator.score_matrix()
+    summary = summarize_ids(true_ids, pred_ids, labels, norm_to_orig, scores)
+    report = {
+        'version': REPORT_VERSION,
+        'metadata': {
+            **(metadata or {}),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'records': evaluator.total,
+            'failures': evaluator.failures,
+            'scored_records': evaluator.total - evaluator.unscored,
+            'ap': 'ranked' if scores is not None else '11-point'
+        },
+        'labels': labels,
+        'display_labels': [norm_to_orig.get(label, label) for label in labels],
+        **summary,
+        'confusion_matrix': evaluator.confusion_matrix().tolist(),
+    }
+    slices = summarize_slices(evaluator, scores)
+    if slices:
+        report['slices'] = slices
+    return report
+
+def confusion_array(report):
+    """Confusion matrix of a report as a (labels x labels) NumPy array"""
+    num_labels = len(report['labels'])
+    return np.asarray(report['confusion_matrix'], dtype=np.int64).reshape(num_labels, num_labels)
+
+def save_report(report, path, confusion_npy=None):
+    """Write the report as JSON with one line per confusion matrix row; optionally the matrix as .npy"""
+    if confusion_npy:
+        np.save(confusion_npy, confusion_array(report))
+        report = {**report, 'metadata': {**report['metadata'], 'confusion_npy': str(confusion_npy)}}
+    placeholder = '"__confusion_matrix__"'
+    text = json.dumps({**report, 'confusion_matrix': None}, indent=2).replace(
+        '"confusion_matrix": null', f'"confusion_matrix": {placeholder}', 1)
+    rows = ',\n'.join(f"    {json.dumps(row, separators=(',', ':'))}" for row in report['confusion_matrix'])
+    text = text.replace(placeholder, f"[\n{rows}\n  ]" if rows else "[]", 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
 
-def calculate_map(predictions):
-    """Calculate mean Average Precision for all classes"""
-    # Get unique class labels
-    class_labels = set(p['true'] for p in predictions)
-    aps = []
+def load_report(path):
+    """Load a saved report; the confusion matrix is returned as a NumPy array"""
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    report['confusion_matrix'] = confusion_array(report)
+    return report
+
+def render_report(report, evaluator=None, verbose=False, debug=False):
+    """
+    Print a report. Headline metrics and slices are always shown; per-class
+    metrics and the confusion matrix only with `verbose` or `debug`, and
+    per-record details only if the evaluator kept them.
+    """
+    labels = report['labels']
+    norm_to_orig = dict(zip(labels, report['display_labels']))
+    
+    if report['metadata']['scored_records'] and report['metadata']['ap'] != 'ranked':
+        print(f"Warning: {report['total'] - report['metadata']['scored_records']}/{report['total']} records have no scores, "
+              f"using 11-point AP in file order")
+    print(f"\nOverall Accuracy: {report['accuracy']:.4f} ({report['correct']}/{report['total']})")
+    print(f"Mean Average Precision (mAP): {report['map']:.4f}")
+    if 'top_k_accuracy' in report:
+        print("Top-k Accuracy: " + ", ".join(f"top-{k} {value:.4f}" for k, value in report['top_k_accuracy'].items()))
+    
+    if verbose or debug:
+        confusion = confusion_array(report)
+        class_metrics = report['class_metrics']
+        
+        # Debug print
+        if debug and evaluator is not None and evaluator.predictions is not None:
+            print("\nPredictions (Normalized):")
+            for i, pred in enumerate(evaluator.predictions, 1):
+                print(f"{i}. True: '{pred['true']}' (Display: '{pred['true_display']}'), "
+                      f"Pred: '{pred['pred']}' (Display: '{pred['pred_display']}'), "
+                      f"Correct: {pred['correct']}")
+        if debug:
+            print("\nNormalized Mappings:")
+            for norm, orig in norm_to_orig.items():
+                print(f"Normalized: '{norm}' -> Original: '{orig}'")
+            
+            print("\nConfusion Matrix (Raw):")
+            for true_idx, pred_idx in zip(*np.nonzero(confusion)):
+                true_label, pred_label = labels[true_idx], labels[pred_idx]
+                print(f"True: '{true_label}' (Display: '{norm_to_orig[true_label]}'), "
+                      f"Pred: '{pred_label}' (Display: '{norm_to_orig[pred_label]}'), "
+                      f"Count: {confusion[true_idx, pred_idx]}")
+        
+        # Get maximum class name length for better formatting
+        sorted_classes = sorted(class_metrics.keys(), key=lambda x: norm_to_orig.get(x, x))
+        max_class_length = get_max_class_name_length(sorted_classes, norm_to_orig)
+        # Cap at reasonable length to prevent overly wide output
+        max_class_length = min(max_class_length, 30)
+        
+        print("\nPer-Class Metrics:")
+        metrics_header = f"{'Class':{max_class_length}} {'Precision':>10} {'Recall':>10} {'F1-Score':>10} {'Support':>10}"
+        print(metrics_header)
+        print("-" * len(metrics_header))
+        
+        # Sort by display name
+        for cls in sorted_classes:
+            metrics = class_metrics[cls]
+            display_name = norm_to_orig.get(cls, cls)
+            
+            # Debug print
+            if debug:
+                print(f"\nClass: {display_name} (Normalized: {cls})")
+                print(f"TP: {metrics['tp']}, FP: {metrics['fp']}, FN: {metrics['fn']}, Support: {metrics['support']}")
+            
+            print(f"{display_name:{max_class_length}} {metrics['precision']:>10.4f} {metrics['recall']:>10.4f} {metrics['f1']:>10.4f} {metrics['support']:>10}")
+        
+        # Print macro and weighted averages
+        macro, weighted, total = report['macro'], report['weighted'], report['total']
+        if sorted_classes:
+            print("-" * len(metrics_header))
+            print(f"{'Macro Average':{max_class_length}} {macro['precision']:>10.4f} {macro['recall']:>10.4f} {macro['f1']:>10.4f} {total:>10}")
+            
+            if total > 0:
+                print(f"{'Weighted Average':{max_class_length}} {weighted['precision']:>10.4f} {weighted['recall']:>10.4f} {weighted['f1']:>10.4f} {total:>10}")
+        
+        # Print detailed confusion matrix
+        print_confusion_matrix(confusion, labels, norm_to_orig)
+    else:
+        print(f"Macro F1: {report['macro']['f1']:.4f}, Weighted F1: {report['weighted']['f1']:.4f}")
     
-    for cls in class_labels:
-        precisions, recalls = calculate_precision_recall_curve(predictions, cls)
-        ap = calculate_average_precision(precisions, recalls)
-        aps.append(ap)
+    # Print metrics per slice side by side
+    for key, key_slices in report.get('slices', {}).items():
+        print_slice_table(key, key_slices, norm_to_orig)
     
-    return sum(aps) / len(aps) if aps else 0.0
+    # Print incorrect predictions if verbose mode is enabled - show original MCQ format
+    if verbose and evaluator is not None and evaluator.incorrect:
+        print("\nIncorrect Predictions:")
+        for i, (original_labels, original_response) in enumerate(evaluator.incorrect, 1):
+            print(f"{i}. True: '{original_labels}', Predicted: '{original_response}'")
 
 def main():
     parser = argparse.ArgumentParser(description="Evaluate accuracy from a JSONL file")
     parser.add_argument("--input_file", help="Path to the JSONL file")
-    parser.add_argument("--output", "-o", help="Path to save results in JSON format", default=None)
-    parser.add_argument("--verbose", "-v", action="store_true", help="Show detailed information including incorrect predictions")
+    parser.add_argument("--output", "-o", help="Path to save the evaluation report in JSON format", default=None)
+    parser.add_argument("--confusion_npy", help="Also save the confusion matrix as a .npy integer array", default=None)
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show per-class metrics, the confusion matrix and incorrect predictions")
     parser.add_argument("--debug", "-d", action="store_true", help="Show debug information")
     parser.add_argument("--output_failure", help="Path to save full details of incorrect predictions in JSONL format", default="fails.jsonl")
     parser.add_argument("--mode", choices=["normal", "cot"], default="normal", help="Evaluation mode: 'normal' for standard format, 'cot' for chain-of-thought format")
+    parser.add_argument("--normalization", choices=sorted(NORMALIZATION_PRESETS), default="default", help="Label normalization rules")
+    parser.add_argument("--normalization_by_dataset", nargs="*", metavar="DATASET=PRESET", help="Normalization rules per _source.dataset, e.g. Cholect50=triplet")
+    parser.add_argument("--group_by", nargs="*", metavar="KEY", default=[], help="Also report metrics per value of these record keys, e.g. _source.dataset _source.file meta.phase video")
     args = parser.parse_args()
     
-    # Create output directory if it doesn't exist
-    if args.output:
-        output_dir = Path(args.output).parent
-        output_dir.mkdir(parents=True, exist_ok=True)
+    # Create output directories if they don't exist
+    for path in (args.output, args.confusion_npy):
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
     
     input_path = Path(args.input_file)
     if not input_path.exists():
         print(f"Error: File {args.input_file} does not exist")
         return
     
-    accuracy, confusion, correct, total, true_labels_counter, pred_labels_counter, predictions, norm_to_orig = calculate_accuracy(args.input_file, mode=args.mode)
-    
-    # Calculate mAP
-    map_score = calculate_map(predictions)
-    
-    print(f"\nOverall Accuracy: {accuracy:.4f} ({correct}/{total})")
-    print(f"Mean Average Precision (mAP): {map_score:.4f}")
-    
-    # Debug print
-    if args.debug:
-        print("\nPredictions (Normalized):")
-        for i, pred in enumerate(predictions, 1):
-            print(f"{i}. True: '{pred['true']}' (Display: '{pred['true_display']}'), "
-                  f"Pred: '{pred['pred']}' (Display: '{pred['pred_display']}'), "
-                  f"Correct: {pred['correct']}")
-        
-        print("\nNormalized Mappings:")
-        for norm, orig in norm_to_orig.items():
-            print(f"Normalized: '{norm}' -> Original: '{orig}'")
-        
-        print("\nConfusion Matrix (Raw):")
-        for true_label in confusion:
-            for pred_label in confusion[true_label]:
-                print(f"True: '{true_label}' (Display: '{norm_to_orig.get(true_label, true_label)}'), "
-                      f"Pred: '{pred_label}' (Display: '{norm_to_orig.get(pred_label, pred_label)}'), "
-                      f"Count: {confusion[true_label][pred_label]}")
-    
-    # Calculate and print class metrics
-    class_metrics = calculate_class_metrics(predictions)
-    
-    # Get maximum class name length for better formatting
-    sorted_classes = sorted(class_metrics.keys(), key=lambda x: norm_to_orig.get(x, x))
-    max_class_length = get_max_class_name_length(sorted_classes, norm_to_orig)
-    # Cap at reasonable length to prevent overly wide output
-    max_class_length = min(max_class_length, 30)
-    
-    print("\nPer-Class Metrics:")
-    metrics_header = f"{'Class':{max_class_length}} {'Precision':>10} {'Recall':>10} {'F1-Score':>10} {'Support':>10}"
-    print(metrics_header)
-    print("-" * len(metrics_header))
-    
-    # Calculate macro and weighted averages
-    macro_precision = 0
-    macro_recall = 0
-    macro_f1 = 0
-    weighted_precision = 0
-    weighted_recall = 0
-    weighted_f1 = 0
-    total_support = 0
-    
-    # Sort by display name
-    num_classes = len(sorted_classes)
-    
-    for cls in sorted_classes:
-        metrics = class_metrics[cls]
-        display_name = norm_to_orig.get(cls, cls)
-        
-        # Debug print
-        if args.debug:
-            print(f"\nClass: {display_name} (Normalized: {cls})")
-            print(f"TP: {metrics['tp']}, FP: {metrics['fp']}, FN: {metrics['fn']}, Support: {metrics['support']}")
-        
-        print(f"{display_name:{max_class_length}} {metrics['precision']:>10.4f} {metrics['recall']:>10.4f} {metrics['f1']:>10.4f} {metrics['support']:>10}")
-        
-        support = metrics['support']
-        total_support += support
-        macro_precision += metrics['precision']
-        macro_recall += metrics['recall']
-        macro_f1 += metrics['f1']
-        
-        # For weighted average
-        weighted_precision += metrics['precision'] * support
-        weighted_recall += metrics['recall'] * support
-        weighted_f1 += metrics['f1'] * support
-    
-    # Print macro and weighted averages
-    if num_classes > 0:
-        print("-" * len(metrics_header))
-        print(f"{'Macro Average':{max_class_length}} {macro_precision/num_classes:>10.4f} {macro_recall/num_classes:>10.4f} {macro_f1/num_classes:>10.4f} {total:>10}")
-        
-        if total_support > 0:
-            print(f"{'Weighted Average':{max_class_length}} {weighted_precision/total_support:>10.4f} {weighted_recall/total_support:>10.4f} {weighted_f1/total_support:>10.4f} {total:>10}")
-    
-    # Print detailed confusion matrix
-    print_confusion_matrix(confusion, true_labels_counter, norm_to_orig)
-    
-    # Print incorrect predictions if verbose mode is enabled - show original MCQ format
-    incorrect = [p for p in predictions if not p['correct']]
-    if args.verbose and incorrect:
-        print("\nIncorrect Predictions:")
-        for i, pred in enumerate(incorrect, 1):
-            print(f"{i}. True: '{pred['original_labels']}', Predicted: '{pred['original_response']}'")
-    
-    # Save results to JSON if output path is provided
+    normalizer, dataset_normalizers = parse_normalization_args(args.normalization, args.normalization_by_dataset)
+    evaluator = evaluate_file(
+        args.input_file,
+        mode=args.mode,
+        failure_file=args.output_failure,
+        keep_incorrect=args.verbose,
+        keep_predictions=args.debug,
+        normalizer=normalizer,
+        dataset_normalizers=dataset_normalizers,
+        group_by=args.group_by
+    )
+    report = build_report(evaluator, {
+        'input_file': str(input_path.resolve()),
+        'mode': args.mode,
+        'normalization': args.normalization,
+        'normalization_by_dataset': args.normalization_by_dataset or [],
+        'group_by': args.group_by
+    })
+    render_report(report, evaluator, verbose=args.verbose, debug=args.debug)
+    
+    # Save the report to JSON if output path is provided
     if args.output:
-        # Convert to serializable format
-        serializable_confusion = {k: dict(v) for k, v in confusion.items()}
-        results = {
-            'accuracy': accuracy,
-            'correct': correct,
-            'total': total,
-            'class_metrics': class_metrics,
-            'confusion_matrix': serializable_confusion,
-            'norm_to_orig': norm_to_orig
-        }
-        
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2)
-        
+        save_report(report, args.output, args.confusion_npy)
         print(f"\nResults saved to {args.output}")
+    elif args.confusion_npy:
+        np.save(args.confusion_npy, confusion_array(report))
     
-    # Save full details of incorrect predictions if output_failure path is provided
-    if args.output_failure and incorrect:
-        with open(args.output_failure, 'w', encoding='utf-8') as f:
-            for pred in incorrect:
-                # Write the original item to the file
-                json.dump(pred['original_item'], f)
-                f.write('\n')
-        
+    # Incorrect predictions were written to output_failure while streaming
+    if evaluator.failures:
         print(f"\nIncorrect predictions saved to {args.output_failure}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
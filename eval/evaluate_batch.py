@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from evaluate_accuracy import NORMALIZATION_PRESETS, evaluate_file, parse_normalization_args, summarize_evaluator
+
+# Bump when the cached summary format or metric definitions change
+CACHE_VERSION = 2
+
+def file_sha1(file_path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def get_run_name(path):
+    """Name a prediction file after its checkpoint directory if it has one"""
+    for part in reversed(Path(path).parts):
+        if part.startswith('checkpoint-'):
+            return part
+    return Path(path).stem
+
+def get_step(name):
+    match = re.search(r'checkpoint-(\d+)', name)
+    return int(match.group(1)) if match else -1
+
+def evaluate_one(path, mode, normalization):
+    """Process pool worker: evaluate one prediction file without writing failures"""
+    normalizer, _ = parse_normalization_args(normalization)
+    evaluator = evaluate_file(path, mode=mode, failure_file=None, normalizer=normalizer)
+    return summarize_evaluator(evaluator)
+
+def load_cache(cache_path):
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') == CACHE_VERSION:
+            return cache
+    return {'version': CACHE_VERSION, 'files': {}, 'results': {}}
+
+def save_cache(cache, cache_path):
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+def get_file_hash(path, cache):
+    """sha1 of a file, reusing the cached value while size and mtime are unchanged"""
+    stat = os.stat(path)
+    entry = cache['files'].get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['sha1']
+    sha1 = file_sha1(path)
+    cache['files'][path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1}
+    return sha1
+
+def evaluate_batch(paths, mode="normal", normalization="default", workers=None, cache_path=None):
+    """Evaluate prediction files in a process pool; returns {path: summary}"""
+    cache = load_cache(cache_path)
+    summaries = {}
+    pending = {}
+    for path in paths:
+        key = f"{get_file_hash(path, cache)}:{mode}:{normalization}"
+        if key in cache['results']:
+            summaries[path] = cache['results'][key]
+        else:
+            pending[path] = key
+    print(f"{len(paths)} prediction files, {len(summaries)} cached, {len(pending)} to evaluate")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(evaluate_one, path, mode, normalization): path for path in pending}
+            for future in as_completed(futures):
+                path = futures[future]
+                summaries[path] = future.result()
+                cache['results'][pending[path]] = summaries[path]
+                print(f"Evaluated {path}")
+    if cache_path:
+        save_cache(cache, cache_path)
+    return summaries
+
+def print_comparison(runs, baseline):
+    """runs: list of (name, summary) in display order"""
+    name_width = max(len(name) for name, _ in runs) + 2
+    header = f"{'Run':{name_width}} {'Total':>8} {'Accuracy':>10} {'mAP':>10} {'Macro-F1':>10}"
+    print("\nCheckpoint Comparison:")
+    print(header)
+    print("-" * len(header))
+    for name, summary in runs:
+        print(f"{name:{name_width}} {summary['total']:>8} {summary['accuracy']:>10.4f} {summary['map']:>10.4f} {summary['macro']['f1']:>10.4f}")
+
+    # Per-class F1 deltas against the baseline run
+    base = dict(runs)[baseline]
+    display = {}
+    for _, summary in runs:
+        display.update(summary['norm_to_orig'])
+    classes = sorted({cls for _, summary in runs for cls in summary['class_metrics']}, key=lambda c: display.get(c, c))
+    class_width = min(max(len(display.get(c, c)) for c in classes), 30) if classes else 5
+    delta_width = max(max(len(name) for name, _ in runs), 8)
+    print(f"\nPer-Class F1 Delta vs {baseline}:")
+    header = f"{'Class':{class_width}} {'Base F1':>8}" + "".join(f" {name:>{delta_width}}" for name, _ in runs if name != baseline)
+    print(header)
+    print("-" * len(header))
+    for cls in classes:
+        base_f1 = base['class_metrics'].get(cls, {}).get('f1')
+        row = f"{display.get(cls, cls)[:class_width]:{class_width}} "
+        row += f"{base_f1:>8.4f}" if base_f1 is not None else f"{'-':>8}"
+        for name, summary in runs:
+            if name == baseline:
+                continue
+            f1 = summary['class_metrics'].get(cls, {}).get('f1')
+            row += f" {f1 - base_f1:>+{delta_width}.4f}" if f1 is not None and base_f1 is not None else f" {'-':>{delta_width}}"
+        print(row)
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate many prediction files (e.g. one per checkpoint) and compare them")
+    parser.add_argument("inputs", nargs="+", help="Prediction JSONL files or glob patterns")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--cache", default="eval_cache.json", help="Results cache keyed by file hash (default: eval_cache.json)")
+    parser.add_argument("--baseline", default=None, help="Run name to compute per-class deltas against (default: first run)")
+    parser.add_argument("--output", "-o", default=None, help="Path to save the comparison in JSON format")
+    parser.add_argument("--mode", choices=["normal", "cot"], default="normal", help="Evaluation mode: 'normal' for standard format, 'cot' for chain-of-thought format")
+    parser.add_argument("--normalization", choices=sorted(NORMALIZATION_PRESETS), default="default", help="Label normalization rules")
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in args.inputs:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else [])
+        if not matches:
+            print(f"Warning: no files match {pattern}")
+        paths.extend(os.path.abspath(m) for m in matches)
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        print("Error: no prediction files to evaluate")
+        return
+
+    summaries = evaluate_batch(paths, args.mode, args.normalization, args.workers, args.cache)
+
+    # Order by checkpoint step, then name; disambiguate identical names with the path
+    names = {path: get_run_name(path) for path in paths}
+    if len(set(names.values())) < len(names):
+        names = {path: os.path.relpath(path) for path in paths}
+    paths.sort(key=lambda path: (get_step(names[path]), names[path]))
+    runs = [(names[path], summaries[path]) for path in paths]
+    baseline = args.baseline or runs[0][0]
+    if baseline not in dict(runs):
+        print(f"Error: baseline {baseline} is not one of the runs")
+        return
+    print_comparison(runs, baseline)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'baseline': baseline,
+                'runs': [{'name': name, 'path': path, **summaries[path]}
+                         for path in paths for name in [names[path]]]
+            }, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import selectors
+import socket
+import sys
+import time
+from pathlib import Path
+from statistics import NormalDist
+
+from evaluate_accuracy import (NORMALIZATION_PRESETS, StreamingEvaluator, build_report, calculate_average_metrics,
+                               calculate_class_metrics, parse_normalization_args, render_report, save_report)
+
+def wilson_interval(correct, total, confidence=0.95):
+    """Wilson score interval (low, high) of a binomial proportion"""
+    if total == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = correct / total
+    denominator = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denominator
+    half = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+def tail_lines(path, poll_interval=0.5, idle_timeout=None):
+    """
+    Yield complete lines appended to a growing file (which may not exist
+    yet), and None on every poll without new data so the caller can act on
+    time. Stops after `idle_timeout` seconds without new data.
+    """
+    while not os.path.exists(path):
+        yield None
+        time.sleep(poll_interval)
+    last_data = time.monotonic()
+    buffer = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if chunk:
+                last_data = time.monotonic()
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                yield from lines
+                continue
+            if idle_timeout is not None and time.monotonic() - last_data > idle_timeout:
+                if buffer.strip():
+                    yield buffer
+                return
+            yield None
+            time.sleep(poll_interval)
+
+def socket_lines(path, poll_interval=0.5, idle_timeout=None):
+    """
+    Serve a unix socket at `path` and yield the lines sent by any number of
+    clients, and None on every poll without data. Each client sends JSONL
+    and closes the connection when done. Stops after `idle_timeout` seconds
+    without data or open connections.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    server.setblocking(False)
+    print(f"Listening on {path}")
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ, None)
+    buffers = {}
+    last_data = time.monotonic()
+    try:
+        while True:
+            events = selector.select(timeout=poll_interval)
+            if not events:
+                if idle_timeout is not None and not buffers and time.monotonic() - last_data > idle_timeout:
+                    return
+                yield None
+                continue
+            for key, _ in events:
+                if key.data is None:
+                    conn, _ = server.accept()
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ, True)
+                    buffers[conn] = b''
+                    continue
+                conn = key.fileobj
+                chunk = conn.recv(1 << 16)
+                last_data = time.monotonic()
+                if not chunk:
+                    # Client closed: flush its last unterminated line
+                    if buffers[conn].strip():
+                        yield buffers[conn]
+                    selector.unregister(conn)
+                    conn.close()
+                    del buffers[conn]
+                    continue
+                *lines, buffers[conn] = (buffers[conn] + chunk).split(b'\n')
+                yield from lines
+    finally:
+        for conn in buffers:
+            conn.close()
+        selector.close()
+        server.close()
+        os.unlink(path)
+
+def stdin_lines():
+    yield from sys.stdin.buffer
+
+class OnlineMonitor:
+    """
+    Periodic snapshots of a StreamingEvaluator and the early-stopping rule:
+    after `min_records`, stop once the Wilson interval on accuracy is
+    narrower than +-`stop_halfwidth`, or once its upper bound falls below
+    `min_accuracy` (the checkpoint cannot reach the required accuracy).
+    """
+    def __init__(self, evaluator, every=1000, interval=30.0, confidence=0.95, min_records=1000,
+                 stop_halfwidth=None, min_accuracy=None, snapshot_file=None):
+        self.evaluator = evaluator
+        self.every = every
+        self.interval = interval
+        self.confidence = confidence
+        self.min_records = min_records
+        self.stop_halfwidth = stop_halfwidth
+        self.min_accuracy = min_accuracy
+        self.snapshot_file = open(snapshot_file, 'a', encoding='utf-8') if snapshot_file else None
+        self.start = time.monotonic()
+        self.last_time = self.start
+        self.last_total = 0
+        self.stop_reason = None
+
+    def due(self):
+        total = self.evaluator.total
+        if total == self.last_total:
+            return False
+        return total - self.last_total >= self.every or time.monotonic() - self.last_time >= self.interval
+
+    def snapshot(self, check_stop=True):
+        """Record and print the current metrics; check_stop=False for the final snapshot of an exhausted input"""
+        evaluator = self.evaluator
+        low, high = wilson_interval(evaluator.correct, evaluator.total, self.confidence)
+        class_metrics = calculate_class_metrics(evaluator.confusion_matrix(), evaluator.labels)
+        macro, _, _ = calculate_average_metrics(class_metrics, sorted(class_metrics))
+        elapsed = time.monotonic() - self.start
+        snapshot = {
+            'time': round(elapsed, 3),
+            'records': evaluator.total,
+            'accuracy': evaluator.accuracy,
+            'ci_low': low,
+            'ci_high': high,
+            'macro_f1': macro['f1'],
+            'records_per_second': evaluator.total / elapsed if elapsed > 0 else 0.0
+        }
+        self.last_time = time.monotonic()
+        self.last_total = evaluator.total
+        if check_stop:
+            self.stop_reason = self.check_stop(low, high)
+            if self.stop_reason:
+                snapshot['stop'] = self.stop_reason
+        if self.snapshot_file:
+            self.snapshot_file.write(json.dumps(snapshot) + '\n')
+            self.snapshot_file.flush()
+        print(f"[{elapsed:8.1f}s] {snapshot['records']:>8} records  accuracy {snapshot['accuracy']:.4f} "
+              f"[{low:.4f}, {high:.4f}]  macro F1 {snapshot['macro_f1']:.4f}  {snapshot['records_per_second']:.0f}/s")
+        return snapshot
+
+    def check_stop(self, low, high):
+        if self.evaluator.total < self.min_records:
+            return None
+        if self.min_accuracy is not None and high < self.min_accuracy:
+            return f"accuracy upper bound {high:.4f} < {self.min_accuracy}"
+        if self.stop_halfwidth is not None and (high - low) / 2 <= self.stop_halfwidth:
+            return f"confidence interval half-width {(high - low) / 2:.4f} <= {self.stop_halfwidth}"
+        return None
+
+    def close(self):
+        if self.snapshot_file:
+            self.snapshot_file.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate predictions while they are being written, with early stopping")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input_file", help="JSONL file to follow as it grows, or '-' for stdin")
+    source.add_argument("--socket", help="Unix socket path to serve; clients send JSONL lines")
+    parser.add_argument("--idle_timeout", type=float, default=60.0, help="Finish after this many seconds without new records (default: 60)")
+    parser.add_argument("--poll_interval", type=float, default=0.5, help="Seconds between checks for new data (default: 0.5)")
+    parser.add_argument("--every", type=int, default=1000, help="Snapshot every N records (default: 1000)")
+    parser.add_argument("--interval", type=float, default=30.0, help="Snapshot at least every N seconds while records arrive (default: 30)")
+    parser.add_argument("--snapshots", default=None, help="Append snapshots to this JSONL file")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the accuracy interval (default: 0.95)")
+    parser.add_argument("--min_records", type=int, default=1000, help="Never stop early before this many records (default: 1000)")
+    parser.add_argument("--stop_halfwidth", type=float, default=None, help="Stop once the accuracy interval is within +- this value")
+    parser.add_argument("--min_accuracy", type=float, default=None, help="Stop once the accuracy upper bound is below this value")
+    parser.add_argument("--output", "-o", default=None, help="Path to save the final evaluation report in JSON format")
+    parser.add_argument("--output_failure", default=None, help="Path to save incorrect predictions in JSONL format")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show per-class metrics and the confusion matrix at the end")
+    parser.add_argument("--mode", choices=["normal", "cot"], default="normal", help="Evaluation mode: 'normal' for standard format, 'cot' for chain-of-thought format")
+    parser.add_argument("--normalization", choices=sorted(NORMALIZATION_PRESETS), default="default", help="Label normalization rules")
+    parser.add_argument("--normalization_by_dataset", nargs="*", metavar="DATASET=PRESET", help="Normalization rules per _source.dataset, e.g. Cholect50=triplet")
+    args = parser.parse_args()
+
+    normalizer, dataset_normalizers = parse_normalization_args(args.normalization, args.normalization_by_dataset)
+    evaluator = StreamingEvaluator(args.mode, args.output_failure, normalizer=normalizer, dataset_normalizers=dataset_normalizers)
+    monitor = OnlineMonitor(evaluator, args.every, args.interval, args.confidence, args.min_records,
+                            args.stop_halfwidth, args.min_accuracy, args.snapshots)
+    if args.socket:
+        lines = socket_lines(args.socket, args.poll_interval, args.idle_timeout)
+    elif args.input_file == '-':
+        lines = stdin_lines()
+    else:
+        lines = tail_lines(args.input_file, args.poll_interval, args.idle_timeout)
+        print(f"Following {args.input_file}")
+
+    try:
+        for line in lines:
+            if line is not None:
+                try:
+                    evaluator.update_line(line)
+                except json.JSONDecodeError:
+                    print(f"Warning: skipping malformed line: {line[:80]!r}")
+            if monitor.due():
+                monitor.snapshot()
+                if monitor.stop_reason:
+                    print(f"\nStopping early: {monitor.stop_reason}")
+                    break
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+    finally:
+        lines.close()
+        evaluator.close()
+        if evaluator.total != monitor.last_total:
+            monitor.snapshot(check_stop=False)
+        monitor.close()
+
+    report = build_report(evaluator, {
+        'source': args.socket or args.input_file,
+        'mode': args.mode,
+        'normalization': args.normalization,
+        'normalization_by_dataset': args.normalization_by_dataset or [],
+        'stopped_early': monitor.stop_reason
+    })
+    low, high = wilson_interval(evaluator.correct, evaluator.total, args.confidence)
+    report['accuracy_interval'] = {'confidence': args.confidence, 'low': low, 'high': high}
+    render_report(report, evaluator, verbose=args.verbose)
+    print(f"Accuracy {args.confidence:.0%} interval: [{low:.4f}, {high:.4f}]")
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        save_report(report, args.output)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
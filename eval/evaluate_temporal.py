@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import re
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from evaluate_accuracy import (NORMALIZATION_PRESETS, extract_response_and_labels, get_group_value, get_image_paths,
+                               parse_normalization_args)
+
+# Overlap thresholds of the segmental F1 score (F1@10, F1@25, F1@50)
+OVERLAPS = (0.1, 0.25, 0.5)
+FRAME_NUMBER = re.compile(r"(\d+)(?!.*\d)")
+
+def parse_frame_key(data):
+    """
+    (video, frame number) of a record. Ids are VVFFFFFF (Cholec80) or
+    xxxnnnnnn (CholecT50); otherwise the directory and the last number of
+    the first image file name are used. Returns None if neither works.
+    """
+    record_id = str(data.get('id', ''))
+    if record_id.isdigit() and len(record_id) in (8, 9):
+        split = len(record_id) - 6
+        return record_id[:split], int(record_id[split:])
+    images = get_image_paths(data)
+    image = images[0] if images else None
+    if image:
+        path = Path(image)
+        match = FRAME_NUMBER.search(path.stem)
+        if match:
+            return path.parent.name, int(match.group(1))
+    return None
+
+def run_lengths(seq):
+    """(labels, starts, ends) of the runs of equal values in a 1-D array; ends are exclusive"""
+    if len(seq) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    starts = np.concatenate(([0], np.flatnonzero(seq[1:] != seq[:-1]) + 1))
+    ends = np.append(starts[1:], len(seq))
+    return seq[starts], starts, ends
+
+def edit_distance(a, b):
+    """
+    Levenshtein distance of two label sequences. Each DP row is vectorized:
+    substitutions and deletions come from the previous row, and insertions
+    along the row are a running minimum of (cost - column).
+    """
+    previous = np.arange(len(b) + 1)
+    for i in range(1, len(a) + 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        current[1:] = np.minimum(previous[1:] + 1, previous[:-1] + (b != a[i - 1]))
+        columns = np.arange(len(b) + 1)
+        current = np.minimum.accumulate(current - columns) + columns
+        previous = current
+    return int(previous[-1])
+
+def edit_score(true_seq, pred_seq):
+    """Segmental edit score in [0, 100]: 1 - normalized edit distance of the run labels"""
+    true_labels = run_lengths(true_seq)[0]
+    pred_labels = run_lengths(pred_seq)[0]
+    longest = max(len(true_labels), len(pred_labels))
+    if longest == 0:
+        return 100.0
+    return (1 - edit_distance(pred_labels, true_labels) / longest) * 100
+
+def segmental_f1(true_seq, pred_seq, overlaps=OVERLAPS):
+    """
+    Segmental F1@k: a predicted segment is a true positive if its IoU with
+    an unmatched ground-truth segment of the same label reaches k. IoUs of
+    all segment pairs are computed as one matrix.
+    """
+    true_labels, true_starts, true_ends = run_lengths(true_seq)
+    pred_labels, pred_starts, pred_ends = run_lengths(pred_seq)
+    intersection = np.minimum(pred_ends[:, None], true_ends[None, :]) - np.maximum(pred_starts[:, None], true_starts[None, :])
+    union = np.maximum(pred_ends[:, None], true_ends[None, :]) - np.minimum(pred_starts[:, None], true_starts[None, :])
+    iou = np.where(pred_labels[:, None] == true_labels[None, :], np.clip(intersection, 0, None) / union, 0.0)
+    best = iou.argmax(axis=1) if len(true_labels) else np.zeros(len(pred_labels), dtype=np.int64)
+
+    scores = {}
+    for overlap in overlaps:
+        used = np.zeros(len(true_labels), dtype=bool)
+        tp = 0
+        for p, g in enumerate(best.tolist()):
+            if len(true_labels) and iou[p, g] >= overlap and not used[g]:
+                used[g] = True
+                tp += 1
+        fp = len(pred_labels) - tp
+        fn = len(true_labels) - tp
+        precision = tp / (tp + fp) if tp + fp > 0 else 0
+        recall = tp / (tp + fn) if tp + fn > 0 else 0
+        scores[overlap] = 2 * precision * recall / (precision + recall) * 100 if precision + recall > 0 else 0.0
+    return scores
+
+def phase_jaccard(true_seq, pred_seq, num_labels):
+    """Mean Jaccard index over the phases present in the ground truth, in [0, 100]"""
+    true_counts = np.bincount(true_seq, minlength=num_labels)
+    pred_counts = np.bincount(pred_seq, minlength=num_labels)
+    intersection = np.bincount(true_seq[true_seq == pred_seq], minlength=num_labels)
+    present = true_counts > 0
+    union = true_counts + pred_counts - intersection
+    return float(np.mean(intersection[present] / union[present]) * 100) if present.any() else 0.0
+
+def mode_filter(seq, window, num_labels):
+    """Sliding majority vote of width `window` (odd); ties go to the lowest label id"""
+    half = window // 2
+    onehot = np.zeros((len(seq) + 1, num_labels), dtype=np.int32)
+    onehot[np.arange(1, len(seq) + 1), seq] = 1
+    counts = np.cumsum(onehot, axis=0)
+    idx = np.arange(len(seq))
+    upper = np.minimum(idx + half + 1, len(seq))
+    lower = np.maximum(idx - half, 0)
+    return (counts[upper] - counts[lower]).argmax(axis=1)
+
+def median_filter(seq, window, ranks):
+    """
+    Sliding median over the phase order: `ranks` maps every label id to its
+    position in the surgical workflow, see phase_ranks.
+    """
+    half = window // 2
+    labels = np.argsort(ranks)
+    padded = np.pad(ranks[seq], half, mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    return labels[np.median(windows, axis=1).astype(np.int64)]
+
+def phase_ranks(sequences, num_labels):
+    """Rank of every label id by its mean relative position in the ground-truth videos"""
+    position_sum = np.zeros(num_labels)
+    counts = np.zeros(num_labels)
+    for true_seq, _ in sequences.values():
+        position_sum += np.bincount(true_seq, weights=np.linspace(0, 1, len(true_seq)), minlength=num_labels)
+        counts += np.bincount(true_seq, minlength=num_labels)
+    # Labels never seen as ground truth go last
+    mean_position = np.where(counts > 0, position_sum / np.maximum(counts, 1), 2.0)
+    ranks = np.empty(num_labels, dtype=np.int64)
+    ranks[np.argsort(mean_position, kind='stable')] = np.arange(num_labels)
+    return ranks
+
+def hmm_smooth(seq, num_labels, stay=0.99, accuracy=0.8):
+    """
+    Viterbi decoding of an HMM whose hidden state is the true phase: the
+    phase stays with probability `stay` and otherwise jumps uniformly, and
+    the observed per-frame prediction is correct with probability
+    `accuracy`. Because transitions are uniform off the diagonal, each step
+    is O(labels): stay in the same state or come from the best state.
+    """
+    if len(seq) == 0 or num_labels < 2:
+        return seq.copy()
+    log_stay = np.log(stay)
+    log_switch = np.log((1 - stay) / (num_labels - 1))
+    log_hit = np.log(accuracy)
+    log_miss = np.log((1 - accuracy) / (num_labels - 1))
+
+    emissions = np.full((len(seq), num_labels), log_miss)
+    emissions[np.arange(len(seq)), seq] = log_hit
+    backpointers = np.empty((len(seq), num_labels), dtype=np.int32)
+    delta = emissions[0] - np.log(num_labels)
+    states = np.arange(num_labels)
+    for t in range(1, len(seq)):
+        best = int(delta.argmax())
+        from_best = delta[best] + log_switch
+        from_self = delta + log_stay
+        stay_here = from_self >= from_best
+        backpointers[t] = np.where(stay_here, states, best)
+        delta = np.where(stay_here, from_self, from_best) + emissions[t]
+
+    path = np.empty(len(seq), dtype=seq.dtype)
+    path[-1] = delta.argmax()
+    for t in range(len(seq) - 1, 0, -1):
+        path[t - 1] = backpointers[t, path[t]]
+    return path
+
+def smooth(seq, method, window, num_labels, ranks, hmm_stay, hmm_accuracy):
+    if method == 'mode':
+        return mode_filter(seq, window, num_labels)
+    if method == 'median':
+        return median_filter(seq, window, ranks)
+    if method == 'hmm':
+        return hmm_smooth(seq, num_labels, hmm_stay, hmm_accuracy)
+    return seq
+
+def video_metrics(true_seq, pred_seq, num_labels):
+    f1 = segmental_f1(true_seq, pred_seq)
+    metrics = {
+        'frames': int(len(true_seq)),
+        'accuracy': float(np.mean(true_seq == pred_seq) * 100),
+        'jaccard': phase_jaccard(true_seq, pred_seq, num_labels),
+        'edit': edit_score(true_seq, pred_seq)
+    }
+    for overlap, value in f1.items():
+        metrics[f"f1@{int(overlap * 100)}"] = value
+    return metrics
+
+def parse_filters(specs):
+    """[(dotted key, value)] from KEY=VALUE arguments"""
+    filters = []
+    for spec in specs or []:
+        key, sep, value = spec.partition('=')
+        if not sep or not key:
+            raise ValueError(f"Invalid filter {spec!r}, expected KEY=VALUE")
+        filters.append((key, value))
+    return filters
+
+class SequenceCollector:
+    """
+    Collect (video, frame, true id, predicted id) per record while streaming.
+    Only records matching every (dotted key, value) of `filters` are kept,
+    so a merged file with several tasks per frame can be narrowed to one.
+    """
+    def __init__(self, mode="normal", normalizer=None, dataset_normalizers=None, filters=None):
+        self.mode = mode
+        self.filters = list(filters or [])
+        self.normalizer = normalizer
+        self.dataset_normalizers = dataset_normalizers or {}
+        self.label_ids = {}
+        self.norm_to_orig = {}
+        self.video_ids = {}
+        self.videos = array('i')
+        self.frames = array('q')
+        self.true_ids = array('i')
+        self.pred_ids = array('i')
+        self.skipped = 0
+        self.filtered = 0
+
+    def update(self, data):
+        if any(get_group_value(data, key) != value for key, value in self.filters):
+            self.filtered += 1
+            return
+        fields = extract_response_and_labels(data, self.mode)
+        key = parse_frame_key(data)
+        if fields is None or key is None:
+            self.skipped += 1
+            return
+        response, labels = fields
+        normalizer = self.normalizer
+        if self.dataset_normalizers:
+            source = data.get("_source") or {}
+            normalizer = self.dataset_normalizers.get(source.get("dataset"), normalizer)
+        clean_response, norm_response = normalizer.clean(response)
+        clean_labels, norm_labels = normalizer.clean(labels)
+        self.norm_to_orig.setdefault(norm_response, clean_response)
+        self.norm_to_orig.setdefault(norm_labels, clean_labels)
+
+        video, frame = key
+        self.videos.append(self.video_ids.setdefault(video, len(self.video_ids)))
+        self.frames.append(frame)
+        self.true_ids.append(self.label_ids.setdefault(norm_labels, len(self.label_ids)))
+        self.pred_ids.append(self.label_ids.setdefault(norm_response, len(self.label_ids)))
+
+    def sequences(self):
+        """
+        {video: (true sequence, predicted sequence)} in frame order. Raises
+        ValueError if two records share a (video, frame): they are usually
+        different tasks on the same frame, which would interleave.
+        """
+        videos = np.frombuffer(self.videos, dtype=np.intc)
+        frames = np.frombuffer(self.frames, dtype=np.int64)
+        true_ids = np.frombuffer(self.true_ids, dtype=np.intc)
+        pred_ids = np.frombuffer(self.pred_ids, dtype=np.intc)
+        order = np.lexsort((frames, videos))
+        videos, frames = videos[order], frames[order]
+        repeated = np.flatnonzero((videos[1:] == videos[:-1]) & (frames[1:] == frames[:-1]))
+        if len(repeated):
+            names = sorted(self.video_ids, key=self.video_ids.get)
+            first = repeated[0] + 1
+            raise ValueError(f"{len(repeated)} records repeat a (video, frame) already seen, e.g. "
+                             f"{names[videos[first]]} frame {frames[first]}; use --filter to keep one task")
+        bounds = np.searchsorted(videos, np.arange(len(self.video_ids) + 1))
+        names = sorted(self.video_ids, key=self.video_ids.get)
+        result = {}
+        for video_id, name in enumerate(names):
+            segment = order[bounds[video_id]:bounds[video_id + 1]]
+            result[name] = (true_ids[segment], pred_ids[segment])
+        return dict(sorted(result.items()))
+
+def summarize(per_video):
+    """Mean and standard deviation over videos of every metric"""
+    names = [k for k in next(iter(per_video.values())) if k != 'frames'] if per_video else []
+    summary = {}
+    for name in names:
+        values = np.array([m[name] for m in per_video.values()])
+        summary[name] = {'mean': float(values.mean()), 'std': float(values.std())}
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Video-level phase metrics from per-frame predictions")
+    parser.add_argument("--input_file", required=True, help="Path to the JSONL file")
+    parser.add_argument("--output", "-o", default=None, help="Path to save results in JSON format")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show metrics per video")
+    parser.add_argument("--mode", choices=["normal", "cot"], default="normal", help="Evaluation mode: 'normal' for standard format, 'cot' for chain-of-thought format")
+    parser.add_argument("--normalization", choices=sorted(NORMALIZATION_PRESETS), default="default", help="Label normalization rules")
+    parser.add_argument("--normalization_by_dataset", nargs="*", metavar="DATASET=PRESET", help="Normalization rules per _source.dataset, e.g. Cholect50=triplet")
+    parser.add_argument("--filter", nargs="*", metavar="KEY=VALUE", help="Only use records whose dotted field equals the value, e.g. _source.file=test_mcq_phase.jsonl")
+    parser.add_argument("--smoothing", choices=["none", "mode", "median", "hmm"], default="none", help="Temporal smoothing of the predicted sequences")
+    parser.add_argument("--window", type=int, default=15, help="Window (frames, odd) of the mode and median filters (default: 15)")
+    parser.add_argument("--hmm_stay", type=float, default=0.99, help="HMM probability of staying in the same phase (default: 0.99)")
+    parser.add_argument("--hmm_accuracy", type=float, default=0.8, help="HMM probability that a frame prediction is correct (default: 0.8)")
+    args = parser.parse_args()
+
+    if not Path(args.input_file).exists():
+        print(f"Error: File {args.input_file} does not exist")
+        return
+    if args.window % 2 == 0:
+        args.window += 1
+
+    normalizer, dataset_normalizers = parse_normalization_args(args.normalization, args.normalization_by_dataset)
+    try:
+        filters = parse_filters(args.filter)
+    except ValueError as e:
+        parser.error(str(e))
+    collector = SequenceCollector(args.mode, normalizer, dataset_normalizers, filters)
+    with open(args.input_file, 'rb') as f:
+        for line in f:
+            if line.strip():
+                collector.update(json.loads(line))
+    try:
+        sequences = collector.sequences()
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    num_labels = len(collector.label_ids)
+
+    print(f"\nVideos: {len(sequences)}, frames: {len(collector.true_ids)}, skipped records: {collector.skipped}, "
+          f"filtered out: {collector.filtered}")
+
+    ranks = phase_ranks(sequences, num_labels)
+    runs = {'raw': {}}
+    if args.smoothing != 'none':
+        runs[args.smoothing] = {}
+    for video, (true_seq, pred_seq) in sequences.items():
+        runs['raw'][video] = video_metrics(true_seq, pred_seq, num_labels)
+        if args.smoothing != 'none':
+            smoothed = smooth(pred_seq, args.smoothing, args.window, num_labels, ranks, args.hmm_stay, args.hmm_accuracy)
+            runs[args.smoothing][video] = video_metrics(true_seq, smoothed, num_labels)
+    summaries = {name: summarize(per_video) for name, per_video in runs.items()}
+
+    if args.verbose:
+        for name, per_video in runs.items():
+            print(f"\nPer-Video Metrics ({name}):")
+            header = f"{'Video':10} {'Frames':>7} {'Acc':>7} {'Jaccard':>8} {'Edit':>7}" + "".join(f" {'F1@' + str(int(o * 100)):>7}" for o in OVERLAPS)
+            print(header)
+            print("-" * len(header))
+            for video, m in per_video.items():
+                print(f"{video[:10]:10} {m['frames']:>7} {m['accuracy']:>7.2f} {m['jaccard']:>8.2f} {m['edit']:>7.2f}"
+                      + "".join(f" {m[f'f1@{int(o * 100)}']:>7.2f}" for o in OVERLAPS))
+
+    print("\nVideo-Level Metrics (mean ± std over videos):")
+    header = f"{'Metric':10}" + "".join(f" {name:>16}" for name in summaries)
+    print(header)
+    print("-" * len(header))
+    for metric in (next(iter(summaries.values())) if sequences else {}):
+        print(f"{metric:10}" + "".join(f" {s[metric]['mean']:>8.2f} ± {s[metric]['std']:>5.2f}" for s in summaries.values()))
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'smoothing': {'method': args.smoothing, 'window': args.window,
+                              'hmm_stay': args.hmm_stay, 'hmm_accuracy': args.hmm_accuracy},
+                'labels': [collector.norm_to_orig.get(label, label) for label in collector.label_ids],
+                'summary': summaries,
+                'videos': runs
+            }, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import re
+from array import array
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from evaluate_accuracy import MCQ_LETTER_PATTERN, extract_response_and_labels, extract_scores
+
+# Components of a CholecT50 triplet, in category_mapping.json naming
+COMPONENTS = ('instrument', 'verb', 'target', 'triplet')
+# Question type named in the answer prefix -> component, as written by create_recognition_data.py
+ANSWER_PREFIXES = [
+    (re.compile(r"(?i)^the\s+complete\s+surgical\s+actions?\s+(?:is|are)\s*:?\s*"), 'triplet'),
+    (re.compile(r"(?i)^the\s+tools?\s+(?:is|are)\s*"), 'instrument'),
+    (re.compile(r"(?i)^the\s+actions?\s+(?:is|are)\s*"), 'verb'),
+    (re.compile(r"(?i)^the\s+tissues?\s+(?:is|are)\s*"), 'target'),
+]
+# Separators between the names of a multi-label answer ("A, B and C")
+LIST_SEPARATOR = re.compile(r"\s*(?:,|;|\band\b)\s*")
+# Separators between several triplets; triplets themselves may use commas ("grasper,dissect,gallbladder")
+TRIPLET_SEPARATOR = re.compile(r"\s*(?:;|\band\b|\n)\s*")
+BRACKET_TRIPLET = re.compile(r"\[([^\]]+)\]-\[([^\]]+)\]-\[([^\]]+)\]")
+
+def name_key(name):
+    """Comparison key of a category name: 'Cystic plate' and 'cystic_plate' match"""
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+class TripletVocabulary:
+    """
+    Category ids from category_mapping.json ({component: {id: name}}).
+    Triplet names are 'instrument,verb,target'; each triplet id is also
+    decomposed into its instrument, verb and target ids, as the binary
+    labels of ori_c50_loader.T50.get_binary_labels are.
+    """
+    def __init__(self, mapping):
+        self.names = {}
+        self.ids = {}
+        for component in ('instrument', 'verb', 'target'):
+            entries = sorted(((int(k), v) for k, v in mapping.get(component, {}).items()))
+            self.names[component] = [v for _, v in entries]
+            self.ids[component] = {name_key(v): k for k, v in entries}
+
+        # (instrument id, verb id, target id) -> triplet id
+        self.triplet_ids = {}
+        triplet_entries = sorted(((int(k), v) for k, v in mapping.get('triplet', {}).items()))
+        self.names['triplet'] = [v for _, v in triplet_entries]
+        for triplet_id, name in triplet_entries:
+            parts = self.parse_triplet(name)
+            if parts is not None:
+                self.triplet_ids[parts] = triplet_id
+        self.parse_answer = lru_cache(maxsize=65536)(self._parse_answer)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def size(self, component):
+        return len(self.names[component])
+
+    def parse_triplet(self, text):
+        """(instrument id, verb id, target id) of one triplet text, or None"""
+        text = text.strip().strip('.')
+        match = BRACKET_TRIPLET.search(text)
+        if match:
+            parts = match.groups()
+        elif text.count(',') == 2:
+            parts = text.split(',')
+        else:
+            # Space separated names, which may themselves contain spaces: try every split point
+            tokens = text.split()
+            for i in range(1, len(tokens) - 1):
+                for j in range(i + 1, len(tokens)):
+                    parts = (' '.join(tokens[:i]), ' '.join(tokens[i:j]), ' '.join(tokens[j:]))
+                    ids = self._lookup_parts(parts)
+                    if ids is not None:
+                        return ids
+            return None
+        return self._lookup_parts(parts)
+
+    def class_id(self, component, name):
+        """Id of a class name of one component ('instrument,verb,target' for triplets), or None"""
+        if component == 'triplet':
+            return self.triplet_ids.get(self.parse_triplet(name))
+        return self.ids[component].get(name_key(name))
+
+    def _lookup_parts(self, parts):
+        ids = tuple(self.ids[c].get(name_key(p)) for c, p in zip(('instrument', 'verb', 'target'), parts))
+        return None if None in ids else ids
+
+    def _parse_answer(self, text):
+        """
+        Parse an answer into ({component: frozenset(ids)}, unknown names).
+        The component comes from the answer prefix ("The tools are ...");
+        MCQ answers ("B. grasper") are matched against every vocabulary.
+        A triplet also sets its instrument, verb and target.
+        """
+        text = MCQ_LETTER_PATTERN.sub('', text.strip())
+        component = None
+        for pattern, name in ANSWER_PREFIXES:
+            match = pattern.match(text)
+            if match:
+                component = name
+                text = text[match.end():]
+                break
+        text = text.strip().rstrip('.')
+
+        if component == 'triplet' or (component is None and BRACKET_TRIPLET.search(text)):
+            return self._parse_triplets(text)
+        labels, unknown = self._parse_names(text, component)
+        if component is None and unknown:
+            # Bare text that is not a list of names may be space separated triplets
+            triplet_labels, triplet_unknown = self._parse_triplets(text)
+            if triplet_unknown < unknown:
+                return triplet_labels, triplet_unknown
+        return labels, unknown
+
+    def _parse_triplets(self, text):
+        triplets = set()
+        unknown = 0
+        if BRACKET_TRIPLET.search(text):
+            parts = [match.group(0) for match in BRACKET_TRIPLET.finditer(text)]
+        else:
+            parts = TRIPLET_SEPARATOR.split(text)
+        for part in parts:
+            if not part:
+                continue
+            ids = self.parse_triplet(part)
+            if ids is None:
+                unknown += 1
+                continue
+            triplets.add(ids)
+        labels = {
+            'instrument': frozenset(i for i, _, _ in triplets),
+            'verb': frozenset(v for _, v, _ in triplets),
+            'target': frozenset(t for _, _, t in triplets),
+            'triplet': frozenset(self.triplet_ids[ivt] for ivt in triplets if ivt in self.triplet_ids)
+        }
+        return labels, unknown
+
+    def _parse_names(self, text, component):
+        candidates = [component] if component else ['instrument', 'verb', 'target']
+        ids = {c: set() for c in candidates}
+        unknown = 0
+        for name in LIST_SEPARATOR.split(text):
+            if not name:
+                continue
+            key = name_key(name)
+            matched = [c for c in candidates if key in self.ids[c]]
+            if not matched:
+                unknown += 1
+                continue
+            ids[matched[0]].add(self.ids[matched[0]][key])
+        if component is None:
+            # Bare names: report only the components the names belong to
+            candidates = [c for c in candidates if ids[c]]
+        return {c: frozenset(ids[c]) for c in candidates}, unknown
+
+class MultiLabelAccumulator:
+    """
+    Streaming multi-label evaluation. For every component, each record
+    that answers it gets a row; positive labels are appended as sparse
+    (row, id) pairs and densified into boolean matrices at the end.
+    Per-class scores of a record (evaluate_accuracy.SCORE_FIELDS, keyed by
+    class name) are kept the same way for ranked AP.
+    """
+    def __init__(self, vocabulary, mode="normal"):
+        self.vocabulary = vocabulary
+        self.mode = mode
+        self.rows = {c: 0 for c in COMPONENTS}
+        self.true = {c: (array('i'), array('i')) for c in COMPONENTS}
+        self.pred = {c: (array('i'), array('i')) for c in COMPONENTS}
+        self.scores = {c: (array('i'), array('i'), array('d')) for c in COMPONENTS}
+        self.scored_rows = {c: 0 for c in COMPONENTS}
+        self.total = 0
+        self.skipped = 0
+        self.unknown_true = 0
+        self.unknown_pred = 0
+
+    def update(self, data):
+        fields = extract_response_and_labels(data, self.mode)
+        if fields is None:
+            self.skipped += 1
+            return
+        response, labels = fields
+        true_labels, unknown_true = self.vocabulary.parse_answer(labels)
+        pred_labels, unknown_pred = self.vocabulary.parse_answer(response)
+        self.unknown_true += unknown_true
+        self.unknown_pred += unknown_pred
+        if not true_labels:
+            self.skipped += 1
+            return
+        scores = extract_scores(data) or {}
+        # A record is scored on the components its ground truth answers
+        for component, ids in true_labels.items():
+            row = self.rows[component]
+            for target, values in ((self.true[component], ids), (self.pred[component], pred_labels.get(component, ()))):
+                for value in values:
+                    target[0].append(row)
+                    target[1].append(value)
+            class_scores = {}
+            for name, score in scores.items():
+                class_id = self.vocabulary.class_id(component, name)
+                if class_id is not None:
+                    class_scores[class_id] = max(class_scores.get(class_id, -np.inf), float(score))
+            for class_id, score in class_scores.items():
+                self.scores[component][0].append(row)
+                self.scores[component][1].append(class_id)
+                self.scores[component][2].append(score)
+            self.scored_rows[component] += bool(class_scores)
+            self.rows[component] = row + 1
+        self.total += 1
+
+    def matrices(self, component):
+        """(truth, prediction) boolean matrices of shape (records, classes)"""
+        shape = (self.rows[component], self.vocabulary.size(component))
+        result = []
+        for rows, cols in (self.true[component], self.pred[component]):
+            matrix = np.zeros(shape, dtype=bool)
+            matrix[np.frombuffer(rows, dtype=np.intc), np.frombuffer(cols, dtype=np.intc)] = True
+            result.append(matrix)
+        return result
+
+    def score_matrix(self, component):
+        """(records, classes) scores, -inf for unscored classes; None unless every record has scores"""
+        if self.rows[component] == 0 or self.scored_rows[component] < self.rows[component]:
+            return None
+        rows, cols, values = self.scores[component]
+        matrix = np.full((self.rows[component], self.vocabulary.size(component)), -np.inf)
+        matrix[np.frombuffer(rows, dtype=np.intc), np.frombuffer(cols, dtype=np.intc)] = np.frombuffer(values, dtype=np.float64)
+        return matrix
+
+def multilabel_average_precision(truth, scores):
+    """
+    Exact AP per column of a (records x classes) score matrix, all classes at
+    once: columns are sorted by descending score, precision and recall are
+    cumulative sums, and tied scores count as a single threshold. Classes
+    without positives are NaN, as in ivtmetrics.
+    """
+    num_records, num_classes = truth.shape
+    if num_records == 0:
+        return np.full(num_classes, np.nan)
+    order = np.argsort(-scores, axis=0, kind='stable')
+    ranked = np.take_along_axis(scores, order, axis=0)
+    hits = np.take_along_axis(truth, order, axis=0)
+    tp = np.cumsum(hits, axis=0)
+    positives = tp[-1].astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = tp / np.arange(1, num_records + 1)[:, None]
+        recall = tp / positives
+    # Threshold rows: last row of every run of tied scores
+    is_threshold = np.vstack([ranked[1:] != ranked[:-1], np.ones((1, num_classes), dtype=bool)])
+    # Recall never decreases, so the running max over threshold rows is the previous threshold's recall
+    previous = np.vstack([np.zeros((1, num_classes)), np.maximum.accumulate(np.where(is_threshold, recall, 0), axis=0)[:-1]])
+    ap = np.where(is_threshold, (recall - previous) * precision, 0).sum(axis=0)
+    ap[positives == 0] = np.nan
+    return ap
+
+def component_metrics(truth, pred, names, scores=None):
+    """
+    Per-class and averaged AP / precision / recall / F1 of one component. AP
+    ranks records by `scores` when given; otherwise it is computed on the
+    0/1 predictions, which reduces to precision x recall per class and is
+    not comparable to the score-based mAP of the literature, so
+    'map_source' says which one was used.
+    """
+    tp = np.count_nonzero(truth & pred, axis=0)
+    fp = np.count_nonzero(~truth & pred, axis=0)
+    fn = np.count_nonzero(truth & ~pred, axis=0)
+    support = tp + fn
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    ap = multilabel_average_precision(truth, pred.astype(np.float64) if scores is None else scores)
+
+    present = support > 0
+    classes = {}
+    for idx in np.flatnonzero(present).tolist():
+        classes[names[idx] if idx < len(names) else str(idx)] = {
+            'ap': float(ap[idx]),
+            'precision': float(precision[idx]),
+            'recall': float(recall[idx]),
+            'f1': float(f1[idx]),
+            'support': int(support[idx])
+        }
+    total_tp, total_fp, total_fn = int(tp.sum()), int(fp.sum()), int(fn.sum())
+    micro_p = total_tp / (total_tp + total_fp) if total_tp + total_fp > 0 else 0
+    micro_r = total_tp / (total_tp + total_fn) if total_tp + total_fn > 0 else 0
+    return {
+        'records': int(truth.shape[0]),
+        'map': float(np.nanmean(ap)) if present.any() else 0.0,
+        'map_source': 'binary' if scores is None else 'scores',
+        'macro_f1': float(f1[present].mean()) if present.any() else 0.0,
+        'micro_f1': 2 * micro_p * micro_r / (micro_p + micro_r) if micro_p + micro_r > 0 else 0,
+        'exact_match': float(np.mean((truth == pred).all(axis=1))) if truth.shape[0] else 0.0,
+        'class_metrics': classes
+    }
+
+def evaluate_triplets(jsonl_file, vocabulary, mode="normal"):
+    accumulator = MultiLabelAccumulator(vocabulary, mode)
+    with open(jsonl_file, 'rb') as f:
+        for line in f:
+            if line.strip():
+                accumulator.update(json.loads(line))
+    results = {}
+    for component in COMPONENTS:
+        if accumulator.rows[component] == 0:
+            continue
+        truth, pred = accumulator.matrices(component)
+        results[component] = component_metrics(truth, pred, vocabulary.names[component], accumulator.score_matrix(component))
+    return accumulator, results
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-label evaluation of CholecT50 tool / action / tissue / triplet answers")
+    parser.add_argument("--input_file", required=True, help="Path to the JSONL file")
+    parser.add_argument("--mapping_file", default="data_preprocess/Cholect50/datasets/category_mapping.json", help="CholecT50 category_mapping.json")
+    parser.add_argument("--output", "-o", default=None, help="Path to save results in JSON format")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show per-class metrics")
+    parser.add_argument("--mode", choices=["normal", "cot"], default="normal", help="Evaluation mode: 'normal' for standard format, 'cot' for chain-of-thought format")
+    args = parser.parse_args()
+
+    if not Path(args.input_file).exists():
+        print(f"Error: File {args.input_file} does not exist")
+        return
+
+    vocabulary = TripletVocabulary.load(args.mapping_file)
+    accumulator, results = evaluate_triplets(args.input_file, vocabulary, args.mode)
+
+    print(f"\nRecords: {accumulator.total} evaluated, {accumulator.skipped} skipped")
+    if accumulator.unknown_true or accumulator.unknown_pred:
+        print(f"Unrecognized names: {accumulator.unknown_true} in labels, {accumulator.unknown_pred} in responses")
+
+    print("\nComponent Metrics:")
+    header = f"{'Component':12} {'Records':>8} {'mAP':>8} {'AP from':>8} {'Macro-F1':>9} {'Micro-F1':>9} {'Exact':>8}"
+    print(header)
+    print("-" * len(header))
+    for component, metrics in results.items():
+        print(f"{component:12} {metrics['records']:>8} {metrics['map']:>8.4f} {metrics['map_source']:>8} {metrics['macro_f1']:>9.4f} {metrics['micro_f1']:>9.4f} {metrics['exact_match']:>8.4f}")
+    if any(metrics['map_source'] == 'binary' for metrics in results.values()):
+        print("AP from binary predictions is precision x recall per class, not the score-ranked mAP of the literature")
+
+    if args.verbose:
+        for component, metrics in results.items():
+            class_width = min(max([len(name) for name in metrics['class_metrics']] + [5]), 40)
+            print(f"\nPer-Class Metrics ({component}):")
+            header = f"{'Class':{class_width}} {'AP':>8} {'Precision':>10} {'Recall':>8} {'F1':>8} {'Support':>8}"
+            print(header)
+            print("-" * len(header))
+            for name, m in metrics['class_metrics'].items():
+                print(f"{name[:class_width]:{class_width}} {m['ap']:>8.4f} {m['precision']:>10.4f} {m['recall']:>8.4f} {m['f1']:>8.4f} {m['support']:>8}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'total': accumulator.total,
+                'skipped': accumulator.skipped,
+                'unknown_names': {'labels': accumulator.unknown_true, 'responses': accumulator.unknown_pred},
+                'components': results
+            }, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
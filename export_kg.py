@@ -0,0 +1,403 @@
+import argparse
+import csv
+import json
+import re
+from pathlib import Path
+
+from dedup_datasets import get_video_key
+from surgical_kg import ACTION, INSTRUMENT, PHASE, SurgicalKG, name_key
+
+BATCH_SIZE = 5000
+FRAME_NUMBER = re.compile(r"(\d+)(?!.*\d)")
+MISSING_PHASE = 'Unknown'
+KG_FILE = Path(__file__).resolve().parent / 'testlap_data.cypher'
+# testlap_data.cypher describes laparoscopic hysterectomy, i.e. the AutoLaparo phases
+KB_DATASET = 'autolaparo'
+
+VIDEO = 'TestlapVideo'
+SEGMENT = 'TestlapSegment'
+HAS_SEGMENT = 'TESTLAP_HAS_SEGMENT'
+# Fact kind -> (knowledge-base label, segment -> entity relationship)
+KINDS = {
+    'phase': (PHASE, 'TESTLAP_OF_PHASE'),
+    'tool': (INSTRUMENT, 'TESTLAP_OF_INSTRUMENT'),
+    'triplet': (ACTION, 'TESTLAP_OF_ACTION'),
+}
+# Label -> (uniqueness constraint, key property). Phases, instruments and actions are upserted on
+# the constraints of testlap_data.cypher; videos and segments have none there, so they get their
+# own in the same naming scheme
+CONSTRAINTS = {
+    PHASE: ('testlap_phase_id', 'id'),
+    INSTRUMENT: ('testlap_instrument_id', 'id'),
+    ACTION: ('testlap_action_name', 'name'),
+    VIDEO: ('testlap_video_id', 'id'),
+    SEGMENT: ('testlap_segment_id', 'id'),
+}
+# Node columns per label, key first
+SCHEMA = {
+    PHASE: ('id', 'dataset', 'name'),
+    INSTRUMENT: ('id', 'dataset', 'name'),
+    ACTION: ('name', 'dataset'),
+    VIDEO: ('id', 'dataset', 'video'),
+    SEGMENT: ('id', 'kind', 'video', 'name', 'start_frame', 'end_frame', 'frames'),
+}
+# Knowledge-base nodes are created if missing but never overwritten by an import
+ENTITY_LABELS = {PHASE, INSTRUMENT, ACTION}
+INTEGER_COLUMNS = {'start_frame', 'end_frame', 'frames'}
+
+def constraint_statement(label):
+    name, key = CONSTRAINTS[label]
+    return f"CREATE CONSTRAINT {name} IF NOT EXISTS ON (n:{label}) ASSERT n.{key} IS UNIQUE"
+
+def node_query(label):
+    key = CONSTRAINTS[label][1]
+    update = 'ON CREATE SET' if label in ENTITY_LABELS else 'SET'
+    return f"UNWIND $rows AS row MERGE (n:{label} {{{key}: row.{key}}}) {update} n += row"
+
+def relationship_query(rel_type, source_label, target_label):
+    source_key, target_key = CONSTRAINTS[source_label][1], CONSTRAINTS[target_label][1]
+    return (f"UNWIND $rows AS row MATCH (a:{source_label} {{{source_key}: row.source}}) "
+            f"MATCH (b:{target_label} {{{target_key}: row.target}}) MERGE (a)-[:{rel_type}]->(b)")
+
+def csv_key(key, column):
+    """LOAD CSV value of a key column; ids of testlap_data.cypher are integers, others strings"""
+    return f"coalesce(toInteger(row.{column}), row.{column})" if key == 'id' else f"row.{column}"
+
+def entity_key(kg, kind, dataset, name):
+    """
+    Key of the knowledge-base node a fact refers to. Phases and instruments
+    of KB_DATASET reuse the id of the node with the same name in `kg`;
+    other ones get a '<dataset>/<name>' id. Actions are keyed on their name.
+    """
+    label = KINDS[kind][0]
+    if label == ACTION:
+        return name
+    if kg is not None and dataset == KB_DATASET:
+        node = kg.index[(label, 'name')].get(name_key(name))
+        if node is not None:
+            return kg.nodes[node][1]['id']
+    return f"{dataset}/{name}"
+
+def get_frame_key(data):
+    """
+    (video, frame number) of a meta record: ids are VVFFFFFF (Cholec80) or
+    xxxnnnnnn (CholecT50), otherwise the image directory and the last number
+    in the file name. None if neither works.
+    """
+    record_id = str(data.get('id', ''))
+    if record_id.isdigit() and len(record_id) in (8, 9):
+        split = len(record_id) - 6
+        return record_id[:split], int(record_id[split:])
+    image = data.get('image_path') or (data.get('images') or [None])[0]
+    if image:
+        match = FRAME_NUMBER.search(Path(image).stem)
+        if match:
+            return get_video_key(image), int(match.group(1))
+    return None
+
+def get_facts(data):
+    """{(kind, name)} present in a meta record: its phase, tools and triplets"""
+    facts = set()
+    phase = data.get('phase')
+    if phase and phase != MISSING_PHASE:
+        facts.add(('phase', phase))
+    facts.update(('tool', tool) for tool in data.get('tools', []))
+    for triplet in data.get('triplets', []):
+        facts.add(('triplet', ','.join(triplet.strip('[]').split(']-['))))
+    return facts
+
+class SegmentBuilder:
+    """
+    Run-length encodes per-frame facts of a stream of meta records into
+    segments (video, kind, name, start frame, end frame, frame count). Only
+    the open runs of each video are kept; frames of a video are expected in
+    increasing order, as written by the metadata scripts, and a frame going
+    backwards closes every open run of that video.
+    """
+    def __init__(self):
+        self.open = {}        # video -> {(kind, name): [start, end, frames]}
+        self.last_frame = {}  # video -> last frame number seen
+
+    def update(self, video, frame, facts):
+        """Add one frame; returns the segments it closes"""
+        runs = self.open.setdefault(video, {})
+        closed = []
+        if frame <= self.last_frame.get(video, -1):
+            closed = self.close_video(video)
+            runs = self.open.setdefault(video, {})
+        for fact in list(runs):
+            if fact not in facts:
+                closed.append((video, *fact, *runs.pop(fact)))
+        for fact in facts:
+            run = runs.get(fact)
+            if run is None:
+                runs[fact] = [frame, frame, 1]
+            else:
+                run[1] = frame
+                run[2] += 1
+        self.last_frame[video] = frame
+        return closed
+
+    def close_video(self, video):
+        runs = self.open.pop(video, {})
+        self.last_frame.pop(video, None)
+        return [(video, *fact, *run) for fact, run in runs.items()]
+
+    def close(self):
+        closed = []
+        for video in list(self.open):
+            closed.extend(self.close_video(video))
+        return closed
+
+class UnwindWriter:
+    """
+    Buffers rows per node label / relationship type and writes batched
+    `UNWIND $rows ... MERGE` payloads, one JSON object per line. Pending node
+    batches are always written before a relationship batch, so every MATCH
+    finds its endpoints.
+    """
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.f = open(path, 'w', encoding='utf-8')
+        self.batch_size = batch_size
+        self.nodes = {}
+        self.relationships = {}
+        self.payloads = 0
+        for label in SCHEMA:
+            self.write({'kind': 'constraint', 'query': constraint_statement(label)})
+
+    def write(self, payload):
+        self.f.write(json.dumps(payload, ensure_ascii=False) + '\n')
+        self.payloads += 1
+
+    def add_node(self, label, row):
+        rows = self.nodes.setdefault(label, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush_nodes(label)
+
+    def add_relationship(self, rel_type, source_label, target_label, source, target):
+        key = (rel_type, source_label, target_label)
+        rows = self.relationships.setdefault(key, [])
+        rows.append({'source': source, 'target': target})
+        if len(rows) >= self.batch_size:
+            self.flush_nodes()
+            self.flush_relationships(key)
+
+    def flush_nodes(self, label=None):
+        for name in [label] if label else list(self.nodes):
+            rows = self.nodes.pop(name, None)
+            if rows:
+                self.write({'kind': 'nodes', 'label': name, 'query': node_query(name), 'rows': rows})
+
+    def flush_relationships(self, key=None):
+        for rel in [key] if key else list(self.relationships):
+            rows = self.relationships.pop(rel, None)
+            if rows:
+                rel_type, source_label, target_label = rel
+                self.write({'kind': 'relationships', 'type': rel_type, 'source_label': source_label,
+                            'target_label': target_label,
+                            'query': relationship_query(rel_type, source_label, target_label), 'rows': rows})
+
+    def close(self):
+        self.flush_nodes()
+        self.flush_relationships()
+        self.f.close()
+
+class CsvWriter:
+    """
+    One CSV per node label and relationship type, written as rows arrive,
+    plus `load_csv.cypher` with idempotent `LOAD CSV ... MERGE` statements
+    that import them in transactions of `batch_size` rows.
+    """
+    def __init__(self, out_dir, batch_size=BATCH_SIZE):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.files = {}
+        self.writers = {}
+        self.tables = {}  # file name -> (label,) or (rel_type, source_label, target_label)
+        self.payloads = 0
+
+    def writer(self, name, header, table):
+        if name not in self.writers:
+            self.tables[name] = table
+            f = open(self.out_dir / f"{name}.csv", 'w', encoding='utf-8', newline='')
+            self.files[name] = f
+            self.writers[name] = csv.writer(f)
+            self.writers[name].writerow(header)
+        return self.writers[name]
+
+    def add_node(self, label, row):
+        columns = SCHEMA[label]
+        self.writer(f"nodes_{label}", columns, (label,)).writerow([row.get(c, '') for c in columns])
+
+    def add_relationship(self, rel_type, source_label, target_label, source, target):
+        name = f"rels_{rel_type}_{source_label}_{target_label}"
+        self.writer(name, ('source', 'target'), (rel_type, source_label, target_label)).writerow([source, target])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        statements = [constraint_statement(label) + ';' for label in SCHEMA]
+        transactions = f"IN TRANSACTIONS OF {self.batch_size} ROWS"
+        for name, table in self.tables.items():
+            if len(table) == 1:
+                label = table[0]
+                key = CONSTRAINTS[label][1]
+                sets = ', '.join(f"n.{c} = toInteger(row.{c})" if c in INTEGER_COLUMNS else f"n.{c} = row.{c}"
+                                 for c in SCHEMA[label] if c != key)
+                update = 'ON CREATE SET' if label in ENTITY_LABELS else 'SET'
+                statements.append(f":auto LOAD CSV WITH HEADERS FROM 'file:///{name}.csv' AS row "
+                                  f"CALL {{ WITH row MERGE (n:{label} {{{key}: {csv_key(key, key)}}}) {update} {sets} }} {transactions};")
+            else:
+                rel_type, source_label, target_label = table
+                source_key, target_key = CONSTRAINTS[source_label][1], CONSTRAINTS[target_label][1]
+                statements.append(f":auto LOAD CSV WITH HEADERS FROM 'file:///{name}.csv' AS row "
+                                  f"CALL {{ WITH row MATCH (a:{source_label} {{{source_key}: {csv_key(source_key, 'source')}}}) "
+                                  f"MATCH (b:{target_label} {{{target_key}: {csv_key(target_key, 'target')}}}) MERGE (a)-[:{rel_type}]->(b) }} {transactions};")
+        with open(self.out_dir / 'load_csv.cypher', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(statements) + '\n')
+        self.payloads = len(statements)
+
+def export(input_files, writer, kg=None):
+    """
+    Stream meta JSONL files into `writer` as video and segment nodes linked
+    to the phase, instrument and action nodes of the knowledge base (see
+    entity_key; `kg` is the graph of testlap_data.cypher). Memory is bounded
+    by the open runs per video and the vocabularies, not by the number of
+    frames.
+    """
+    seen_entities = set()
+    counts = {'records': 0, 'skipped': 0, 'segments': 0}
+
+    def emit(dataset, segments):
+        for video, kind, name, start, end, frames in segments:
+            entity_label, rel_type = KINDS[kind]
+            video_id = f"{dataset}/{video}"
+            entity = entity_key(kg, kind, dataset, name)
+            segment_id = f"{video_id}/{kind}/{name}/{start}"
+            if (VIDEO, video_id) not in seen_entities:
+                seen_entities.add((VIDEO, video_id))
+                writer.add_node(VIDEO, {'id': video_id, 'dataset': dataset, 'video': video})
+            if (entity_label, entity) not in seen_entities:
+                seen_entities.add((entity_label, entity))
+                row = {'name': name, 'dataset': dataset}
+                if entity_label != ACTION:
+                    row['id'] = entity
+                writer.add_node(entity_label, row)
+            writer.add_node(SEGMENT, {'id': segment_id, 'kind': kind, 'video': video_id, 'name': name,
+                                      'start_frame': start, 'end_frame': end, 'frames': frames})
+            writer.add_relationship(HAS_SEGMENT, VIDEO, SEGMENT, video_id, segment_id)
+            writer.add_relationship(rel_type, SEGMENT, entity_label, segment_id, entity)
+            counts['segments'] += 1
+
+    for input_file in input_files:
+        builders = {}
+        with open(input_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                key = get_frame_key(data)
+                if key is None:
+                    counts['skipped'] += 1
+                    continue
+                dataset = data.get('dataset') or Path(input_file).stem
+                builder = builders.setdefault(dataset, SegmentBuilder())
+                emit(dataset, builder.update(*key, get_facts(data)))
+                counts['records'] += 1
+        for dataset, builder in builders.items():
+            emit(dataset, builder.close())
+    writer.close()
+    return counts
+
+def iter_payloads(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def lookup_key(key, value):
+    """Index key of a property value, as SurgicalKG normalizes names"""
+    return name_key(value) if key == 'name' else value
+
+def apply_payload(graph, payload):
+    """Apply one UNWIND payload to an in-process SurgicalKG with the same MERGE semantics as the Cypher query"""
+    if payload['kind'] == 'constraint':
+        graph.execute(payload['query'])
+    elif payload['kind'] == 'nodes':
+        label = payload['label']
+        key = CONSTRAINTS[label][1]
+        for row in payload['rows']:
+            # ON CREATE SET: existing knowledge-base nodes are left as they are
+            if label in ENTITY_LABELS and lookup_key(key, row[key]) in graph.index[(label, key)]:
+                continue
+            graph.merge_node(label, row, key)
+    else:
+        source_key = CONSTRAINTS[payload['source_label']][1]
+        target_key = CONSTRAINTS[payload['target_label']][1]
+        sources = graph.index[(payload['source_label'], source_key)]
+        targets = graph.index[(payload['target_label'], target_key)]
+        for row in payload['rows']:
+            source = sources.get(lookup_key(source_key, row['source']))
+            target = targets.get(lookup_key(target_key, row['target']))
+            if source is not None and target is not None:
+                graph.merge_edge(payload['type'], source, target)
+
+def load_payloads(path, graph):
+    for payload in iter_payloads(path):
+        apply_payload(graph, payload)
+    graph.build()
+    return graph
+
+def load_neo4j(path, uri, user, password):
+    """Run UNWIND payloads against a Neo4j server, one transaction per batch"""
+    try:
+        from neo4j import GraphDatabase
+    except ImportError:
+        raise ImportError("Loading into Neo4j requires the neo4j driver: pip install neo4j")
+    with GraphDatabase.driver(uri, auth=(user, password)) as driver:
+        with driver.session() as session:
+            for payload in iter_payloads(path):
+                session.execute_write(lambda tx: tx.run(payload['query'], rows=payload.get('rows', [])).consume())
+
+def main():
+    parser = argparse.ArgumentParser(description='Export per-video phase, tool and triplet segments from meta JSONL files for a batched graph import')
+    parser.add_argument('inputs', nargs='+', help='Meta JSONL files (Cholec80 meta_data.jsonl, CholecT50 meta_phase_triplet_data.jsonl, ...)')
+    parser.add_argument('--output', '-o', required=True, help="Output: a JSONL payload file for 'unwind', a directory for 'csv'")
+    parser.add_argument('--format', choices=['unwind', 'csv'], default='unwind', help='Batched UNWIND payloads or CSV files with a LOAD CSV script (default: unwind)')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE, help=f'Rows per UNWIND batch or LOAD CSV transaction (default: {BATCH_SIZE})')
+    parser.add_argument('--verify', action='store_true', help='Load the payloads twice into an in-process graph seeded from --cypher and check the import is idempotent')
+    parser.add_argument('--cypher', default=str(KG_FILE), help='Knowledge base whose phase/instrument ids are reused and which --verify loads (default: testlap_data.cypher)')
+    parser.add_argument('--neo4j_uri', default=None, help='Also load the payloads into this Neo4j server (requires the neo4j driver)')
+    parser.add_argument('--neo4j_user', default='neo4j')
+    parser.add_argument('--neo4j_password', default=None)
+    args = parser.parse_args()
+
+    if args.format == 'csv':
+        writer = CsvWriter(args.output, args.batch_size)
+    else:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        writer = UnwindWriter(args.output, args.batch_size)
+    counts = export(args.inputs, writer, SurgicalKG.from_cypher(args.cypher))
+    print(f"Records: {counts['records']} (skipped {counts['skipped']} without a video/frame key)")
+    print(f"Segments: {counts['segments']}")
+    print(f"Wrote {writer.payloads} {'payloads' if args.format == 'unwind' else 'statements'} to {args.output}")
+
+    if args.verify:
+        if args.format != 'unwind':
+            parser.error('--verify needs --format unwind')
+        graph = load_payloads(args.output, SurgicalKG.from_cypher(args.cypher))
+        first = graph.summary()
+        second = load_payloads(args.output, graph).summary()
+        print("Nodes: " + ", ".join(f"{label} {count}" for label, count in first[0].items()))
+        print("Relationships: " + ", ".join(f"{rel_type} {count}" for rel_type, count in first[1].items()))
+        print(f"Idempotent: {'yes' if first == second else 'NO'}")
+    if args.neo4j_uri:
+        if args.format != 'unwind':
+            parser.error('--neo4j_uri needs --format unwind')
+        load_neo4j(args.output, args.neo4j_uri, args.neo4j_user, args.neo4j_password)
+        print(f"Loaded into {args.neo4j_uri}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import json
+from array import array
+
+import numpy as np
+
+from dedup_datasets import get_image_paths
+
+class ImageIndex:
+    """
+    Index from unique image sets to the records that use them, over one or
+    more JSONL files. Records are kept as (file, byte offset) so they can be
+    re-read on demand; each record's image set (the tuple of its image paths)
+    is interned to an integer id, and the inverse mapping from image set to
+    records is a CSR array sorted by image set.
+    """
+    def __init__(self, files, record_files, record_offsets, record_groups, groups):
+        self.files = list(files)
+        self.record_files = np.asarray(record_files, dtype=np.int32)
+        self.record_offsets = np.asarray(record_offsets, dtype=np.int64)
+        self.record_groups = np.asarray(record_groups, dtype=np.int64)
+        self.groups = list(groups)  # group id -> tuple of image paths
+        self.group_ids = {images: i for i, images in enumerate(self.groups)}
+        # Records of group g: group_records[group_indptr[g]:group_indptr[g + 1]], in file order
+        self.group_records = np.argsort(self.record_groups, kind='stable')
+        self.group_indptr = np.zeros(len(self.groups) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.record_groups, minlength=len(self.groups)), out=self.group_indptr[1:])
+        self._image_groups = None
+        self._handles = {}
+
+    @classmethod
+    def build(cls, files):
+        groups = {}
+        record_files = array('i')
+        record_offsets = array('q')
+        record_groups = array('q')
+        for file_id, path in enumerate(files):
+            with open(path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if line.strip():
+                        images = tuple(get_image_paths(json.loads(line)))
+                        record_files.append(file_id)
+                        record_offsets.append(offset)
+                        record_groups.append(groups.setdefault(images, len(groups)))
+                    offset += len(line)
+        return cls(files, np.frombuffer(record_files, dtype=np.int32), np.frombuffer(record_offsets, dtype=np.int64),
+                   np.frombuffer(record_groups, dtype=np.int64), list(groups))
+
+    def save(self, path):
+        np.savez(path, files=np.array(self.files, dtype=str), record_files=self.record_files,
+                 record_offsets=self.record_offsets, record_groups=self.record_groups,
+                 groups=np.array([json.dumps(images, ensure_ascii=False) for images in self.groups], dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['files'].tolist(), data['record_files'], data['record_offsets'], data['record_groups'],
+                       [tuple(json.loads(images)) for images in data['groups'].tolist()])
+
+    def __len__(self):
+        return len(self.record_offsets)
+
+    def group_of(self, images):
+        """Record ids of an exact tuple of image paths"""
+        group = self.group_ids.get(tuple(images))
+        if group is None:
+            return np.zeros(0, dtype=np.int64)
+        return self.group_records[self.group_indptr[group]:self.group_indptr[group + 1]]
+
+    def records_of(self, path):
+        """Record ids of every record using an image path, alone or with other images"""
+        if self._image_groups is None:
+            self._image_groups = {}
+            for group, images in enumerate(self.groups):
+                for image in set(images):
+                    self._image_groups.setdefault(image, []).append(group)
+        groups = self._image_groups.get(path, [])
+        if not groups:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate([self.group_records[self.group_indptr[g]:self.group_indptr[g + 1]] for g in groups]))
+
+    def read_record(self, record):
+        """Parse one record from its file"""
+        file_id = int(self.record_files[record])
+        f = self._handles.get(file_id)
+        if f is None:
+            f = self._handles[file_id] = open(self.files[file_id], 'rb')
+        f.seek(int(self.record_offsets[record]))
+        return json.loads(f.readline())
+
+    def close(self):
+        for f in self._handles.values():
+            f.close()
+        self._handles = {}
+
+    def iter_batches(self, batch_size, order=None):
+        """
+        Yield batches of (image paths, record ids) groups with at most
+        `batch_size` records, keeping the records of an image set together.
+        A group larger than a batch is split across consecutive batches.
+        `order` is an optional permutation of group ids (e.g. shuffled).
+        """
+        batch, size = [], 0
+        for group in (range(len(self.groups)) if order is None else order):
+            records = self.group_records[self.group_indptr[group]:self.group_indptr[group + 1]]
+            while len(records):
+                if size == batch_size:
+                    yield batch
+                    batch, size = [], 0
+                take = records[:batch_size - size]
+                batch.append((self.groups[group], take))
+                size += len(take)
+                records = records[len(take):]
+        if batch:
+            yield batch
+
+    def iter_grouped_records(self, load_image, batch_size=256, order=None):
+        """
+        Yield (record, images) with every image of a group decoded once by
+        `load_image(path)` and shared by all records of the group. The parts
+        of a group split across batches are consecutive, so its decoded
+        images are carried over to the next batch rather than decoded again.
+        """
+        current, decoded = None, None
+        for batch in self.iter_batches(batch_size, order):
+            for images, records in batch:
+                if images is not current:
+                    current, decoded = images, [load_image(path) for path in images]
+                for record in records:
+                    yield self.read_record(int(record)), decoded
+
+    def stats(self):
+        counts = np.diff(self.group_indptr)
+        unique_paths = {path for images in self.groups for path in images}
+        return {
+            'records': len(self),
+            'image_sets': len(self.groups),
+            'unique_images': len(unique_paths),
+            'records_per_image_set': float(counts.mean()) if len(counts) else 0.0,
+            'max_records_per_image_set': int(counts.max()) if len(counts) else 0,
+            'shared_image_sets': int((counts > 1).sum())
+        }
+
+def write_grouped(index, output_file):
+    """Write all records in image-set order, so records sharing images are adjacent"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for record in index.group_records:
+            f.write(json.dumps(index.read_record(int(record)), ensure_ascii=False) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Index the records of JSONL files by the images they use')
+    parser.add_argument('inputs', nargs='+', help='Task or merged JSONL files')
+    parser.add_argument('--output', '-o', default=None, help='Save the index (.npz)')
+    parser.add_argument('--grouped_output', default=None, help='Also write all records with records sharing images adjacent')
+    args = parser.parse_args()
+
+    index = ImageIndex.build(args.inputs)
+    stats = index.stats()
+    print(f"Records: {stats['records']}")
+    print(f"Unique images: {stats['unique_images']} in {stats['image_sets']} image sets")
+    print(f"Records per image set: {stats['records_per_image_set']:.2f} (max {stats['max_records_per_image_set']})")
+    print(f"Image sets used by more than one record: {stats['shared_image_sets']}")
+    if args.output:
+        index.save(args.output)
+        print(f"Index saved to {args.output}")
+    if args.grouped_output:
+        write_grouped(index, args.grouped_output)
+        print(f"Grouped records saved to {args.grouped_output}")
+    index.close()
+
+if __name__ == '__main__':
+    main()
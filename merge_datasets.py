@@ -1,9 +1,16 @@
 import json
-import os
 import random
-from collections import defaultdict, Counter
 from pathlib import Path
 import shutil
+import argparse
+import hashlib
+
+from dedup_datasets import Deduplicator
+from dataset_stats import DatasetStats, diff_stats
+from merged_shards import ShardWriter
+
+# Fraction of each MCQ file kept in the merged data
+MCQ_SAMPLE_RATIO = 0.2
 
 def read_jsonl_generator(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -17,7 +24,7 @@ def count_lines(file_path):
             count += 1
     return count
 
-def reservoir_sample(file_path, k):
+def reservoir_sample(file_path, k, rng=random):
     """
     Perform reservoir sampling to randomly select k items from a stream.
     This is memory efficient as it never holds more than k items in memory.
@@ -27,11 +34,90 @@ def reservoir_sample(file_path, k):
         if i < k:
             reservoir.append(item)
         else:
-            j = random.randrange(i + 1)
+            j = rng.randrange(i + 1)
             if j < k:
                 reservoir[j] = item
     return reservoir
 
+def file_sha1(file_path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_fingerprint(file_path, previous=None):
+    """
+    Fingerprint an input file by (size, mtime, sha1). The hash is only
+    recomputed when size or mtime differ from the previous fingerprint.
+    """
+    stat = file_path.stat()
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if previous and previous['size'] == fingerprint['size'] and previous['mtime'] == fingerprint['mtime']:
+        fingerprint['sha1'] = previous['sha1']
+    else:
+        fingerprint['sha1'] = file_sha1(file_path)
+    return fingerprint
+
+def load_manifest(manifest_path, settings):
+    """Load the shard manifest, discarding it if it was built with other settings."""
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('settings') == settings:
+            return manifest
+        print("Merge settings changed, rebuilding all shards")
+    return {'settings': settings, 'sources': {}}
+
+def get_stats_path(shard_path):
+    return shard_path.with_suffix('.stats.json')
+
+def remove_stale_shards(shard_dir, manifest):
+    """
+    Delete shard and statistics files the manifest does not reference: shards
+    of inputs that no longer exist, and every old shard after the settings
+    changed (the discarded manifest no longer lists them).
+    """
+    keep = {Path(entry['shard']) for entry in manifest['sources'].values()}
+    keep |= {get_stats_path(shard) for shard in keep}
+    for path in sorted(shard_dir.rglob('*.jsonl')) + sorted(shard_dir.rglob('*.stats.json')):
+        if path.relative_to(shard_dir) not in keep:
+            print(f"Removing stale shard {path.relative_to(shard_dir)}")
+            path.unlink()
+
+def write_source_shard(input_path, shard_path, dataset, file_name, split, rng):
+    """
+    Sample one ready/ file and write it, tagged with `_source`, to its
+    intermediate shard, collecting the shard statistics in the same pass.
+    Returns (original line count, written count).
+    """
+    # Count total lines in input file
+    total_lines = count_lines(input_path)
+    
+    # Determine if we need to sample
+    is_mcq = 'mcq' in file_name.lower()
+    sample_size = int(total_lines * MCQ_SAMPLE_RATIO) if is_mcq else total_lines
+    
+    stats = DatasetStats()
+    stats.add_original(f"{dataset}/{file_name}", total_lines)
+    shard_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = shard_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as out_f:
+        if is_mcq:
+            # Use reservoir sampling for MCQ files
+            items = reservoir_sample(input_path, sample_size, rng)
+        else:
+            # For non-MCQ files, we can stream directly
+            items = read_jsonl_generator(input_path)
+        for item in items:
+            # Add metadata to track source
+            item['_source'] = {'dataset': dataset, 'file': file_name}
+            out_f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            stats.update(item, split, dataset, file_name)
+    stats.save(get_stats_path(shard_path))
+    tmp_path.replace(shard_path)
+    return total_lines, sample_size
+
 def get_split_type(filename):
     """Get the split type (train/val/test) from filename."""
     if filename.startswith('train'):
@@ -43,24 +129,34 @@ def get_split_type(filename):
     else:
         raise ValueError(f"Unknown split type in filename: {filename}")
 
-def merge_datasets():
+def merge_datasets(incremental=False, dedup=False, use_phash=False, max_near_duplicates=1, seed=42, compare_stats=None, shard_size=None):
     # Define dataset paths
     base_path = Path('data_json')
     output_dir = Path('merged_data')
+    shard_dir = output_dir / 'shards'
+    manifest_path = shard_dir / 'manifest.json'
+    settings = {'seed': seed, 'mcq_sample_ratio': MCQ_SAMPLE_RATIO}
     
-    # Create output directory if it doesn't exist
-    if output_dir.exists():
-        shutil.rmtree(output_dir)
-    output_dir.mkdir()
+    # Statistics of the previous merge, to report distribution shifts
+    stats_path = output_dir / 'stats.json'
+    if compare_stats is None and stats_path.exists():
+        compare_stats = stats_path
+    previous_stats = DatasetStats.load(compare_stats) if compare_stats else None
     
-    # Statistics
-    dataset_stats = defaultdict(lambda: {'files': set(), 'total_examples': 0, 'original_examples': 0})
-    split_stats = defaultdict(lambda: {'total': 0, 'datasets': set(), 'file_types': set()})
+    # A full rebuild starts from an empty output directory; an incremental
+    # run keeps the per-source shards and only rewrites the split files
+    if output_dir.exists() and not incremental:
+        shutil.rmtree(output_dir)
+    output_dir.mkdir(exist_ok=True)
+    manifest = load_manifest(manifest_path, settings) if incremental else {'settings': settings, 'sources': {}}
+    new_manifest = {'settings': settings, 'sources': {}}
+
     
     # Process each dataset in the data_json directory
-    datasets = [d.name for d in base_path.iterdir() if d.is_dir()]
+    datasets = sorted(d.name for d in base_path.iterdir() if d.is_dir())
     
-    # Process each dataset
+    # Stage 1: bring the per-source shards up to date
+    rebuilt = 0
     for dataset in datasets:
         ready_path = base_path / dataset / 'ready'
         if not ready_path.exists():
@@ -68,80 +164,131 @@ def merge_datasets():
             continue
             
         # Process each file in the ready directory
-        for input_path in ready_path.glob('*.jsonl'):
+        for input_path in sorted(ready_path.glob('*.jsonl')):
             file_name = input_path.name
-            print(f"Processing {dataset}/{file_name}")
+            source = f"{dataset}/{file_name}"
+            shard_path = shard_dir / dataset / file_name
             
+            previous = manifest['sources'].get(source)
+            fingerprint = file_fingerprint(input_path, previous['fingerprint'] if previous else None)
+            if (previous and previous['fingerprint']['sha1'] == fingerprint['sha1']
+                    and shard_path.exists() and get_stats_path(shard_path).exists()):
+                print(f"Up to date {source}")
+                new_manifest['sources'][source] = dict(previous, fingerprint=fingerprint)
+                continue
+            
+            print(f"Processing {source}")
+            # Seed per source so a shard does not depend on which other shards were rebuilt
+            rng = random.Random(f"{seed}:{source}")
             # Get split type (train/val/test)
             split = get_split_type(file_name)
-            output_path = output_dir / f"{split}.jsonl"
-            
-            # Count total lines in input file
-            total_lines = count_lines(input_path)
-            
-            # Determine if we need to sample
-            is_mcq = 'mcq' in file_name.lower()
-            sample_size = int(total_lines * 0.2) if is_mcq else total_lines
-            
-            # Update statistics
-            dataset_stats[dataset]['files'].add(file_name)
-            dataset_stats[dataset]['total_examples'] += sample_size
-            dataset_stats[dataset]['original_examples'] += total_lines
-            
-            split_stats[split]['total'] += sample_size
-            split_stats[split]['datasets'].add(dataset)
-            file_type = 'mcq' if is_mcq else 'vqa'
-            split_stats[split]['file_types'].add(file_type)
-            
-            # Append to output file
-            write_mode = 'a' if output_path.exists() else 'w'
-            with open(output_path, write_mode, encoding='utf-8') as out_f:
-                if is_mcq:
-                    # Use reservoir sampling for MCQ files
-                    sampled_data = reservoir_sample(input_path, sample_size)
-                    for item in sampled_data:
-                        # Add metadata to track source
-                        item['_source'] = {'dataset': dataset, 'file': file_name}
-                        out_f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            total_lines, sample_size = write_source_shard(input_path, shard_path, dataset, file_name, split, rng)
+            new_manifest['sources'][source] = {
+                'dataset': dataset,
+                'file': file_name,
+                'split': split,
+                'shard': str(shard_path.relative_to(shard_dir)),
+                'fingerprint': fingerprint,
+                'original_examples': total_lines,
+                'sampled_examples': sample_size
+            }
+            rebuilt += 1
+    
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    remove_stale_shards(shard_dir, new_manifest)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(new_manifest, f, indent=2)
+    print(f"Rebuilt {rebuilt} of {len(new_manifest['sources'])} source shards")
+    
+    # Stage 2: concatenate shards into the split files. Statistics come from
+    # the per-shard summaries, or from the dedup pass when records are dropped
+    stats = DatasetStats()
+    # One deduplicator per split so that a frame can still appear in both train and test
+    dedupers = {}
+    split_files = {}
+    for source, entry in new_manifest['sources'].items():
+        dataset, file_name, split = entry['dataset'], entry['file'], entry['split']
+        if split not in split_files:
+            # Either one monolithic split file or fixed-size shards with a manifest
+            if shard_size:
+                if (output_dir / split).exists():
+                    shutil.rmtree(output_dir / split)
+                split_files[split] = ShardWriter(output_dir / split, shard_size)
+            else:
+                split_files[split] = open(output_dir / f"{split}.jsonl", 'w', encoding='utf-8')
+        out_f = split_files[split]
+        shard_path = shard_dir / entry['shard']
+        
+        if dedup:
+            if split not in dedupers:
+                dedupers[split] = Deduplicator(use_phash=use_phash, max_near_duplicates=max_near_duplicates)
+            stats.add_original(source, entry['original_examples'])
+            for item in read_jsonl_generator(shard_path):
+                if dedupers[split].keep(item, source):
+                    out_f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                    stats.update(item, split, dataset, file_name)
+        else:
+            with open(shard_path, 'r', encoding='utf-8') as shard_f:
+                if shard_size:
+                    for line in shard_f:
+                        out_f.write(line)
                 else:
-                    # For non-MCQ files, we can stream directly
-                    for item in read_jsonl_generator(input_path):
-                        # Add metadata to track source
-                        item['_source'] = {'dataset': dataset, 'file': file_name}
-                        out_f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                    shutil.copyfileobj(shard_f, out_f)
+            stats.merge(DatasetStats.load(get_stats_path(shard_path)))
+    for out_f in split_files.values():
+        out_f.close()
+    
+    # Remove split outputs that no longer have any source or use the other layout
+    for split in ['train', 'val', 'test']:
+        if split not in split_files or shard_size:
+            (output_dir / f"{split}.jsonl").unlink(missing_ok=True)
+        if (split not in split_files or not shard_size) and (output_dir / split).exists():
+            shutil.rmtree(output_dir / split)
     
-    # Print statistics
-    print("\nDataset Statistics:")
-    print("=" * 50)
-    for dataset, stats in dataset_stats.items():
-        print(f"\nDataset: {dataset}")
-        print(f"Original examples: {stats['original_examples']}")
-        print(f"After sampling: {stats['total_examples']}")
-        print(f"Files processed: {len(stats['files'])}")
-        print("Files:", ", ".join(sorted(stats['files'])))
+    # Report removed duplicates per source. Every run deduplicates all shards
+    # again, so the hash sets are not kept between runs
+    for split, deduper in dedupers.items():
+        deduper.print_report(split)
     
-    print("\nMerged Split Statistics:")
-    print("=" * 50)
-    for split, stats in split_stats.items():
-        print(f"\nSplit: {split}")
-        print(f"Total examples: {stats['total']}")
-        print(f"Source datasets: {', '.join(sorted(stats['datasets']))}")
-        print(f"File types: {', '.join(sorted(stats['file_types']))}")
+    # Print and save statistics
+    stats.print_summary()
+    stats.save(stats_path)
+    print(f"\nStatistics saved to {stats_path}")
     
-    total_original = sum(stats['original_examples'] for stats in dataset_stats.values())
-    total_after_sampling = sum(stats['total_examples'] for stats in dataset_stats.values())
-    print(f"\nTotal original examples across all datasets: {total_original}")
-    print(f"Total examples after sampling: {total_after_sampling}")
-    print(f"Total datasets processed: {len(dataset_stats)}")
+    if previous_stats is not None:
+        changes = diff_stats(previous_stats, stats)
+        print(f"\nDistribution changes vs {compare_stats}:")
+        if not changes:
+            print("No split share changed by more than 5%")
+        for key, old_count, new_count, old_share, new_share in changes:
+            print(f"{' / '.join(key)}: {old_count} ({old_share:.1%}) -> {new_count} ({new_share:.1%})")
     
     print("\nOutput files:")
-    for split in ['train', 'val', 'test']:
-        file_path = output_dir / f"{split}.jsonl"
-        if file_path.exists():
-            print(f"{split}.jsonl: {count_lines(file_path)} examples")
+    for (split,), total in sorted(stats.marginal('split').items()):
+        if shard_size:
+            print(f"{split}/: {total} examples in {len(split_files[split].shards)} shards")
+        else:
+            print(f"{split}.jsonl: {total} examples")
     
     print("\nMerging complete!")
 
 if __name__ == '__main__':
-    random.seed(42)  # For reproducibility
-    merge_datasets() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Merge the ready/ task files of all datasets into train/val/test')
+    parser.add_argument('--dedup', action='store_true', help='Drop records with identical (images, question, answer)')
+    parser.add_argument('--phash', action='store_true', help='Also limit near-identical frames per video using a perceptual hash (implies --dedup)')
+    parser.add_argument('--max_near_duplicates', type=int, default=1, help='Records kept per (video, perceptual hash, question, answer) bucket (default: 1)')
+    parser.add_argument('--incremental', action='store_true', help='Reuse the shards of ready/ files whose fingerprint did not change')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for MCQ sampling (default: 42)')
+    parser.add_argument('--shard_size', type=int, default=None, help='Write each split as <split>/part-XXXXX.jsonl shards of this many records plus a manifest.json')
+    parser.add_argument('--compare_stats', default=None, help='stats.json of a previous merge to diff against (default: the existing merged_data/stats.json)')
+    args = parser.parse_args()
+    
+    merge_datasets(
+        incremental=args.incremental,
+        dedup=args.dedup or args.phash,
+        use_phash=args.phash,
+        max_near_duplicates=args.max_near_duplicates,
+        seed=args.seed,  # For reproducibility
+        compare_stats=args.compare_stats,
+        shard_size=args.shard_size
+    )
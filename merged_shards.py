@@ -0,0 +1,211 @@
+import json
+import os
+import random
+from pathlib import Path
+
+MANIFEST_NAME = 'manifest.json'
+# Lines held in memory by the record shuffle of each consumer
+SHUFFLE_BUFFER = 10000
+
+class ShardWriter:
+    """
+    Write JSONL lines into fixed-size shards `part-00000.jsonl`, ... under
+    `output_dir` and record the record count and byte size of every shard
+    in `manifest.json` on close.
+    """
+    def __init__(self, output_dir, shard_size):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.shards = []
+        self.file = None
+
+    def _open_next(self):
+        if self.file is not None:
+            self.file.close()
+        name = f"part-{len(self.shards):05d}.jsonl"
+        self.file = open(self.output_dir / name, 'wb')
+        self.shards.append({'path': name, 'records': 0, 'bytes': 0})
+
+    def write(self, line):
+        """Write one JSONL line (str, with trailing newline)."""
+        if self.file is None or self.shards[-1]['records'] >= self.shard_size:
+            self._open_next()
+        data = line.encode('utf-8')
+        self.file.write(data)
+        self.shards[-1]['records'] += 1
+        self.shards[-1]['bytes'] += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        manifest = {
+            'shard_size': self.shard_size,
+            'total_records': sum(s['records'] for s in self.shards),
+            'total_bytes': sum(s['bytes'] for s in self.shards),
+            'shards': self.shards
+        }
+        with open(self.output_dir / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+def load_manifest(path):
+    """Load a shard manifest from a manifest.json path or its directory."""
+    path = Path(path)
+    if path.is_dir():
+        path = path / MANIFEST_NAME
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['root'] = str(path.parent)
+    return manifest
+
+def assign_shards(shards, consumer, num_consumers):
+    """
+    Deterministically split shards over consumers without overlap. Shards
+    are handed out largest first to the consumer with the fewest bytes so
+    far, so every rank/worker gets a similar amount of data to parse.
+    Returns the shard indices of `consumer`, in file order.
+    """
+    loads = [0] * num_consumers
+    owned = [[] for _ in range(num_consumers)]
+    for idx in sorted(range(len(shards)), key=lambda i: (-shards[i]['bytes'], i)):
+        target = min(range(num_consumers), key=lambda c: (loads[c], c))
+        loads[target] += shards[idx]['bytes']
+        owned[target].append(idx)
+    return sorted(owned[consumer])
+
+def consumer_records(shards, num_consumers):
+    """
+    Records every consumer yields. Byte-balanced shards hold different
+    numbers of records, so all consumers are padded to the largest count
+    (as DistributedSampler does): no record is dropped and every DDP rank
+    runs the same number of steps.
+    """
+    counts = [sum(shards[idx]['records'] for idx in assign_shards(shards, consumer, num_consumers))
+              for consumer in range(num_consumers)]
+    return max(counts, default=0)
+
+def get_consumer(rank=None, world_size=None, worker_id=None, num_workers=None):
+    """
+    Resolve (consumer index, number of consumers) for rank x worker. Missing
+    values are taken from torch.distributed / RANK, WORLD_SIZE and the
+    DataLoader worker info.
+    """
+    if rank is None or world_size is None:
+        try:
+            import torch.distributed as dist
+            initialized = dist.is_available() and dist.is_initialized()
+        except ImportError:
+            initialized = False
+        if initialized:
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        else:
+            rank = int(os.environ.get('RANK', 0))
+            world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if worker_id is None or num_workers is None:
+        worker_id, num_workers = 0, 1
+        try:
+            from torch.utils.data import get_worker_info
+            info = get_worker_info()
+            if info is not None:
+                worker_id, num_workers = info.id, info.num_workers
+        except ImportError:
+            pass
+    return rank * num_workers + worker_id, world_size * num_workers
+
+def shuffle_buffer(items, buffer_size, rng):
+    """Shuffle a stream holding at most `buffer_size` items: each new item replaces a random buffered one, which is yielded"""
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = rng.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+def iter_shard_lines(root, shards, owned, target, rng=None):
+    """Yield `target` lines of the owned shards, repeating them as needed; with `rng`, shard order is permuted on every pass"""
+    yielded = 0
+    while yielded < target:
+        order = list(owned)
+        if rng is not None:
+            rng.shuffle(order)
+        for idx in order:
+            with open(Path(root) / shards[idx]['path'], 'r', encoding='utf-8') as f:
+                for line in f:
+                    if yielded == target:
+                        return
+                    yield line
+                    yielded += 1
+
+def iter_shard_records(manifest_path, rank=None, world_size=None, worker_id=None, num_workers=None,
+                       seed=None, epoch=0, buffer_size=SHUFFLE_BUFFER):
+    """
+    Yield the parsed records of the shards assigned to this rank and worker,
+    padded to consumer_records() by repeating them from the start. A
+    consumer without records repeats a non-empty shard chosen by its index,
+    so it still yields the same number of records. With a `seed`, the
+    consumer's shards are read in an order permuted per (seed, epoch) and
+    records are shuffled through a buffer of `buffer_size` lines; shards
+    are filled source by source, so this is what mixes datasets in a batch.
+    """
+    manifest = load_manifest(manifest_path)
+    shards = manifest['shards']
+    consumer, num_consumers = get_consumer(rank, world_size, worker_id, num_workers)
+    target = consumer_records(shards, num_consumers)
+    if target == 0:
+        return
+    if len(shards) < num_consumers:
+        print(f"Warning: {len(shards)} shards for {num_consumers} consumers, records will be repeated")
+    filled = [idx for idx, shard in enumerate(shards) if shard['records']]
+    owned = [idx for idx in assign_shards(shards, consumer, num_consumers) if shards[idx]['records']]
+    owned = owned or [filled[consumer % len(filled)]]
+    rng = random.Random(f"{seed}:{epoch}:{consumer}") if seed is not None else None
+    lines = iter_shard_lines(manifest['root'], shards, owned, target, rng)
+    if rng is not None and buffer_size > 1:
+        lines = shuffle_buffer(lines, buffer_size, rng)
+    for line in lines:
+        yield json.loads(line)
+
+try:
+    from torch.utils.data import IterableDataset
+
+    class ShardedJsonlDataset(IterableDataset):
+        """
+        IterableDataset over a sharded merge output; each rank x worker reads
+        disjoint shards, padded to the same record count (see
+        consumer_records). `num_workers` must match the DataLoader's.
+        Records are shuffled per epoch unless `seed` is None; call
+        set_epoch() before each epoch, as with DistributedSampler (workers
+        only see the new epoch when they are restarted, i.e. without
+        persistent_workers).
+        """
+        def __init__(self, manifest_path, num_workers=0, seed=0, buffer_size=SHUFFLE_BUFFER):
+            self.manifest_path = manifest_path
+            self.manifest = load_manifest(manifest_path)
+            self.num_workers = max(1, num_workers)
+            self.seed = seed
+            self.buffer_size = buffer_size
+            self.epoch = 0
+
+        def set_epoch(self, epoch):
+            self.epoch = epoch
+
+        def __len__(self):
+            """Records of this rank: the padded per-consumer count times its workers"""
+            _, num_consumers = get_consumer(worker_id=0, num_workers=self.num_workers)
+            return consumer_records(self.manifest['shards'], num_consumers) * self.num_workers
+
+        def __iter__(self):
+            from torch.utils.data import get_worker_info
+            info = get_worker_info()
+            if (info.num_workers if info is not None else 1) != self.num_workers:
+                raise ValueError(f"ShardedJsonlDataset was built for {self.num_workers} workers, "
+                                 f"the DataLoader uses {info.num_workers if info is not None else 0}")
+            return iter_shard_records(self.manifest_path, seed=self.seed, epoch=self.epoch, buffer_size=self.buffer_size)
+except ImportError:
+    pass
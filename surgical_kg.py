@@ -0,0 +1,512 @@
+import argparse
+import re
+from collections import defaultdict
+from functools import lru_cache
+from itertools import product
+
+import numpy as np
+
+PHASE = 'TestlapPhase'
+INSTRUMENT = 'TestlapInstrument'
+ACTION = 'TestlapAction'
+ANATOMY = 'TestlapAnatomy'
+USES_INSTRUMENT = 'TESTLAP_USES_INSTRUMENT'
+PHASE_SEQUENCE = 'TESTLAP_PHASE_SEQUENCE'
+SYNONYM_OF = 'TESTLAP_SYNONYM_OF'
+BELONGS_TO = 'TESTLAP_BELONGS_TO'
+
+TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    | (?P<number>-?\d+(?:\.\d+)?)
+    | (?P<arrow><-|->)
+    | (?P<op><>|<=|>=|[=<>])
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<punct>[(){}\[\]:,.\-])
+    )""", re.VERBOSE)
+NODE_CREATE = re.compile(r"(?is)^CREATE\s+\(")
+CONSTRAINT = re.compile(r"(?is)^CREATE\s+CONSTRAINT\s+(\w+)\s+(?:IF\s+NOT\s+EXISTS\s+)?ON\s+\((\w+):(\w+)\)\s+ASSERT\s+\2\.(\w+)\s+IS\s+UNIQUE$")
+
+def split_statements(text):
+    """Split a Cypher script into statements on ';', ignoring '//' comments and quoted text"""
+    statements = []
+    current = []
+    quote = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            current.append(ch)
+            if ch == '\\' and i + 1 < len(text):
+                current.append(text[i + 1])
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+            current.append(ch)
+        elif text.startswith('//', i):
+            i = text.find('\n', i)
+            if i == -1:
+                break
+            continue
+        elif ch == ';':
+            statements.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    if ''.join(current).strip():
+        statements.append(''.join(current).strip())
+    return [s for s in statements if s]
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Unexpected Cypher syntax at: {text[pos:pos + 40]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = bytes(value[1:-1], 'utf-8').decode('unicode_escape') if '\\' in value else value[1:-1]
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+class Parser:
+    """Recursive descent over the Cypher subset used by testlap_data.cypher"""
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        idx = self.pos + offset
+        return self.tokens[idx] if idx < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, token = self.next()
+        if token != value and not (kind == 'name' and isinstance(value, str) and token.upper() == value.upper()):
+            raise ValueError(f"Expected {value!r}, got {token!r}")
+        return token
+
+    def accept_keyword(self, keyword):
+        kind, value = self.peek()
+        if kind == 'name' and value.upper() == keyword:
+            self.pos += 1
+            return True
+        return False
+
+    def at_end(self):
+        return self.pos >= len(self.tokens)
+
+    def literal(self):
+        kind, value = self.next()
+        if kind in ('string', 'number'):
+            return value
+        if value == '[':
+            items = []
+            while self.peek()[1] != ']':
+                items.append(self.literal())
+                if self.peek()[1] == ',':
+                    self.next()
+            self.next()
+            return items
+        if value == '{':
+            return self.properties(opened=True)
+        if kind == 'name' and value.lower() in ('true', 'false', 'null'):
+            return {'true': True, 'false': False, 'null': None}[value.lower()]
+        raise ValueError(f"Unsupported literal {value!r}")
+
+    def properties(self, opened=False):
+        if not opened:
+            self.expect('{')
+        props = {}
+        while self.peek()[1] != '}':
+            _, key = self.next()
+            self.expect(':')
+            props[key] = self.literal()
+            if self.peek()[1] == ',':
+                self.next()
+        self.next()
+        return props
+
+    def node_pattern(self):
+        """(var:Label {props}) -> (var, label, props); every part is optional"""
+        self.expect('(')
+        var = label = None
+        props = {}
+        if self.peek()[0] == 'name':
+            _, var = self.next()
+        if self.peek()[1] == ':':
+            self.next()
+            _, label = self.next()
+        if self.peek()[1] == '{':
+            props = self.properties()
+        self.expect(')')
+        return var, label, props
+
+    def relationship_pattern(self):
+        """(a)-[:TYPE {props}]->(b) or (a)<-[:TYPE]-(b) -> (source var, type, props, target var)"""
+        left = self.node_pattern()[0]
+        incoming = self.peek()[1] == '<-'
+        self.next()
+        self.expect('[')
+        if self.peek()[0] == 'name':
+            self.next()
+        self.expect(':')
+        _, rel_type = self.next()
+        props = self.properties() if self.peek()[1] == '{' else {}
+        self.expect(']')
+        self.next()  # '-' or '->'
+        right = self.node_pattern()[0]
+        return (right, rel_type, props, left) if incoming else (left, rel_type, props, right)
+
+    def comma_separated(self, item):
+        items = [item()]
+        while self.peek()[1] == ',':
+            self.next()
+            items.append(item())
+        return items
+
+    def operand(self):
+        """var.prop, or a literal"""
+        kind, value = self.peek()
+        if kind == 'name' and self.peek(1)[1] == '.':
+            self.pos += 2
+            _, prop = self.next()
+            return ('prop', value, prop)
+        return ('value', self.literal())
+
+    def condition(self):
+        left = self.operand()
+        kind, op = self.next()
+        if kind == 'name' and op.upper() == 'IN':
+            op = 'IN'
+        elif kind != 'op':
+            raise ValueError(f"Unsupported WHERE operator {op!r}")
+        return left, op, self.operand()
+
+    def where(self):
+        conditions = [self.condition()]
+        while self.accept_keyword('AND'):
+            conditions.append(self.condition())
+        return conditions
+
+def resolve(operand, binding):
+    if operand[0] == 'value':
+        return operand[1]
+    _, var, prop = operand
+    return binding[var][1].get(prop)
+
+def check(conditions, binding):
+    for left, op, right in conditions:
+        a, b = resolve(left, binding), resolve(right, binding)
+        if op == 'IN':
+            ok = b is not None and a in b
+        elif op == '=':
+            ok = a == b
+        elif op == '<>':
+            ok = a != b
+        elif a is None or b is None:
+            ok = False
+        else:
+            ok = {'<': a < b, '>': a > b, '<=': a <= b, '>=': a >= b}[op]
+        if not ok:
+            return False
+    return True
+
+def name_key(name):
+    return ' '.join(str(name).lower().split())
+
+class SurgicalKG:
+    """
+    In-process surgical knowledge graph. Nodes are rows of per-label
+    property dicts with hash indexes on `id` and `name`; relationships are
+    stored per type as CSR adjacency arrays in both directions. Phase x
+    instrument membership is precomputed as integer bitmasks, so phase and
+    instrument queries are a handful of integer operations.
+    """
+    def __init__(self):
+        self.nodes = []            # [(label, props)]
+        self.labels = defaultdict(list)
+        self.constraints = set()   # (label, prop) that must be unique
+        self.index = defaultdict(dict)  # (label, 'id'|'name') -> {key: node}
+        self.edges = defaultdict(list)  # type -> [(source, target, props)]
+        self.edge_keys = {}        # (type, source, target) -> position in edges[type]
+        self.adjacency = {}
+        self.phase_masks = {}
+        self._mask_cache = {}
+
+    @classmethod
+    def from_cypher(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_cypher_text(f.read())
+
+    @classmethod
+    def from_cypher_text(cls, text):
+        graph = cls()
+        for statement in split_statements(text):
+            graph.execute(statement)
+        graph.build()
+        return graph
+
+    def execute(self, statement):
+        """Apply one statement: CREATE CONSTRAINT, CREATE (nodes), or MATCH [WHERE] CREATE (relationships)"""
+        match = CONSTRAINT.match(statement)
+        if match:
+            self.constraints.add((match.group(3), match.group(4)))
+            return
+        parser = Parser(statement)
+        if parser.accept_keyword('MATCH'):
+            patterns = parser.comma_separated(parser.node_pattern)
+            conditions = parser.where() if parser.accept_keyword('WHERE') else []
+            parser.expect('CREATE')
+            relationships = parser.comma_separated(parser.relationship_pattern)
+            self.create_relationships(patterns, conditions, relationships)
+        elif NODE_CREATE.match(statement):
+            parser.expect('CREATE')
+            for _, label, props in parser.comma_separated(parser.node_pattern):
+                self.add_node(label, props)
+        else:
+            raise ValueError(f"Unsupported Cypher statement: {statement[:60]!r}")
+        if not parser.at_end():
+            raise ValueError(f"Unparsed Cypher after: {statement[:60]!r}")
+
+    def add_node(self, label, props):
+        node = len(self.nodes)
+        for key in ('id', 'name'):
+            if key in props:
+                value = name_key(props[key]) if key == 'name' else props[key]
+                if (label, key) in self.constraints and value in self.index[(label, key)]:
+                    raise ValueError(f"Duplicate {label}.{key} = {props[key]!r}")
+                self.index[(label, key)].setdefault(value, node)
+        self.nodes.append((label, props))
+        self.labels[label].append(node)
+        return node
+
+    def candidates(self, label, props):
+        """Nodes matching a label and inline properties, using the id/name index when possible"""
+        if 'id' in props:
+            node = self.index[(label, 'id')].get(props['id'])
+            pool = [] if node is None else [node]
+        elif 'name' in props:
+            node = self.index[(label, 'name')].get(name_key(props['name']))
+            pool = [] if node is None else [node]
+        else:
+            pool = self.labels[label]
+        return [n for n in pool if all(self.nodes[n][1].get(k) == v for k, v in props.items())]
+
+    def create_relationships(self, patterns, conditions, relationships):
+        variables = [var for var, _, _ in patterns]
+        pools = [self.candidates(label, props) for _, label, props in patterns]
+        for combination in product(*pools):
+            binding = {var: self.nodes[node] for var, node in zip(variables, combination)}
+            if not check(conditions, binding):
+                continue
+            node_of = dict(zip(variables, combination))
+            for source, rel_type, props, target in relationships:
+                self.add_edge(rel_type, node_of[source], node_of[target], props)
+
+    def add_edge(self, rel_type, source, target, props):
+        self.edge_keys.setdefault((rel_type, source, target), len(self.edges[rel_type]))
+        self.edges[rel_type].append((source, target, props))
+
+    def merge_node(self, label, props, key='id'):
+        """Upsert a node keyed on a unique property: update an existing node's properties, else create it"""
+        value = name_key(props[key]) if key == 'name' else props[key]
+        node = self.index[(label, key)].get(value)
+        if node is None:
+            return self.add_node(label, dict(props))
+        self.nodes[node][1].update(props)
+        if 'name' in props:
+            self.index[(label, 'name')].setdefault(name_key(props['name']), node)
+        return node
+
+    def merge_edge(self, rel_type, source, target, props=None):
+        """Create a relationship unless one of the same type already links source to target"""
+        position = self.edge_keys.get((rel_type, source, target))
+        if position is None:
+            self.add_edge(rel_type, source, target, dict(props or {}))
+        elif props:
+            self.edges[rel_type][position][2].update(props)
+
+    def build(self):
+        """Build CSR adjacency per relationship type and the phase instrument bitmasks"""
+        num_nodes = len(self.nodes)
+        for rel_type, edges in self.edges.items():
+            sources = np.array([s for s, _, _ in edges], dtype=np.int32)
+            targets = np.array([t for _, t, _ in edges], dtype=np.int32)
+            self.adjacency[rel_type] = {
+                'out': self._csr(sources, targets, num_nodes),
+                'in': self._csr(targets, sources, num_nodes)
+            }
+        # Bit i of a phase mask is set if the instrument with node index instruments[i] is used
+        self.instrument_bits = {node: 1 << i for i, node in enumerate(self.labels[INSTRUMENT])}
+        self.phase_masks = {}
+        for phase in self.labels[PHASE]:
+            mask = 0
+            for node in self.neighbors(phase, USES_INSTRUMENT):
+                mask |= self.instrument_bits.get(node, 0)
+            self.phase_masks[phase] = mask
+        self._phase_items = list(self.phase_masks.items())
+        self._mask_cache = {}
+
+    @staticmethod
+    def _csr(rows, cols, num_nodes):
+        order = np.argsort(rows, kind='stable')
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+        return indptr, cols[order], order
+
+    # Lookups
+
+    def node(self, label, key):
+        """Node index of a node given by id (int) or name (case-insensitive); KeyError if unknown"""
+        if isinstance(key, (int, np.integer)) and not isinstance(key, bool):
+            node = self.index[(label, 'id')].get(int(key))
+        else:
+            node = self.index[(label, 'name')].get(name_key(key))
+        if node is None:
+            raise KeyError(f"No {label} {key!r}")
+        return node
+
+    def props(self, node):
+        return self.nodes[node][1]
+
+    def name(self, node):
+        return self.nodes[node][1].get('name')
+
+    def neighbors(self, node, rel_type, direction='out'):
+        """Node indices connected to `node` by `rel_type` edges, in creation order"""
+        adjacency = self.adjacency.get(rel_type)
+        if adjacency is None:
+            return []
+        indptr, indices, _ = adjacency[direction]
+        return indices[indptr[node]:indptr[node + 1]].tolist()
+
+    def edge_props(self, node, rel_type, direction='out'):
+        """[(neighbor, relationship props)] of `node`"""
+        adjacency = self.adjacency.get(rel_type)
+        if adjacency is None:
+            return []
+        indptr, indices, order = adjacency[direction]
+        edges = self.edges[rel_type]
+        return [(int(indices[i]), edges[order[i]][2]) for i in range(indptr[node], indptr[node + 1])]
+
+    # Instrument / phase queries
+
+    def instrument_mask(self, instruments):
+        """Bitmask of a set of instruments given by ids or names"""
+        key = frozenset(instruments)
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            mask = 0
+            for instrument in key:
+                mask |= self.instrument_bits[self.node(INSTRUMENT, instrument)]
+            self._mask_cache[key] = mask
+        return mask
+
+    def instruments_of_mask(self, mask):
+        return [self.name(node) for node, bit in self.instrument_bits.items() if mask & bit]
+
+    def instruments_in_phase(self, phase):
+        """Names of the instruments used in a phase"""
+        return self.instruments_of_mask(self.phase_masks[self.node(PHASE, phase)])
+
+    def is_valid_instrument(self, phase, instrument):
+        return bool(self.phase_masks[self.node(PHASE, phase)] & self.instrument_bits[self.node(INSTRUMENT, instrument)])
+
+    def phases_with_instruments(self, instruments):
+        """Phases whose instruments include every instrument of the set"""
+        mask = self.instrument_mask(instruments)
+        return [self.name(phase) for phase, phase_mask in self._phase_items if phase_mask & mask == mask]
+
+    def phases_within_instruments(self, instruments):
+        """Phases that use only instruments from the set"""
+        mask = self.instrument_mask(instruments)
+        return [self.name(phase) for phase, phase_mask in self._phase_items if phase_mask and phase_mask & ~mask == 0]
+
+    def combo_instruments(self, instrument):
+        """Names of the instruments listed in an instrument's combo_instruments"""
+        ids = self.props(self.node(INSTRUMENT, instrument)).get('combo_instruments', [])
+        return [self.name(self.node(INSTRUMENT, i)) for i in ids if i in self.index[(INSTRUMENT, 'id')]]
+
+    def synonyms(self, instrument):
+        """Instruments related by TESTLAP_SYNONYM_OF in either direction"""
+        node = self.node(INSTRUMENT, instrument)
+        return [self.name(n) for n in self.neighbors(node, SYNONYM_OF) + self.neighbors(node, SYNONYM_OF, 'in')]
+
+    def _phase_step(self, phase, step_type):
+        node = self.node(PHASE, phase)
+        for neighbor, props in self.edge_props(node, PHASE_SEQUENCE):
+            if props.get('type') == step_type:
+                return self.name(neighbor)
+        return None
+
+    def next_phase(self, phase):
+        return self._phase_step(phase, 'NEXT_PHASE')
+
+    def previous_phase(self, phase):
+        return self._phase_step(phase, 'PREVIOUS_PHASE')
+
+    def phase_order(self):
+        """Phase names along the NEXT_PHASE chain from the phase without a predecessor"""
+        phases = [self.name(p) for p in self.labels[PHASE]]
+        starts = [p for p in phases if self.previous_phase(p) is None] or phases[:1]
+        order = []
+        current = starts[0] if starts else None
+        while current is not None and current not in order:
+            order.append(current)
+            current = self.next_phase(current)
+        return order
+
+    def actions_in_phase(self, phase):
+        return [self.name(n) for n in self.neighbors(self.node(PHASE, phase), BELONGS_TO, 'in')]
+
+    def summary(self):
+        counts = {label: len(nodes) for label, nodes in self.labels.items()}
+        edges = {rel_type: len(edges) for rel_type, edges in self.edges.items()}
+        return counts, edges
+
+@lru_cache(maxsize=None)
+def load_default_graph(path='testlap_data.cypher'):
+    """Parse a Cypher file once per process"""
+    return SurgicalKG.from_cypher(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load the surgical knowledge graph from Cypher and query it')
+    parser.add_argument('--cypher', default='testlap_data.cypher', help='Cypher script (default: testlap_data.cypher)')
+    parser.add_argument('--phase', default=None, help='Show instruments, actions and neighbours of this phase (id or name)')
+    parser.add_argument('--instruments', nargs='*', default=None, help='Show phases compatible with these instruments (ids or names)')
+    args = parser.parse_args()
+
+    graph = SurgicalKG.from_cypher(args.cypher)
+    counts, edges = graph.summary()
+    print("Nodes: " + ", ".join(f"{label} {count}" for label, count in counts.items()))
+    print("Relationships: " + ", ".join(f"{rel_type} {count}" for rel_type, count in edges.items()))
+    print("Phase order: " + " -> ".join(graph.phase_order()))
+
+    if args.phase:
+        phase = int(args.phase) if args.phase.isdigit() else args.phase
+        print(f"\nPhase: {graph.name(graph.node(PHASE, phase))}")
+        print(f"Instruments: {', '.join(graph.instruments_in_phase(phase))}")
+        print(f"Actions: {', '.join(graph.actions_in_phase(phase)) or '-'}")
+        print(f"Previous: {graph.previous_phase(phase) or '-'}, next: {graph.next_phase(phase) or '-'}")
+    if args.instruments:
+        instruments = [int(i) if i.isdigit() else i for i in args.instruments]
+        print(f"\nInstruments: {', '.join(graph.name(graph.node(INSTRUMENT, i)) for i in instruments)}")
+        print(f"Phases using all of them: {', '.join(graph.phases_with_instruments(instruments)) or '-'}")
+        print(f"Phases using only them: {', '.join(graph.phases_within_instruments(instruments)) or '-'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# Tools are run as scripts from their own directories, so each is an import root
+for path in (ROOT, ROOT / 'eval', ROOT / 'data_preprocess', ROOT / 'data_preprocess' / 'Cholec80',
+             ROOT / 'data_preprocess' / 'Cholect50' / 'datasets'):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,81 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from build_image_cache import (INDEX_FILE, PNG_SIGNATURE, ImageCache, cache_key, iter_unique_images, output_format,
+                               rewrite_jsonl, rewrite_paths)
+
+def write_image(path, height=90, width=130, value=0):
+    image = np.full((height, width, 3), value, dtype=np.uint8)
+    image[::7] = 255
+    cv2.imwrite(str(path), image)
+    return str(path)
+
+def test_cache_key_and_output_format():
+    assert cache_key(b'abc', 56, 84, 95) == cache_key(b'abc', 56, 84, 95)
+    assert cache_key(b'abc', 56, 84, 95) != cache_key(b'abd', 56, 84, 95)
+    assert cache_key(b'abc', 56, 84, 95) != cache_key(b'abc', 84, 56, 95)
+    assert cache_key(b'abc', 56, 84, 95) != cache_key(b'abc', 56, 84, 90)
+    assert output_format(PNG_SIGNATURE + b'rest') == '.png'
+    assert output_format(b'\xff\xd8\xff\xe0') == '.jpg'
+
+def test_build_resizes_and_looks_up(tmp_path):
+    jpg = write_image(tmp_path / 'a.jpg')
+    png = write_image(tmp_path / 'b.png', value=40)
+    copy = tmp_path / 'c.jpg'
+    copy.write_bytes((tmp_path / 'a.jpg').read_bytes())
+    cache = ImageCache(tmp_path / 'cache')
+
+    cached, failed = cache.build([jpg, png, str(copy), str(tmp_path / 'missing.jpg')], workers=2)
+    assert cached == 3 and failed == [str(tmp_path / 'missing.jpg')]
+    assert cache.lookup(png).endswith('.png') and cache.lookup(jpg).endswith('.jpg')
+    # Identical content is stored once
+    assert cache.lookup(jpg) == cache.lookup(str(copy))
+    image = cv2.imread(cache.lookup(jpg))
+    name, _, _, width, height = cache.entries[jpg]
+    assert image.shape[:2] == (height, width)
+    assert height % 28 == 0 and width % 28 == 0
+
+    # The index survives a reload; a changed source is no longer served
+    cache.save()
+    reloaded = ImageCache(tmp_path / 'cache')
+    assert reloaded.lookup(jpg) == cache.lookup(jpg)
+    write_image(tmp_path / 'a.jpg', height=60)
+    stat = os.stat(jpg)
+    os.utime(jpg, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert reloaded.lookup(jpg) is None
+    assert reloaded.build([jpg, png], workers=2) == (1, [])
+    assert reloaded.entries[jpg][0] != name
+
+def test_other_settings_start_an_empty_index(tmp_path):
+    path = write_image(tmp_path / 'a.jpg')
+    cache = ImageCache(tmp_path / 'cache')
+    cache.build([path], workers=1)
+    cache.save()
+    assert json.loads((tmp_path / 'cache' / INDEX_FILE).read_text())['entries']
+    assert ImageCache(tmp_path / 'cache', quality=80).lookup(path) is None
+
+def test_rewrite_paths_of_every_record_shape():
+    mapping = {'a.jpg': '/cache/a.jpg', 'b.jpg': '/cache/b.jpg'}
+    listed = {'images': ['a.jpg', {'path': 'b.jpg'}, 'other.jpg']}
+    assert rewrite_paths(listed, mapping) == 2
+    assert listed['images'] == ['/cache/a.jpg', {'path': '/cache/b.jpg'}, 'other.jpg']
+    single = {'images': 'a.jpg'}
+    assert rewrite_paths(single, mapping) == 1 and single['images'] == '/cache/a.jpg'
+    legacy = {'image_path': 'b.jpg'}
+    assert rewrite_paths(legacy, mapping) == 1 and legacy['image_path'] == '/cache/b.jpg'
+    assert rewrite_paths({'image_path': 'other.jpg'}, mapping) == 0
+
+def test_rewrite_jsonl(tmp_path):
+    records = [{'images': ['a.jpg'], 'messages': []}, {'images': ['a.jpg', 'b.jpg']}, {'image_path': ''}]
+    input_file = tmp_path / 'train.jsonl'
+    input_file.write_text(''.join(json.dumps(record) + '\n' for record in records) + '\n')
+    assert list(iter_unique_images([input_file])) == ['a.jpg', 'b.jpg']
+
+    output_file = tmp_path / 'out.jsonl'
+    assert rewrite_jsonl(input_file, output_file, {'a.jpg': '/cache/a.jpg'}) == (3, 2)
+    rewritten = [json.loads(line) for line in output_file.read_text().splitlines()]
+    assert rewritten[1]['images'] == ['/cache/a.jpg', 'b.jpg']
+    assert rewritten[0]['messages'] == []
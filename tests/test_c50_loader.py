@@ -0,0 +1,24 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transforms = pytest.importorskip("torchvision.transforms")
+from ori_c50_loader import BatchTransform, decode_pool
+
+def test_augmentations_are_drawn_per_image():
+    torch.manual_seed(0)
+    images = torch.zeros((64, 3, 4, 6), dtype=torch.uint8)
+    images[:, :, :, 0] = 255  # left column marks the orientation
+    output = BatchTransform(transforms.RandomHorizontalFlip(0.5))(images)
+    flipped = output[:, 0, 0, -1] == 1.0
+    assert output.dtype == torch.float32 and output.shape == images.shape
+    assert flipped.any() and not flipped.all()
+
+def test_normalization_without_augmentation():
+    images = torch.full((2, 3, 4, 6), 255, dtype=torch.uint8)
+    output = BatchTransform(None, transforms.Normalize(mean=[0.5] * 3, std=[0.5] * 3))(images)
+    assert torch.allclose(output, torch.ones_like(output))
+
+def test_decode_pool_per_thread_count():
+    assert decode_pool(2) is decode_pool(2)
+    assert decode_pool(2) is not decode_pool(3)
+    assert decode_pool(3)._max_workers == 3
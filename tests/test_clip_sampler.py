@@ -0,0 +1,24 @@
+import numpy as np
+
+from clip_sampler import FrameIndex
+
+def make_index():
+    # Two videos with unevenly sampled frames
+    return FrameIndex(['v1', 'v2'], [0, 4, 7], [0, 25, 50, 100, 3, 6, 9],
+                      [f'v1/{i}.jpg' for i in (0, 25, 50, 100)] + [f'v2/{i}.jpg' for i in (3, 6, 9)])
+
+def test_windows_clamp_at_video_edges():
+    index = make_index()
+    windows = index.windows([0, 3, 4, 6], k=3)
+    assert windows.tolist() == [[0, 0, 1], [2, 3, 3], [4, 4, 5], [5, 6, 6]]
+
+def test_windows_align_end_and_stride():
+    index = make_index()
+    assert index.windows([5], k=3, align='end').tolist() == [[4, 4, 5]]
+    assert index.windows([2], k=3, stride=2).tolist() == [[0, 2, 3]]
+    assert index.windows([1], k=4).tolist() == [[0, 0, 1, 2]]
+
+def test_locate():
+    index = make_index()
+    assert index.locate(['v1/50.jpg', 'v2/3.jpg', 'v2/4.jpg', 'v3/1.jpg', '']).tolist() == [2, 4, -1, -1, -1]
+    assert np.array_equal(index.windows(index.locate(['v2/9.jpg']), k=2, align='end'), [[5, 6]])
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from compute_token_lengths import ApproxTokenizer, bucket_name, compute_token_lengths
+
+@pytest.mark.parametrize("length, name", [
+    (0, 'len_00000-00256'),
+    (1, 'len_00000-00256'),
+    (256, 'len_00000-00256'),
+    (257, 'len_00257-00512'),
+    (4000, 'len_03841-04000'),
+    (4001, 'len_04001+'),
+])
+def test_bucket_name(length, name):
+    assert bucket_name(length, 256, 4000) == name
+
+def test_missing_images_are_reported_separately(tmp_path):
+    input_file = tmp_path / 'train.jsonl'
+    dims_table = tmp_path / 'dims.jsonl'
+    dims_table.write_text(json.dumps({'path': 'frame.jpg', 'width': 280, 'height': 280}) + '\n')
+    records = [
+        {'messages': [{'role': 'user', 'content': '<image>question'}], 'images': ['frame.jpg']},
+        {'messages': [{'role': 'user', 'content': '<image>question'}], 'images': [str(tmp_path / 'missing.jpg')]},
+    ]
+    input_file.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    report = compute_token_lengths(input_file, tmp_path / 'out', ApproxTokenizer(), max_length=512, bucket_size=256,
+                                   dims_table=dims_table)
+    assert report['records_with_missing_images'] == 1
+    assert report['missing_images'] == 1
+    assert report['buckets'] == {'len_00000-00256': 1}
+    assert report['packs'] == 1
+    assert len((tmp_path / 'out' / 'missing_images.jsonl').read_text().splitlines()) == 1
+    assert json.loads((tmp_path / 'out' / 'packs.json').read_text()) == {'len_00000-00256.jsonl': [[0]]}
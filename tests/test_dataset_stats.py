@@ -0,0 +1,59 @@
+from dataset_stats import DatasetStats, diff_stats, get_task
+
+def record(video, answer, frame=0):
+    return {'images': [f'frames/{video}/{frame:06d}.jpg'],
+            'messages': [{'role': 'user', 'content': 'Which phase is shown?'},
+                         {'role': 'assistant', 'content': answer}]}
+
+def build(records, split='train', dataset='Cholec80', file_name='train_mcq_phase.jsonl'):
+    stats = DatasetStats()
+    for item in records:
+        stats.update(item, split, dataset, file_name)
+    stats.add_original(f'{dataset}/{file_name}', len(records) * 2)
+    return stats
+
+def test_get_task():
+    assert get_task('train_mcq_phase.jsonl') == 'mcq_phase'
+    assert get_task('phase.jsonl') == 'phase'
+
+def test_update_counts_rows_answers_and_letters():
+    stats = build([record('VID01', 'A. Preparation'), record('VID01', 'A. Preparation', 1),
+                   record('VID02', 'B. ClippingCutting')])
+    assert stats.marginal('video') == {('VID01',): 2, ('VID02',): 1}
+    assert stats.marginal('phase') == {('Preparation',): 2, ('ClippingCutting',): 1}
+    assert stats.answers[('train', 'Cholec80', 'mcq_phase', 'Preparation')] == 2
+    assert stats.letters[('train', 'Cholec80', 'mcq_phase', 'B')] == 1
+    assert stats.sources['Cholec80/train_mcq_phase.jsonl'] == {'original': 6, 'kept': 3}
+
+def test_merge_equals_a_single_pass():
+    first = [record('VID01', 'A. Preparation'), record('VID02', 'B. ClippingCutting')]
+    second = [record('VID03', 'A. Preparation'), record('VID01', 'C. GallbladderDissection', 5)]
+    merged = build(first).merge(build(second))
+    single = build(first + second)
+    assert merged.to_dict() == single.to_dict()
+
+def test_save_load_round_trip(tmp_path):
+    stats = build([record('VID01', 'A. Preparation'), record('VID02', 'The phase is ClippingCutting')])
+    stats.merge(build([record('VID05', 'A. Preparation')], split='test', file_name='test_mcq_phase.jsonl'))
+    path = tmp_path / 'stats.json'
+    stats.save(path)
+    loaded = DatasetStats.load(path)
+    assert loaded.to_dict() == stats.to_dict()
+    assert loaded.marginal('split', 'video') == stats.marginal('split', 'video')
+
+def test_diff_stats_reports_share_changes_above_threshold():
+    old = build([record('VID01', 'A. Preparation')] * 5 + [record('VID02', 'B. ClippingCutting')] * 5)
+    # Preparation goes from 50% to 60% of the split; the test split only changes in size
+    new = build([record('VID01', 'A. Preparation')] * 6 + [record('VID02', 'B. ClippingCutting')] * 4)
+    old.merge(build([record('VID09', 'A. Preparation')] * 2, split='test'))
+    new.merge(build([record('VID09', 'A. Preparation')] * 7, split='test'))
+
+    changes = diff_stats(old, new, columns=('split', 'phase'), threshold=0.05)
+    assert [(key, old_count, new_count) for key, old_count, new_count, _, _ in changes] == [
+        (('train', 'ClippingCutting'), 5, 4),
+        (('train', 'Preparation'), 5, 6),
+    ]
+    assert diff_stats(old, new, columns=('split', 'phase'), threshold=0.15) == []
+    # A class that disappears moves from its share to zero
+    gone = diff_stats(old, build([record('VID01', 'A. Preparation')]), columns=('split', 'phase'))
+    assert (('train', 'ClippingCutting'), 5, 0, 0.5, 0.0) in gone
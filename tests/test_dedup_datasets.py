@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+
+from dedup_datasets import Deduplicator, HashSet
+
+def test_hash_set_flushes_into_a_sorted_array():
+    values = [int(v) for v in np.random.default_rng(0).integers(0, 2 ** 63, 5000, dtype=np.uint64)]
+    hashes = HashSet(buffer_size=100)
+    for value in values + values[:500]:
+        hashes.add(value)
+    assert len(hashes.pending) < 100
+    assert len(hashes) == len(set(values))
+    assert np.all(hashes.sorted[1:] > hashes.sorted[:-1])
+    assert all(value in hashes for value in values[::50])
+    assert 12345 not in hashes
+
+def record(image, answer='Preparation'):
+    return {'images': [image], 'messages': [{'role': 'user', 'content': '<image>Which phase?'},
+                                            {'role': 'assistant', 'content': answer}]}
+
+def test_exact_duplicates_are_removed_per_source():
+    deduper = Deduplicator()
+    assert deduper.keep(record('v1/1.jpg'), 'a')
+    assert not deduper.keep(record('v1/1.jpg'), 'b')
+    assert deduper.keep(record('v1/1.jpg', 'ClippingCutting'), 'b')
+    assert deduper.report() == {'b': {'exact': 1}}
+
+def test_near_duplicate_frames(tmp_path):
+    image = np.tile(np.arange(64, dtype=np.uint8) * 4, (48, 1))
+    for name in ('1.png', '2.png'):
+        cv2.imwrite(str(tmp_path / name), cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))
+    deduper = Deduplicator(use_phash=True)
+    assert deduper.keep(record(str(tmp_path / '1.png')), 'a')
+    assert not deduper.keep(record(str(tmp_path / '2.png')), 'a')
+    assert deduper.report() == {'a': {'near': 1}}
+    assert deduper.get_phash.cache_info().currsize == 2
@@ -0,0 +1,70 @@
+import random
+from collections import Counter
+
+import numpy as np
+
+from distractors import (KG_FILE, DistractorSampler, cholec80_weights, kg_phase_weights, order_similarity,
+                         transition_similarity, triplet_weights)
+from surgical_kg import load_default_graph
+
+OPTIONS = ['A', 'B', 'C', 'D', 'E']
+
+def test_samples_are_distinct_and_exclude_the_answer():
+    sampler = DistractorSampler(OPTIONS)
+    rng = random.Random(0)
+    for _ in range(200):
+        distractors = sampler.sample('C', 3, rng)
+        assert len(distractors) == len(set(distractors)) == 3
+        assert 'C' not in distractors
+    assert sorted(sampler.sample('C', 10, rng)) == ['A', 'B', 'D', 'E']
+    # An answer outside the option list still gets k distinct options
+    assert len(set(sampler.sample('Z', 3, rng))) == 3
+
+def test_rows_mix_hard_weights_with_uniform_mass():
+    weights = np.zeros((5, 5))
+    weights[0, 1] = 1.0
+    sampler = DistractorSampler(OPTIONS, weights, uniform=0.2)
+    assert np.allclose(sampler.probabilities.sum(axis=1), 1.0)
+    assert np.allclose(np.diag(sampler.probabilities), 0.0)
+    assert np.isclose(sampler.probabilities[0, 1], 0.8 + 0.2 / 4)
+    assert np.isclose(sampler.probabilities[0, 2], 0.2 / 4)
+    # A row without statistics is uniform
+    assert np.allclose(sampler.probabilities[3], [0.25, 0.25, 0.25, 0.0, 0.25])
+
+def test_hard_distractors_are_drawn_more_often():
+    weights = np.zeros((5, 5))
+    weights[0, 1] = 1.0
+    sampler = DistractorSampler(OPTIONS, weights, uniform=0.2)
+    rng = random.Random(1)
+    first = Counter(sampler.sample('A', 1, rng)[0] for _ in range(4000))
+    assert first['B'] / 4000 > 0.8
+    assert first.keys() == {'B', 'C', 'D', 'E'}
+
+def test_order_and_transition_similarity():
+    similarity = order_similarity(['P1', 'P2', 'P3', 'X'], ['P1', 'P2', 'P3'], decay=0.5)
+    assert similarity[0, 1] == 1.0 and similarity[0, 2] == 0.5
+    assert not similarity[3].any() and not similarity.diagonal().any()
+
+    counts = transition_similarity([['P1', 'P1', 'P2', 'P3'], ['P1', 'P2']], ['P1', 'P2', 'P3'])
+    assert counts[0, 1] == counts[1, 0] == 2
+    assert counts[1, 2] == 1 and counts[0, 2] == 0
+
+def test_cholec80_and_triplet_weights():
+    frames = [{'id': f'01{i:04d}', 'phase': 'Preparation', 'tools': ['Grasper', 'Hook']} for i in range(3)]
+    frames += [{'id': f'01{i:04d}', 'phase': 'ClippingCutting', 'tools': ['Clipper']} for i in range(3, 5)]
+    tools = cholec80_weights(frames, 'tool', ['Grasper', 'Hook', 'Clipper'])
+    assert tools[0, 1] > 0 and tools[0, 2] == 0
+    phases = cholec80_weights(frames, 'phase', ['Preparation', 'ClippingCutting'])
+    assert phases[0, 1] == phases[1, 0] == 1
+
+    triplets = [{'triplets': ['grasper,retract,gallbladder', 'hook,retract,gallbladder', 'hook,dissect,cystic_plate']}]
+    weights = triplet_weights(triplets, 'tool', ['grasper', 'hook', 'clipper'], lambda t: t.split(','))
+    assert weights[0, 1] > 0 and not weights[2].any()
+
+def test_kg_phase_weights_prefer_neighbouring_phases():
+    kg = load_default_graph(str(KG_FILE))
+    order = kg.phase_order()
+    weights = kg_phase_weights(order, kg)
+    assert weights.shape == (len(order), len(order))
+    assert not weights.diagonal().any()
+    assert weights[0, 1] > weights[0, -1]
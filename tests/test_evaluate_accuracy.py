@@ -0,0 +1,161 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+from evaluate_accuracy import (MISSING_GROUP, OTHER_LABEL, StreamingEvaluator, build_report, evaluate_file,
+                               extract_scores, get_group_value, normalize_phase, summarize_evaluator)
+
+PHASES = ["Preparation", "CalotTriangleDissection", "ClippingCutting", "GallbladderDissection",
+          "GallbladderPackaging", "CleaningCoagulation", "GallbladderRetraction"]
+
+def baseline_metrics(pairs):
+    """The original per-record implementation: accuracy, 11-point mAP in file order and per-class P/R/F1"""
+    predictions = [{'true': normalize_phase(label), 'pred': normalize_phase(response)} for response, label in pairs]
+    classes = {p['true'] for p in predictions}
+    aps = []
+    for cls in classes:
+        tp = fp = 0
+        fn = sum(1 for p in predictions if p['true'] == cls)
+        points = []
+        for p in predictions:
+            if p['pred'] == cls:
+                tp += p['true'] == cls
+                fp += p['true'] != cls
+                points.append((tp / (tp + fp), tp / (tp + fn)))
+        interpolated = [max([precision for precision, recall in points if recall >= r], default=0.0)
+                        for r in [i / 10 for i in range(11)]]
+        aps.append(sum(interpolated) / 11)
+    class_metrics = {}
+    for cls in classes:
+        tp = sum(1 for p in predictions if p['pred'] == cls and p['true'] == cls)
+        fp = sum(1 for p in predictions if p['pred'] == cls and p['true'] != cls)
+        fn = sum(1 for p in predictions if p['pred'] != cls and p['true'] == cls)
+        precision = tp / (tp + fp) if tp + fp else 0
+        recall = tp / (tp + fn) if tp + fn else 0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0
+        class_metrics[cls] = {'precision': precision, 'recall': recall, 'f1': f1, 'support': tp + fn}
+    correct = sum(p['true'] == p['pred'] for p in predictions)
+    return correct / len(predictions), sum(aps) / len(aps), class_metrics
+
+def random_pairs(seed, records=400, free_text=0.2):
+    rng = random.Random(seed)
+    pairs = []
+    for i in range(records):
+        label = rng.choice(PHASES)
+        if rng.random() < 0.6:
+            response = f"The phase is {label}"
+        elif rng.random() < free_text:
+            response = f"some free text answer {i}"
+        else:
+            response = f"{rng.choice('ABCDE')}. {rng.choice(PHASES)}"
+        pairs.append((response, label))
+    return pairs
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_parity_with_baseline(tmp_path, seed):
+    pairs = random_pairs(seed)
+    path = tmp_path / 'predictions.jsonl'
+    path.write_text(''.join(json.dumps({'response': response, 'labels': label}) + '\n' for response, label in pairs))
+    summary = summarize_evaluator(evaluate_file(path))
+    accuracy, map_score, class_metrics = baseline_metrics(pairs)
+    assert summary['accuracy'] == accuracy
+    # Class-wise sums run in a different order than the original set iteration
+    assert summary['map'] == pytest.approx(map_score, rel=1e-12)
+    assert summary['class_metrics'].keys() == class_metrics.keys()
+    for cls, metrics in class_metrics.items():
+        for key, value in metrics.items():
+            assert summary['class_metrics'][cls][key] == pytest.approx(value, rel=1e-12)
+
+def test_free_text_predictions_share_the_other_class():
+    evaluator = StreamingEvaluator()
+    for i in range(500):
+        evaluator.update({'response': f'free text {i}', 'labels': PHASES[i % 3]})
+    evaluator.update({'response': PHASES[0], 'labels': PHASES[0]})
+    assert evaluator.labels[-1] == OTHER_LABEL
+    assert len(evaluator.labels) == 4
+    confusion = evaluator.confusion_matrix()
+    assert confusion.shape == (4, 4)
+    assert confusion.sum() == 501 and confusion[:, -1].sum() == 500
+    report = build_report(evaluator)
+    assert report['class_metrics'][normalize_phase(PHASES[0])]['tp'] == 1
+
+TOKEN_LOGPROBS = {"content": [
+    {"token": " ", "logprob": -0.01, "top_logprobs": []},
+    {"token": "A", "logprob": -0.2, "top_logprobs": [{"token": "A", "logprob": -0.2}, {"token": " B", "logprob": -1.9}]},
+]}
+
+@pytest.mark.parametrize("record, expected", [
+    ({"scores": {"a": 0.7, "b": 0.3}}, {"a": 0.7, "b": 0.3}),
+    ({"logprobs": {"a": -0.1, "b": -2}}, {"a": -0.1, "b": -2}),
+    ({"logprobs": TOKEN_LOGPROBS}, {"A": -0.2, "B": -1.9}),
+    ({"scores": {}}, None),
+    ({"scores": {"a": [0.5]}}, None),
+    ({"scores": {"a": "high"}}, None),
+    ({"scores": {"a": True}}, None),
+    ({"logprobs": {"content": [{"token": "A", "logprob": None}]}}, None),
+    ({"logprobs": {"content": "A"}}, None),
+    ({"scores": [0.1, 0.9]}, None),
+    ({}, None),
+])
+def test_extract_scores_shapes(record, expected):
+    assert extract_scores(record) == expected
+
+def mcq_record(answer, label, letter_logprobs):
+    options = ["Preparation", "CalotTriangleDissection", "ClippingCutting"]
+    prompt = "Given the cholecystectomy surgical image <image>, select the current surgical phase:\n" + \
+             "\n".join(f"{letter}. {option}" for letter, option in zip("ABC", options))
+    return {
+        "messages": [{"role": "user", "content": prompt}],
+        "response": answer,
+        "labels": label,
+        "logprobs": {"content": [{"token": answer[0], "logprob": max(letter_logprobs.values()),
+                                  "top_logprobs": [{"token": letter, "logprob": logprob}
+                                                   for letter, logprob in letter_logprobs.items()]}]},
+    }
+
+def test_unusable_scores_leave_evaluator_consistent():
+    evaluator = StreamingEvaluator()
+    evaluator.update(mcq_record("A. Preparation", "A. Preparation", {"A": -0.2, "B": -1.9}))
+    evaluator.update({"response": "B", "labels": "A", "scores": {"a": [0.1]}})
+    assert evaluator.total == len(evaluator.true_ids) == len(evaluator.pred_ids) == 2
+    assert evaluator.unscored == 1
+    assert evaluator.score_matrix() is None
+    summary = summarize_evaluator(evaluator)
+    assert summary['accuracy'] == 0.5
+
+def test_mcq_letter_logprobs_rank_option_classes():
+    evaluator = StreamingEvaluator()
+    evaluator.update(mcq_record("A. Preparation", "A. Preparation", {"A": -0.1, "B": -2.0, "C": -3.0}))
+    evaluator.update(mcq_record("B. CalotTriangleDissection", "B. CalotTriangleDissection", {"A": -2.0, "B": -0.2, "C": -2.5}))
+    evaluator.update(mcq_record("A. Preparation", "C. ClippingCutting", {"A": -0.3, "B": -3.0, "C": -1.5}))
+    assert evaluator.unscored == 0
+    assert evaluator.labels == ["preparation", "calottriangledissection", "clippingcutting"]
+    summary = summarize_evaluator(evaluator)
+    assert summary['top_k_accuracy'][1] == pytest.approx(2 / 3)
+    assert summary['top_k_accuracy'][3] == 1.0
+    assert summary['map'] == pytest.approx(1.0)
+
+def test_scores_without_the_true_label_fall_back():
+    evaluator = StreamingEvaluator()
+    evaluator.update(mcq_record("A. Preparation", "A. Preparation", {"A": -0.1, "B": -2.0}))
+    # No option list to map the letters, so the scores cannot rank the true class
+    evaluator.update({"response": "A. Preparation", "labels": "A. Preparation",
+                      "logprobs": {"content": [{"token": "A", "logprob": -0.1}]}})
+    assert evaluator.unscored == 1
+    assert 'top_k_accuracy' not in summarize_evaluator(evaluator)
+
+@pytest.mark.parametrize("record", [
+    {"images": ["/frames/VID01/000010.png"]},
+    {"images": [{"path": "/frames/VID01/000010.png", "bytes": None}]},
+    {"images": "/frames/VID01/000010.png"},
+    {"image_path": "/frames/VID01/000010.png"},
+])
+def test_group_by_video_image_shapes(record):
+    assert get_group_value(record, 'video') == 'VID01'
+
+def test_group_by_missing_values():
+    assert get_group_value({}, 'video') == MISSING_GROUP
+    assert get_group_value({"_source": {"dataset": "cholec80"}}, '_source.dataset') == 'cholec80'
+    assert get_group_value({"_source": {}}, '_source.dataset') == MISSING_GROUP
@@ -0,0 +1,40 @@
+import json
+
+from evaluate_batch import evaluate_batch, file_sha1, get_file_hash, load_cache
+
+def write_predictions(path, pairs):
+    path.write_text(''.join(json.dumps({'response': response, 'labels': label}) + '\n' for response, label in pairs))
+
+def test_file_hash_is_cached_by_size_and_mtime(tmp_path):
+    path = tmp_path / 'predictions.jsonl'
+    write_predictions(path, [('Preparation', 'Preparation')])
+    cache = load_cache(None)
+    assert get_file_hash(str(path), cache) == file_sha1(path)
+    cache['files'][str(path)]['sha1'] = 'stale'
+    assert get_file_hash(str(path), cache) == 'stale'
+
+def test_results_are_reused_until_the_file_changes(tmp_path, capsys):
+    path = tmp_path / 'checkpoint-100' / 'predictions.jsonl'
+    path.parent.mkdir()
+    write_predictions(path, [('Preparation', 'Preparation'), ('Preparation', 'ClippingCutting')])
+    cache_path = str(tmp_path / 'cache.json')
+    first = evaluate_batch([str(path)], workers=1, cache_path=cache_path)
+    assert first[str(path)]['accuracy'] == 0.5
+    assert '1 cached' not in capsys.readouterr().out
+
+    second = evaluate_batch([str(path)], workers=1, cache_path=cache_path)
+    assert second == first
+    assert '1 cached, 0 to evaluate' in capsys.readouterr().out
+
+    write_predictions(path, [('Preparation', 'Preparation')])
+    third = evaluate_batch([str(path)], workers=1, cache_path=cache_path)
+    assert third[str(path)]['accuracy'] == 1.0
+    assert '0 cached, 1 to evaluate' in capsys.readouterr().out
+    # A different normalization is a different result
+    evaluate_batch([str(path)], normalization='none', workers=1, cache_path=cache_path)
+    assert '0 cached, 1 to evaluate' in capsys.readouterr().out
+
+def test_cache_of_another_version_is_discarded(tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    cache_path.write_text(json.dumps({'version': 1, 'files': {'a': {}}, 'results': {'k': {}}}))
+    assert load_cache(str(cache_path))['results'] == {}
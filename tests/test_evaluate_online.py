@@ -0,0 +1,20 @@
+from evaluate_accuracy import StreamingEvaluator
+from evaluate_online import OnlineMonitor
+
+def make_monitor(records):
+    evaluator = StreamingEvaluator()
+    for i in range(records):
+        evaluator.update({'response': 'Preparation', 'labels': 'Preparation' if i % 2 else 'ClippingCutting'})
+    return OnlineMonitor(evaluator, every=10, min_records=10, stop_halfwidth=0.5)
+
+def test_snapshot_sets_the_stop_reason():
+    monitor = make_monitor(20)
+    assert 'stop' in monitor.snapshot()
+    assert monitor.stop_reason
+
+def test_final_snapshot_does_not_stop():
+    monitor = make_monitor(20)
+    snapshot = monitor.snapshot(check_stop=False)
+    assert 'stop' not in snapshot
+    assert monitor.stop_reason is None
+    assert snapshot['records'] == 20
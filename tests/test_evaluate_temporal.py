@@ -0,0 +1,44 @@
+import pytest
+
+from evaluate_accuracy import parse_normalization_args
+from evaluate_temporal import SequenceCollector, parse_filters, parse_frame_key
+
+@pytest.mark.parametrize("record, expected", [
+    ({"id": "01000025"}, ("01", 25)),
+    ({"id": "012000042"}, ("012", 42)),
+    ({"images": ["/frames/VID12/000042.png"]}, ("VID12", 42)),
+    ({"images": [{"path": "/frames/VID12/000042.png", "bytes": None}]}, ("VID12", 42)),
+    ({"image_path": "/autolaparo/frames_1fps/03/0007.jpg"}, ("03", 7)),
+    ({"images": ["/frames/VID12/cover.png"]}, None),
+    ({}, None),
+])
+def test_parse_frame_key(record, expected):
+    assert parse_frame_key(record) == expected
+
+def frame_record(frame, task, label, response):
+    return {"image_path": f"/frames/VID01/{frame:06d}.png", "_source": {"file": f"test_{task}.jsonl"},
+            "labels": label, "response": response}
+
+def make_collector(filters=None):
+    normalizer, _ = parse_normalization_args()
+    collector = SequenceCollector(normalizer=normalizer, filters=parse_filters(filters))
+    for frame in range(3):
+        collector.update(frame_record(frame, "mcq_phase", "A. Preparation", "A. Preparation"))
+        collector.update(frame_record(frame, "vqa_tool", "Grasper", "Hook"))
+    return collector
+
+def test_interleaved_tasks_are_an_error():
+    with pytest.raises(ValueError, match="3 records repeat"):
+        make_collector().sequences()
+
+def test_filter_keeps_one_task():
+    collector = make_collector(["_source.file=test_mcq_phase.jsonl"])
+    sequences = collector.sequences()
+    assert collector.filtered == 3
+    true_seq, pred_seq = sequences["VID01"]
+    assert len(true_seq) == 3 and (true_seq == pred_seq).all()
+
+def test_parse_filters():
+    assert parse_filters(["a.b=c=d"]) == [("a.b", "c=d")]
+    with pytest.raises(ValueError):
+        parse_filters(["no_value"])
@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+
+from evaluate_triplets import TripletVocabulary, evaluate_triplets
+
+MAPPING = {
+    'instrument': {'0': 'grasper', '1': 'bipolar', '2': 'hook', '3': 'clipper'},
+    'verb': {'0': 'grasp', '1': 'retract', '2': 'dissect', '3': 'clip'},
+    'target': {'0': 'gallbladder', '1': 'cystic_plate', '2': 'cystic_duct'},
+    'triplet': {'0': 'grasper,retract,gallbladder', '1': 'hook,dissect,cystic_plate',
+                '2': 'clipper,clip,cystic_duct', '3': 'hook,dissect,gallbladder'},
+}
+
+def test_multi_tool_answer():
+    vocabulary = TripletVocabulary(MAPPING)
+    labels, unknown = vocabulary.parse_answer("The tools are grasper, hook and clipper.")
+    assert labels == {'instrument': frozenset({0, 2, 3})}
+    assert unknown == 0
+
+    labels, unknown = vocabulary.parse_answer("The tools are grasper and scissors")
+    assert labels == {'instrument': frozenset({0})}
+    assert unknown == 1
+
+def test_multi_triplet_answer():
+    vocabulary = TripletVocabulary(MAPPING)
+    expected = {
+        'instrument': frozenset({0, 2}),
+        'verb': frozenset({1, 2}),
+        'target': frozenset({0, 1}),
+        'triplet': frozenset({0, 1}),
+    }
+    for answer in ("The complete surgical action is: grasper retract gallbladder and hook dissect cystic plate",
+                   "The complete surgical action is: grasper,retract,gallbladder; hook,dissect,cystic_plate",
+                   "[grasper]-[retract]-[gallbladder], [hook]-[dissect]-[cystic_plate]"):
+        assert vocabulary.parse_answer(answer) == (expected, 0), answer
+
+def write_records(path, records):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+def test_map_uses_scores_when_every_record_has_them(tmp_path):
+    vocabulary = TripletVocabulary(MAPPING)
+    records = [
+        {'response': 'The tools are grasper', 'labels': 'The tools are grasper',
+         'scores': {'grasper': 0.9, 'hook': 0.2}},
+        {'response': 'The tools are grasper', 'labels': 'The tools are hook',
+         'scores': {'grasper': 0.6, 'hook': 0.4}},
+        {'response': 'The tools are hook', 'labels': 'The tools are hook',
+         'scores': {'grasper': 0.1, 'hook': 0.8}},
+    ]
+    _, results = evaluate_triplets(write_records(tmp_path / 'scored.jsonl', records), vocabulary)
+    metrics = results['instrument']
+    assert metrics['map_source'] == 'scores'
+    # grasper ranks its only positive first; hook ranks (0.8 +, 0.4 +, 0.2 -)
+    assert np.isclose(metrics['class_metrics']['grasper']['ap'], 1.0)
+    assert np.isclose(metrics['class_metrics']['hook']['ap'], 1.0)
+
+    # One record without scores falls back to AP on the binary predictions
+    del records[1]['scores']
+    _, results = evaluate_triplets(write_records(tmp_path / 'binary.jsonl', records), vocabulary)
+    metrics = results['instrument']
+    assert metrics['map_source'] == 'binary'
+    # The missed hook record ties with the grasper ones at 0 and ranks last
+    assert np.isclose(metrics['class_metrics']['hook']['ap'], (1 + 2 / 3) / 2)
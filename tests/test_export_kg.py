@@ -0,0 +1,28 @@
+import json
+
+from export_kg import KG_FILE, SEGMENT, UnwindWriter, export, load_payloads
+from surgical_kg import ACTION, PHASE, SurgicalKG
+
+def write_meta(path):
+    records = [{"image_path": f"/autolaparo/frames_1fps/01/{f:04d}.jpg", "dataset": "autolaparo", "phase": phase}
+               for f, phase in enumerate(["Preparation"] * 3 + ["Dividing Ligament and Peritoneum"] * 2)]
+    records += [{"id": f"001{f:06d}", "dataset": "cholect50", "phase": "Preparation",
+                 "triplets": ["[grasper]-[retract]-[gallbladder]"]} for f in range(3)]
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+def test_export_upserts_on_knowledge_base_keys(tmp_path):
+    meta = tmp_path / 'meta.jsonl'
+    write_meta(meta)
+    payloads = tmp_path / 'payloads.jsonl'
+    kg = SurgicalKG.from_cypher(str(KG_FILE))
+    export([meta], UnwindWriter(payloads, batch_size=2), kg)
+
+    graph = load_payloads(payloads, SurgicalKG.from_cypher(str(KG_FILE)))
+    first = graph.summary()
+    # AutoLaparo phases are the existing nodes; other datasets get their own
+    assert len(graph.labels[PHASE]) == len(kg.labels[PHASE]) + 1
+    preparation = graph.nodes[graph.node(PHASE, 1)][1]
+    assert preparation['name'] == 'Preparation' and 'dataset' not in preparation
+    assert 'grasper,retract,gallbladder' in graph.index[(ACTION, 'name')]
+    assert len(graph.labels[SEGMENT]) == 4
+    assert load_payloads(payloads, graph).summary() == first
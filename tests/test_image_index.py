@@ -0,0 +1,25 @@
+import json
+
+from image_index import ImageIndex
+
+def build_index(tmp_path, images):
+    path = tmp_path / 'data.jsonl'
+    path.write_text(''.join(json.dumps({'id': i, 'images': image}) + '\n' for i, image in enumerate(images)))
+    return ImageIndex.build([str(path)])
+
+def test_batches_keep_the_batch_size(tmp_path):
+    index = build_index(tmp_path, [['a.jpg']] * 5 + [['b.jpg']] * 2)
+    sizes = [sum(len(records) for _, records in batch) for batch in index.iter_batches(3)]
+    assert sizes == [3, 3, 1]
+
+def test_split_groups_are_decoded_once(tmp_path):
+    index = build_index(tmp_path, [['a.jpg']] * 5 + [['b.jpg', 'c.jpg']] * 2 + [['a.jpg']])
+    loaded = []
+    def load_image(path):
+        loaded.append(path)
+        return path.upper()
+    records = list(index.iter_grouped_records(load_image, batch_size=2))
+    assert sorted(loaded) == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert sorted(record['id'] for record, _ in records) == list(range(8))
+    assert all(images == [path.upper() for path in record['images']] for record, images in records)
+    index.close()
@@ -0,0 +1,37 @@
+import json
+
+from merge_datasets import merge_datasets
+
+def write_ready(root, dataset, name, records=3):
+    ready = root / 'data_json' / dataset / 'ready'
+    ready.mkdir(parents=True, exist_ok=True)
+    record = {'images': [f'{dataset}/1.jpg'], 'messages': [{'role': 'user', 'content': 'q'}, {'role': 'assistant', 'content': 'a'}]}
+    (ready / name).write_text(''.join(json.dumps(record) + '\n' for _ in range(records)))
+    return ready / name
+
+def shard_files(root):
+    shard_dir = root / 'merged_data' / 'shards'
+    return sorted(str(path.relative_to(shard_dir)) for path in shard_dir.rglob('*') if path.is_file())
+
+def test_incremental_merge_removes_unreferenced_shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_ready(tmp_path, 'cholec80', 'train_vqa_phase.jsonl')
+    removed = write_ready(tmp_path, 'autolaparo', 'val_vqa_phase.jsonl')
+    merge_datasets()
+    assert shard_files(tmp_path) == ['autolaparo/val_vqa_phase.jsonl', 'autolaparo/val_vqa_phase.stats.json',
+                                     'cholec80/train_vqa_phase.jsonl', 'cholec80/train_vqa_phase.stats.json',
+                                     'manifest.json']
+    removed.unlink()
+    merge_datasets(incremental=True)
+    assert shard_files(tmp_path) == ['cholec80/train_vqa_phase.jsonl', 'cholec80/train_vqa_phase.stats.json', 'manifest.json']
+
+def test_changed_settings_remove_old_shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_ready(tmp_path, 'cholec80', 'train_vqa_phase.jsonl')
+    source = write_ready(tmp_path, 'autolaparo', 'val_vqa_phase.jsonl')
+    merge_datasets(seed=1)
+    source.unlink()
+    merge_datasets(incremental=True, seed=2)
+    assert shard_files(tmp_path) == ['cholec80/train_vqa_phase.jsonl', 'cholec80/train_vqa_phase.stats.json', 'manifest.json']
+    manifest = json.loads((tmp_path / 'merged_data' / 'shards' / 'manifest.json').read_text())
+    assert manifest['settings']['seed'] == 2
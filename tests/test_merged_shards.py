@@ -0,0 +1,65 @@
+import json
+import random
+
+import pytest
+
+from merged_shards import ShardWriter, assign_shards, consumer_records, iter_shard_records, shuffle_buffer
+
+def write_shards(tmp_path, records, shard_size):
+    writer = ShardWriter(tmp_path, shard_size)
+    for i in range(records):
+        # Uneven line lengths so byte balancing and record counts disagree
+        writer.write(json.dumps({'id': i, 'pad': 'x' * (i % 7) * 20}) + '\n')
+    return writer.close()
+
+def test_assign_shards_is_a_partition():
+    shards = [{'records': 10, 'bytes': b} for b in (900, 100, 500, 500, 300, 50, 50)]
+    for num_consumers in (1, 2, 3, 5, 9):
+        owned = [assign_shards(shards, c, num_consumers) for c in range(num_consumers)]
+        assert sorted(idx for indices in owned for idx in indices) == list(range(len(shards)))
+
+def test_consumer_records_is_the_largest_share():
+    shards = [{'records': 10, 'bytes': 1000}, {'records': 40, 'bytes': 1000}, {'records': 5, 'bytes': 10}]
+    assert consumer_records(shards, 1) == 55
+    assert consumer_records(shards, 2) == 40
+    assert consumer_records([], 4) == 0
+
+@pytest.mark.parametrize("records, shard_size, num_consumers", [(103, 10, 3), (50, 7, 4), (9, 4, 5), (1, 10, 2)])
+def test_every_consumer_yields_the_same_count(tmp_path, records, shard_size, num_consumers):
+    manifest = write_shards(tmp_path, records, shard_size)
+    target = consumer_records(manifest['shards'], num_consumers)
+    seen = set()
+    for consumer in range(num_consumers):
+        ids = [item['id'] for item in iter_shard_records(tmp_path, rank=consumer, world_size=num_consumers,
+                                                          worker_id=0, num_workers=1)]
+        assert len(ids) == target
+        seen.update(ids)
+    # Padding repeats records but never drops one
+    assert seen == set(range(records))
+
+def consumer_ids(path, consumer, num_consumers, **kwargs):
+    return [item['id'] for item in iter_shard_records(path, rank=consumer, world_size=num_consumers,
+                                                      worker_id=0, num_workers=1, **kwargs)]
+
+def test_shuffle_is_seeded_per_epoch(tmp_path):
+    write_shards(tmp_path, 200, 20)
+    ordered = consumer_ids(tmp_path, 0, 2)
+    epoch0 = consumer_ids(tmp_path, 0, 2, seed=1, epoch=0, buffer_size=16)
+    assert epoch0 == consumer_ids(tmp_path, 0, 2, seed=1, epoch=0, buffer_size=16)
+    assert epoch0 != consumer_ids(tmp_path, 0, 2, seed=1, epoch=1, buffer_size=16)
+    assert epoch0 != ordered
+    # Same records and count, only the order changes
+    assert sorted(epoch0) == sorted(ordered)
+
+def test_shuffle_mixes_shards(tmp_path):
+    manifest = write_shards(tmp_path, 200, 20)
+    ids = consumer_ids(tmp_path, 0, 1, seed=0, buffer_size=50)
+    shard_of = [i // 20 for i in ids]
+    # Without shuffling the first 20 records all come from one shard
+    assert len(set(shard_of[:20])) > 1
+    assert len(ids) == consumer_records(manifest['shards'], 1)
+
+def test_shuffle_buffer_keeps_every_item():
+    items = list(range(100))
+    shuffled = list(shuffle_buffer(iter(items), 10, random.Random(0)))
+    assert sorted(shuffled) == items and shuffled != items
@@ -0,0 +1,42 @@
+import numpy as np
+
+from extract_frames_balanced import read_phase_info
+from phase_segments import SegmentTable, run_lengths
+
+def test_run_lengths_sorts_frames():
+    labels, starts, ends = run_lengths([3, 0, 1, 2, 4, 5], ['b', 'a', 'a', 'b', 'b', 'a'])
+    assert labels.tolist() == ['a', 'b', 'a']
+    assert starts.tolist() == [0, 2, 5]
+    assert ends.tolist() == [1, 4, 5]
+
+def test_run_lengths_empty():
+    labels, starts, ends = run_lengths([], [])
+    assert len(labels) == len(starts) == len(ends) == 0
+
+def make_table(sequences):
+    return SegmentTable.from_sources({'cholec80': [(video, np.arange(len(names)), np.array(names)) for video, names in sequences]})
+
+def test_segment_queries():
+    table = make_table([('video01', ['Preparation'] * 3 + ['ClippingCutting'] * 2)])
+    assert table.segments('cholec80/video01') == [('Preparation', 0, 2), ('ClippingCutting', 3, 4)]
+    assert table.phase_at('cholec80/video01', 3) == 'ClippingCutting'
+    assert table.phase_at('cholec80/video01', 9) is None
+    assert table.frame_counts() == {'Preparation': 3, 'ClippingCutting': 2}
+
+def test_count_txt_round_trip(tmp_path, capsys):
+    table = make_table([('video01', ['Preparation'] * 3 + ['ClippingCutting'] * 2),
+                        ('video02', ['Preparation'] * 2 + ['CalotTriangleDissection'] * 4)])
+    path = tmp_path / 'count.txt'
+    assert table.write_count_txt(path, 'cholec80') == []
+    assert read_phase_info(path) == {
+        'video01': {'Preparation': (0, 2), 'ClippingCutting': (3, 4)},
+        'video02': {'Preparation': (0, 1), 'CalotTriangleDissection': (2, 5)},
+    }
+    assert 'Warning' not in capsys.readouterr().out
+
+def test_count_txt_warns_on_recurring_phases(tmp_path, capsys):
+    table = make_table([('video01', ['CleaningCoagulation'] * 2 + ['GallbladderPackaging'] * 2 + ['CleaningCoagulation'] * 2)])
+    path = tmp_path / 'count.txt'
+    assert table.write_count_txt(path, 'cholec80') == ['cholec80/video01']
+    assert read_phase_info(path)['video01'] == {'CleaningCoagulation': (0, 5), 'GallbladderPackaging': (2, 3)}
+    assert 'video01 has recurring phases (CleaningCoagulation)' in capsys.readouterr().out
@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import pytest
+
+from surgical_kg import INSTRUMENT, PHASE, SurgicalKG, split_statements
+
+CYPHER = """
+// Comments and quoted ';' do not end a statement
+CREATE CONSTRAINT testlap_phase_id IF NOT EXISTS ON (p:TestlapPhase) ASSERT p.id IS UNIQUE;
+CREATE CONSTRAINT testlap_instrument_id IF NOT EXISTS ON (i:TestlapInstrument) ASSERT i.id IS UNIQUE;
+
+CREATE (:TestlapInstrument {id: 1, name: "Grasping forceps", combo_instruments: [2, 3], description: "jaws; 5mm"}),
+       (:TestlapInstrument {id: 2, name: "Ultrasonic scalpel", combo_instruments: []}),
+       (:TestlapInstrument {id: 3, name: "Suction", combo_instruments: [1, 9]}),
+       (:TestlapInstrument {id: 4, name: "Grasper", combo_instruments: []});
+CREATE (:TestlapPhase {id: 1, name: "Preparation", order: 1}),
+       (:TestlapPhase {id: 2, name: "Dissection", order: 2}),
+       (:TestlapPhase {id: 3, name: "Closure", order: 3});
+CREATE (:TestlapAction {name: "Lift tissue"});
+
+MATCH (p:TestlapPhase), (i:TestlapInstrument)
+WHERE p.id IN [1, 2] AND i.id <= 2
+CREATE (p)-[:TESTLAP_USES_INSTRUMENT]->(i);
+MATCH (p:TestlapPhase {id: 3}), (i:TestlapInstrument {name: "Suction"})
+CREATE (p)-[:TESTLAP_USES_INSTRUMENT {main: true}]->(i);
+MATCH (p1:TestlapPhase {id: 1}), (p2:TestlapPhase {id: 2})
+CREATE (p1)-[:TESTLAP_PHASE_SEQUENCE {type: "NEXT_PHASE"}]->(p2),
+       (p2)-[:TESTLAP_PHASE_SEQUENCE {type: "PREVIOUS_PHASE"}]->(p1);
+MATCH (p2:TestlapPhase {id: 2}), (p3:TestlapPhase {id: 3})
+CREATE (p2)-[:TESTLAP_PHASE_SEQUENCE {type: "NEXT_PHASE"}]->(p3),
+       (p3)-[:TESTLAP_PHASE_SEQUENCE {type: "PREVIOUS_PHASE"}]->(p2);
+MATCH (a:TestlapAction {name: "Lift tissue"}), (p:TestlapPhase {id: 1})
+CREATE (p)<-[:TESTLAP_BELONGS_TO]-(a);
+MATCH (a:TestlapInstrument {id: 4}), (b:TestlapInstrument {id: 1})
+CREATE (a)-[:TESTLAP_SYNONYM_OF]->(b)
+"""
+
+def test_split_statements_ignores_comments_and_quoted_separators():
+    statements = split_statements('// a; b\nCREATE (:X {name: "a;b"});\nCREATE (:Y {name: \'c\\\'d;\'})')
+    assert statements == ['CREATE (:X {name: "a;b"})', "CREATE (:Y {name: 'c\\'d;'})"]
+
+def test_parses_nodes_and_properties():
+    graph = SurgicalKG.from_cypher_text(CYPHER)
+    counts, edges = graph.summary()
+    assert counts == {INSTRUMENT: 4, PHASE: 3, 'TestlapAction': 1}
+    assert edges == {'TESTLAP_USES_INSTRUMENT': 5, 'TESTLAP_PHASE_SEQUENCE': 4,
+                     'TESTLAP_BELONGS_TO': 1, 'TESTLAP_SYNONYM_OF': 1}
+    forceps = graph.props(graph.node(INSTRUMENT, 'grasping  FORCEPS'))
+    assert forceps['description'] == 'jaws; 5mm'
+    assert forceps['combo_instruments'] == [2, 3]
+    assert graph.node(INSTRUMENT, 1) == graph.node(INSTRUMENT, 'Grasping forceps')
+    with pytest.raises(KeyError):
+        graph.node(PHASE, 'Unknown')
+
+def test_where_and_relationship_directions():
+    graph = SurgicalKG.from_cypher_text(CYPHER)
+    assert graph.instruments_in_phase('Preparation') == ['Grasping forceps', 'Ultrasonic scalpel']
+    assert graph.instruments_in_phase(3) == ['Suction']
+    # '<-' stores the edge from the arrow's tail
+    assert graph.actions_in_phase('Preparation') == ['Lift tissue']
+    assert graph.synonyms('Grasping forceps') == ['Grasper']
+    assert graph.edge_props(graph.node(PHASE, 3), 'TESTLAP_USES_INSTRUMENT') == [
+        (graph.node(INSTRUMENT, 'Suction'), {'main': True})]
+
+def test_phase_and_instrument_queries():
+    graph = SurgicalKG.from_cypher_text(CYPHER)
+    assert graph.phase_order() == ['Preparation', 'Dissection', 'Closure']
+    assert graph.next_phase('Dissection') == 'Closure'
+    assert graph.previous_phase('Preparation') is None
+    assert graph.is_valid_instrument('Dissection', 'Ultrasonic scalpel')
+    assert not graph.is_valid_instrument('Closure', 2)
+    assert graph.phases_with_instruments([1, 'Ultrasonic scalpel']) == ['Preparation', 'Dissection']
+    assert graph.phases_within_instruments(['Suction', 'Grasper']) == ['Closure']
+    # Ids without a node are dropped from combo lists
+    assert graph.combo_instruments('Suction') == ['Grasping forceps']
+
+def test_unique_constraint_and_unsupported_syntax():
+    with pytest.raises(ValueError, match='Duplicate'):
+        SurgicalKG.from_cypher_text(CYPHER + ';\nCREATE (:TestlapPhase {id: 2, name: "Again"})')
+    with pytest.raises(ValueError, match='Unsupported'):
+        SurgicalKG.from_cypher_text('MERGE (:TestlapPhase {id: 1})')
+
+def test_loads_the_shipped_cypher():
+    graph = SurgicalKG.from_cypher(str(Path(__file__).resolve().parents[1] / 'testlap_data.cypher'))
+    order = graph.phase_order()
+    assert len(order) == len(graph.labels[PHASE])
+    assert all(graph.instruments_in_phase(phase) for phase in order)
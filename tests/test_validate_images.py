@@ -0,0 +1,33 @@
+import cv2
+import numpy as np
+import pytest
+
+from validate_images import OK, read_image_header
+
+@pytest.fixture
+def image():
+    return np.zeros((30, 40, 3), dtype=np.uint8)
+
+@pytest.mark.parametrize("suffix, fmt", [('.jpg', 'jpeg'), ('.png', 'png')])
+def test_complete_image(tmp_path, image, suffix, fmt):
+    path = tmp_path / f'frame{suffix}'
+    cv2.imwrite(str(path), image)
+    assert read_image_header(str(path)) == (OK, 40, 30, fmt)
+
+@pytest.mark.parametrize("suffix, fmt", [('.jpg', 'jpeg'), ('.png', 'png')])
+def test_truncated_image(tmp_path, image, suffix, fmt):
+    path = tmp_path / f'frame{suffix}'
+    cv2.imwrite(str(path), image)
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) - 20])
+    assert read_image_header(str(path)) == ('truncated', 40, 30, fmt)
+
+def test_bad_files(tmp_path):
+    (tmp_path / 'empty.jpg').write_bytes(b'')
+    (tmp_path / 'text.jpg').write_bytes(b'not an image')
+    (tmp_path / 'corrupt.jpg').write_bytes(b'\xff\xd8\xff\xd9')
+    assert read_image_header('') == ('empty_path', None, None, None)
+    assert read_image_header(str(tmp_path / 'missing.jpg')) == ('missing', None, None, None)
+    assert read_image_header(str(tmp_path / 'empty.jpg')) == ('empty', None, None, None)
+    assert read_image_header(str(tmp_path / 'text.jpg')) == ('unknown_format', None, None, None)
+    assert read_image_header(str(tmp_path / 'corrupt.jpg')) == ('corrupt', None, None, 'jpeg')
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import struct
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from dedup_datasets import get_image_paths
+
+CACHE_VERSION = 1
+HEADER_BYTES = 64 * 1024
+TAIL_BYTES = 32
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start-of-frame markers carrying the image size (not DHT/JPG/DAC)
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+OK = 'ok'
+
+def parse_jpeg(header):
+    """(width, height) from the first SOF segment of a JPEG header, or None"""
+    pos = 2
+    while pos + 4 <= len(header):
+        if header[pos] != 0xFF:
+            return None
+        marker = header[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        (length,) = struct.unpack('>H', header[pos + 2:pos + 4])
+        if marker in JPEG_SOF:
+            if pos + 9 > len(header):
+                return None
+            height, width = struct.unpack('>HH', header[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+def parse_png(header):
+    """(width, height) from the IHDR chunk of a PNG header, or None"""
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+def read_image_header(path):
+    """
+    Check one image by reading only its header and last bytes. Returns
+    (status, width, height, format); status is 'ok', 'empty_path', 'missing',
+    'empty', 'unknown_format', 'corrupt' (no size in the header) or
+    'truncated' (JPEG without EOI, PNG without IEND).
+    """
+    if not path:
+        return 'empty_path', None, None, None
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return 'empty', None, None, None
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_BYTES)
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read(TAIL_BYTES)
+    except FileNotFoundError:
+        return 'missing', None, None, None
+    except OSError:
+        return 'corrupt', None, None, None
+
+    if header[:2] == b'\xff\xd8':
+        fmt, dims, complete = 'jpeg', parse_jpeg(header), b'\xff\xd9' in tail
+    elif header[:8] == PNG_SIGNATURE:
+        fmt, dims, complete = 'png', parse_png(header), tail[-12:-4] == b'\x00\x00\x00\x00IEND'
+    else:
+        return 'unknown_format', None, None, None
+    if dims is None or 0 in dims:
+        return 'corrupt', None, None, fmt
+    if not complete:
+        return 'truncated', dims[0], dims[1], fmt
+    return OK, dims[0], dims[1], fmt
+
+class HeaderCache:
+    """Scan results keyed by path, reused while the file's size and mtime are unchanged"""
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}  # path -> [size, mtime_ns, status, width, height, format]
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('version') == CACHE_VERSION:
+                self.entries = cache['entries']
+
+    @staticmethod
+    def stat(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime_ns
+        except (OSError, ValueError):
+            return None
+
+    def lookup(self, path, stat):
+        entry = self.entries.get(path)
+        if entry is not None and stat is not None and entry[:2] == list(stat):
+            return tuple(entry[2:])
+        return None
+
+    def scan(self, path):
+        stat = self.stat(path) if path else None
+        cached = self.lookup(path, stat)
+        if cached is not None:
+            return path, cached, True
+        result = read_image_header(path)
+        if stat is not None:
+            self.entries[path] = [*stat, *result]
+        return path, result, False
+
+    def save(self):
+        if self.path:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'entries': self.entries}, f)
+            os.replace(tmp, self.path)
+
+def iter_references(input_files):
+    """Yield (file, line number, image path) for every image reference; records without images give ''"""
+    for input_file in input_files:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                for path in get_image_paths(json.loads(line)) or ['']:
+                    yield input_file, line_number, path
+
+def validate(input_files, workers=16, cache=None):
+    """Scan every unique image of the inputs; returns ({path: (status, width, height, format)}, reused count)"""
+    cache = cache or HeaderCache()
+    paths = list(dict.fromkeys(path for _, _, path in iter_references(input_files)))
+    results = {}
+    reused = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, result, from_cache in executor.map(cache.scan, paths, chunksize=256):
+            results[path] = result
+            reused += from_cache
+    return results, reused
+
+def write_dims_table(results, path):
+    """JSONL of (path, width, height, format) for readable images, as read by compute_token_lengths --dims_table"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for image, (status, width, height, fmt) in results.items():
+            if status == OK:
+                f.write(json.dumps({'path': image, 'width': width, 'height': height, 'format': fmt}, ensure_ascii=False) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the images referenced by JSONL files exist and are complete, reading only headers')
+    parser.add_argument('inputs', nargs='+', help='Task or merged JSONL files (images or image_path fields)')
+    parser.add_argument('--workers', type=int, default=16, help='Header reading threads (default: 16)')
+    parser.add_argument('--cache', default='image_header_cache.json', help="Scan cache keyed by path, size and mtime (default: image_header_cache.json, '' to disable)")
+    parser.add_argument('--dims_table', default=None, help='Write a (path, width, height) JSONL table of readable images')
+    parser.add_argument('--report', default=None, help='Write one JSONL line per record referencing a bad image (file, line, path, status)')
+    args = parser.parse_args()
+
+    cache = HeaderCache(args.cache or None)
+    results, reused = validate(args.inputs, args.workers, cache)
+    cache.save()
+
+    statuses = Counter(result[0] for result in results.values())
+    formats = Counter(result[3] for result in results.values() if result[0] == OK)
+    print(f"Unique images: {len(results)} ({reused} from cache)")
+    for status, count in statuses.most_common():
+        print(f"  {status}: {count}")
+    if formats:
+        print("Formats: " + ", ".join(f"{fmt} {count}" for fmt, count in formats.most_common()))
+
+    bad_records = 0
+    if statuses[OK] != len(results):
+        report = open(args.report, 'w', encoding='utf-8') if args.report else None
+        for input_file, line_number, path in iter_references(args.inputs):
+            status = results[path][0]
+            if status == OK:
+                continue
+            bad_records += 1
+            if report:
+                report.write(json.dumps({'file': input_file, 'line': line_number, 'path': path, 'status': status}, ensure_ascii=False) + '\n')
+            elif bad_records <= 10:
+                print(f"  {input_file}:{line_number} {status} {path!r}")
+        if report:
+            report.close()
+            print(f"Bad references saved to {args.report}")
+    print(f"Bad image references: {bad_records}")
+    if args.dims_table:
+        write_dims_table(results, args.dims_table)
+        print(f"Dimension table saved to {args.dims_table}")
+
+if __name__ == '__main__':
+    main()